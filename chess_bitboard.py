@@ -0,0 +1,393 @@
+"""This file contains a bitboard version of the position, the core of the engine's move generation. Each piece type of
+each colour gets its own 64-bit integer with one bit per square (bit row * 8 + col, so bit 0 is the top-left square,
+matching the (row, col) squares used everywhere else). Where a piece can go is worked out once, when the module is
+imported: the knight, king and pawn attacks from every square are stored in tables, and so are the rays running out
+from every square in each of the eight directions. A sliding piece's attacks along a ray are the ray up to and including
+the first piece in the way, which we find with a single bit operation instead of walking the squares one by one.
+
+GameState keeps a BitboardPosition in step with its mailbox, square by square as moves are made and taken back, and
+gets its moves (legal_moves(), pseudo_legal_moves() and has_legal_move()) and its attack and check tests from it.
+
+Running this file replays random games and checks, position by position, that the bitboard move generator agrees
+with the chess_pieces rules and that GameState's bitboards agree with a position built afresh from its board, eg.
+'python chess_bitboard.py 200'. test_bitboard.py runs the same check on a few games, and the perft reference counts,
+under pytest."""
+
+import random
+import sys
+
+from chess_board import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, board_indices, coordinates, \
+    square_numbers, WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE, CASTLING, EN_PASSANT, \
+    DOUBLE_PUSH, pack_move
+from chess_pieces import piece_rules_allow
+
+# The steps (row, col) for each piece. The first four sliding directions are the rook's and the last four the bishop's.
+knight_steps = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+king_steps = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+directions = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+# A ray runs towards higher square numbers if it goes down the board, or to the right along a row. For those the
+# nearest piece in the way is the lowest set bit of the blockers, and for the others it is the highest.
+increasing_directions = frozenset(number for number, (row_step, col_step) in enumerate(directions)
+                                  if row_step > 0 or (row_step == 0 and col_step > 0))
+
+full_board = (1 << 64) - 1
+row_bitboards = [0xFF << row * 8 for row in range(8)]
+left_column = sum(1 << row * 8 for row in range(8))
+right_column = left_column << 7
+last_row_of = {WHITE: row_bitboards[0], BLACK: row_bitboards[7]}
+
+
+# The step_table() function builds, for every square, a bitboard of the squares reached by taking one of the steps.
+def step_table(steps):
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        attacks = 0
+        for row_step, col_step in steps:
+            r, c = row + row_step, col + col_step
+            if 0 <= r < 8 and 0 <= c < 8:
+                attacks |= 1 << (r * 8 + c)
+        table.append(attacks)
+    return table
+
+
+# The ray_table() function builds, for every direction and every square, a bitboard of all the squares from that
+# square (not included) to the edge of the board.
+def ray_table():
+    table = []
+    for row_step, col_step in directions:
+        rays = []
+        for square in range(64):
+            row, col = divmod(square, 8)
+            ray = 0
+            r, c = row + row_step, col + col_step
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray |= 1 << (r * 8 + c)
+                r, c = r + row_step, c + col_step
+            rays.append(ray)
+        table.append(rays)
+    return table
+
+
+knight_attacks = step_table(knight_steps)
+king_attacks = step_table(king_steps)
+# pawn_attacks[WHITE] gives the squares a white pawn attacks (up the board) and pawn_attacks[BLACK] a black pawn's.
+pawn_attacks = {WHITE: step_table(((-1, -1), (-1, 1))), BLACK: step_table(((1, -1), (1, 1)))}
+rays = ray_table()
+
+
+# The ray_attacks() function returns the squares a slider attacks along one ray, given the occupied squares. If a
+# piece is in the way, everything beyond it (its own ray in the same direction) is removed.
+def ray_attacks(square, direction, occupied):
+    ray = rays[direction][square]
+    blockers = ray & occupied
+    if blockers:
+        if direction in increasing_directions:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= rays[direction][blocker]
+    return ray
+
+
+# slider_rays[square] lists, for each of the rook's and then the bishop's directions, the ray from the square, the ray
+# table for that direction and whether the ray runs towards higher square numbers, so that rook_attacks() and
+# bishop_attacks() can do the work of ray_attacks() for all four directions in one loop. They are called for every
+# slider in every position, so saving the function call per ray matters.
+slider_rays = [[(rays[direction][square], rays[direction], direction in increasing_directions)
+                for direction in range(8)] for square in range(64)]
+rook_rays = [square_rays[:4] for square_rays in slider_rays]
+bishop_rays = [square_rays[4:] for square_rays in slider_rays]
+
+
+def rook_attacks(square, occupied):
+    attacks = 0
+    for ray, beyond, increasing in rook_rays[square]:
+        blockers = ray & occupied
+        if blockers:
+            ray ^= beyond[(blockers & -blockers).bit_length() - 1 if increasing else blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(square, occupied):
+    attacks = 0
+    for ray, beyond, increasing in bishop_rays[square]:
+        blockers = ray & occupied
+        if blockers:
+            ray ^= beyond[(blockers & -blockers).bit_length() - 1 if increasing else blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+# The squares_of() function returns the square number of each set bit in a bitboard, lowest first.
+def squares_of(bitboard):
+    squares = []
+    while bitboard:
+        lowest = bitboard & -bitboard
+        squares.append(lowest.bit_length() - 1)
+        bitboard ^= lowest
+    return squares
+
+
+# Castling rights use the same bits as GameState. Each entry lists the right, the king's start and end squares, the
+# rook's start and end squares, the squares that must be empty and the square the king passes over.
+castling_moves = {
+    WHITE: ((WHITE_KINGSIDE, 60, 62, 63, 61, (61, 62), 61), (WHITE_QUEENSIDE, 60, 58, 56, 59, (57, 58, 59), 59)),
+    BLACK: ((BLACK_KINGSIDE, 4, 6, 7, 5, (5, 6), 5), (BLACK_QUEENSIDE, 4, 2, 0, 3, (1, 2, 3), 3))
+}
+# Moving a piece from or to one of these squares loses the matching castling rights for good.
+castling_squares = {60: WHITE_KINGSIDE | WHITE_QUEENSIDE, 63: WHITE_KINGSIDE, 56: WHITE_QUEENSIDE,
+                    4: BLACK_KINGSIDE | BLACK_QUEENSIDE, 7: BLACK_KINGSIDE, 0: BLACK_QUEENSIDE}
+
+
+class BitboardPosition:
+    # A position is made up of one bitboard per piece code (indexed the same way as the chess_board codes), an
+    # occupancy bitboard per colour, a 64-square list of piece codes for finding out what stands on a square, the side
+    # to move, the castling rights and the en passant square (a square number, or None). Moves are packed integers in
+    # the same format GameState uses (see chess_board.pack_move).
+    def __init__(self):
+        self.pieces = [0] * (BLACK | KING + 1)
+        self.occupancy = {WHITE: 0, BLACK: 0}
+        self.squares = [EMPTY] * 64
+        self.side = WHITE
+        self.castling = 0
+        self.en_passant = None
+        self.undo_stack = []
+
+    # The from_game_state() method builds a bitboard position from a GameState, including its side to move, castling
+    # rights and en passant square.
+    @classmethod
+    def from_game_state(cls, game):
+        position = cls()
+        for square, index in enumerate(board_indices):
+            code = game.squares[index]
+            if code != EMPTY:
+                position.place(square, code)
+        position.side = WHITE if game.turn == 'W' else BLACK
+        position.castling = game.castling
+        position.en_passant = square_numbers[game.en_passant]
+        return position
+
+    def place(self, square, code):
+        bit = 1 << square
+        self.pieces[code] |= bit
+        self.occupancy[code & BLACK] |= bit
+        self.squares[square] = code
+
+    def remove(self, square):
+        code = self.squares[square]
+        bit = 1 << square
+        self.pieces[code] ^= bit
+        self.occupancy[code & BLACK] ^= bit
+        self.squares[square] = EMPTY
+        return code
+
+    # The attacked() method returns True if any piece of the given colour attacks the square. Rather than asking every
+    # enemy piece, we look outward from the square: a knight, king or pawn attacks it if one stands on a square that the
+    # same piece would attack from here, and a slider does if it is on one of the square's unblocked rays.
+    def attacked(self, square, colour):
+        pieces = self.pieces
+        if knight_attacks[square] & pieces[colour | KNIGHT] or king_attacks[square] & pieces[colour | KING]:
+            return True
+        if pawn_attacks[colour ^ BLACK][square] & pieces[colour | PAWN]:
+            return True
+        # A slider only matters if it is on one of the square's rays, and then only if it is the nearest piece there
+        occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        queens = pieces[colour | QUEEN]
+        for sliders, square_rays in ((pieces[colour | ROOK] | queens, rook_rays[square]),
+                                     (pieces[colour | BISHOP] | queens, bishop_rays[square])):
+            if sliders:
+                for ray, _, increasing in square_rays:
+                    if ray & sliders:
+                        blockers = ray & occupied
+                        nearest = blockers & -blockers if increasing else 1 << blockers.bit_length() - 1
+                        if nearest & sliders:
+                            return True
+        return False
+
+    def in_check(self, colour):
+        king = self.pieces[colour | KING]
+        return bool(king) and self.attacked(king.bit_length() - 1, colour ^ BLACK)
+
+    # The pseudo_legal_moves() method generates the moves for the side to move from the attack tables, one piece type
+    # at a time, without checking whether they leave the king in check. With noisy True only captures, en passant and
+    # promotions are generated (for a quiescence search), which the bitboards do by masking the destination squares.
+    def pseudo_legal_moves(self, noisy=False):
+        side, enemy = self.side, self.side ^ BLACK
+        pieces = self.pieces
+        own = self.occupancy[side]
+        occupied = own | self.occupancy[enemy]
+        empty = ~occupied & full_board
+        moves = []
+
+        # Pawns are moved all at once by shifting the pawn bitboard a row forward (and a column sideways to capture,
+        # leaving out the pawns on the edge column they would wrap around from). back is what takes a target square
+        # back to the pawn's origin.
+        pawns = pieces[side | PAWN]
+        enemies = self.occupancy[enemy]
+        last_row = last_row_of[side]
+        if noisy:
+            empty &= last_row  # Only pushes that promote
+        if side == WHITE:
+            single = pawns >> 8 & empty
+            double = (single & row_bitboards[5]) >> 8 & empty
+            back = 8
+            pawn_targets = ((single, 8), ((pawns & ~left_column) >> 9 & enemies, 9),
+                            ((pawns & ~right_column) >> 7 & enemies, 7))
+        else:
+            single = pawns << 8 & empty
+            double = (single & row_bitboards[2]) << 8 & empty
+            back = -8
+            pawn_targets = ((single, -8), ((pawns & ~left_column) << 7 & enemies & full_board, -7),
+                            ((pawns & ~right_column) << 9 & enemies & full_board, -9))
+        for targets, back_step in pawn_targets:
+            moves += [target + back_step | target << 6 for target in squares_of(targets & ~last_row)]
+            for target in squares_of(targets & last_row):
+                moves.extend(pack_move(target + back_step, target, promotion)
+                             for promotion in (QUEEN, ROOK, BISHOP, KNIGHT))
+        for target in squares_of(double):
+            moves.append(pack_move(target + 2 * back, target, EMPTY, DOUBLE_PUSH))
+        if self.en_passant is not None:
+            for square in squares_of(pawn_attacks[enemy][self.en_passant] & pawns):
+                moves.append(pack_move(square, self.en_passant, EMPTY, EN_PASSANT))
+
+        # An ordinary move packs to origin | destination << 6 (see chess_board.pack_move), written out here for speed
+        targets = enemies if noisy else ~own & full_board
+        for square in squares_of(pieces[side | KNIGHT]):
+            moves += [square | target << 6 for target in squares_of(knight_attacks[square] & targets)]
+        for square in squares_of(pieces[side | BISHOP] | pieces[side | QUEEN]):
+            moves += [square | target << 6 for target in squares_of(bishop_attacks(square, occupied) & targets)]
+        for square in squares_of(pieces[side | ROOK] | pieces[side | QUEEN]):
+            moves += [square | target << 6 for target in squares_of(rook_attacks(square, occupied) & targets)]
+        for square in squares_of(pieces[side | KING]):
+            moves += [square | target << 6 for target in squares_of(king_attacks[square] & targets)]
+
+        for right, king_start, king_end, rook_start, rook_end, between, passed in castling_moves[side]:
+            if not noisy and self.castling & right and self.squares[rook_start] == side | ROOK and \
+                    self.squares[king_start] == side | KING and \
+                    all(self.squares[square] == EMPTY for square in between) and \
+                    not self.attacked(king_start, enemy) and not self.attacked(passed, enemy):
+                moves.append(pack_move(king_start, king_end, EMPTY, CASTLING))
+        return moves
+
+    # The make() method plays a packed move, pushing what unmake() needs to take it back.
+    def make(self, move):
+        origin, destination, promotion, flag = move & 63, move >> 6 & 63, move >> 12 & 7, move >> 15
+        capture_square = destination
+        if flag == EN_PASSANT:
+            capture_square = destination + 8 if self.side == WHITE else destination - 8
+        captured = self.squares[capture_square]
+        if captured != EMPTY:
+            self.remove(capture_square)
+        code = self.remove(origin)
+        self.undo_stack.append((move, code, captured, capture_square, self.castling, self.en_passant))
+        self.place(destination, code & BLACK | promotion if promotion else code)
+        if flag == CASTLING:
+            rook_start, rook_end = (origin + 3, origin + 1) if destination > origin else (origin - 4, origin - 1)
+            self.place(rook_end, self.remove(rook_start))
+        self.castling &= ~(castling_squares.get(origin, 0) | castling_squares.get(destination, 0))
+        self.en_passant = (origin + destination) // 2 if flag == DOUBLE_PUSH else None
+        self.side ^= BLACK
+
+    def unmake(self):
+        move, code, captured, capture_square, self.castling, self.en_passant = self.undo_stack.pop()
+        origin, destination, flag = move & 63, move >> 6 & 63, move >> 15
+        self.side ^= BLACK
+        self.remove(destination)
+        self.place(origin, code)
+        if captured != EMPTY:
+            self.place(capture_square, captured)
+        if flag == CASTLING:
+            rook_start, rook_end = (origin + 3, origin + 1) if destination > origin else (origin - 4, origin - 1)
+            self.place(rook_start, self.remove(rook_end))
+
+    # The legal_moves() method keeps the pseudo-legal moves that don't leave the mover's own king in check.
+    def legal_moves(self):
+        side = self.side
+        legal = []
+        for move in self.pseudo_legal_moves():
+            self.make(move)
+            if not self.in_check(side):
+                legal.append(move)
+            self.unmake()
+        return legal
+
+    # The has_legal_move() method returns True if the side to move has a legal move, stopping at the first one found.
+    # The king's steps are tried before generating everything, since one of them is usually legal.
+    def has_legal_move(self):
+        side = self.side
+        king_steps = []
+        if self.pieces[side | KING]:
+            king = self.pieces[side | KING].bit_length() - 1
+            king_steps = [king | target << 6 for target in squares_of(king_attacks[king] & ~self.occupancy[side])]
+        return self.any_legal(king_steps) or self.any_legal(self.pseudo_legal_moves())
+
+    # The any_legal() method returns True if any of the moves doesn't leave the mover's own king in check.
+    def any_legal(self, moves):
+        side = self.side
+        for move in moves:
+            self.make(move)
+            safe = not self.in_check(side)
+            self.unmake()
+            if safe:
+                return True
+        return False
+
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        moves = self.legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.make(move)
+            nodes += self.perft(depth - 1)
+            self.unmake()
+        return nodes
+
+
+# The cross_check() function plays random games with GameState and, in every position reached, compares the legal
+# moves found by a bitboard position built afresh from the board with the moves GameState.legal_moves() finds from the
+# bitboards it keeps up to date move by move, and with every (origin, destination) pair the chess_pieces rules accept.
+# It returns a list of (position, differences) for any disagreements.
+def cross_check(games=20, seed=0, max_moves=200):
+    from chess_game_state import GameState  # GameState is built on this module, so it can't be imported at the top
+
+    generator = random.Random(seed)
+    problems = []
+    for _ in range(games):
+        game = GameState()
+        for _ in range(max_moves):
+            position = BitboardPosition.from_game_state(game)
+            bitboard_moves = set(position.legal_moves())
+            game_state_moves = set(game.legal_moves())
+            # The piece classes don't know about promotion pieces, so they are compared on squares alone
+            bitboard_squares = {(coordinates[board_indices[move & 63]], coordinates[board_indices[move >> 6 & 63]])
+                                for move in bitboard_moves}
+            piece_rule_squares = {(origin, destination) for origin in coordinates if origin
+                                  for destination in coordinates if destination
+                                  if piece_rules_allow(game, origin, destination)}
+            if bitboard_moves != game_state_moves or bitboard_squares != piece_rule_squares:
+                problems.append(([list(row) for row in game.board], game.turn, {
+                    'GameState only': sorted(game_state_moves - bitboard_moves),
+                    'bitboards only': sorted(bitboard_moves - game_state_moves),
+                    'chess_pieces only': sorted(piece_rule_squares - bitboard_squares),
+                    'not allowed by chess_pieces': sorted(bitboard_squares - piece_rule_squares)}))
+                break
+            if not bitboard_moves:
+                break
+            game.play(generator.choice(sorted(bitboard_moves)))
+    return problems
+
+
+if __name__ == '__main__':
+    differences = cross_check(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
+    for board, colour, difference in differences:
+        print('\n'.join(' '.join(row) for row in board))
+        print(colour, 'to move:', difference)
+    print(f'{len(differences)} disagreements found')
+    if differences:
+        sys.exit(1)
@@ -0,0 +1,141 @@
+"""This file contains the integer-coded board representation that GameState keeps internally. The board is stored as a
+flat 10x12 'mailbox' bytearray: the 8x8 board sits in the middle, surrounded by two rows of off-board squares above
+and below and one column on each side. Because stepping off the edge of the board always lands on an OFF_BOARD
+square, code that steps from square to square never needs to check whether a row or column is still in range (moves
+themselves are generated from bitboards, see chess_bitboard). Each piece is a small integer made of a colour bit and
+a piece type, so testing a square is a single integer comparison rather than a string comparison. The board_rows()
+function turns the mailbox back into the familiar 2D list of piece codes (eg. 'BQ') for code such as the renderer and
+the chess_pieces rules, which still work in (row, col) terms."""
+
+# Piece types take up the lowest three bits of a square's code and the colour the next bit up, so code & 7 gives the
+# piece type and code & 8 the colour. Empty squares are 0 and squares off the edge of the board have their own code.
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 8
+OFF_BOARD = 16
+
+piece_codes = {
+    '~~': EMPTY,
+    'WP': WHITE | PAWN,
+    'WN': WHITE | KNIGHT,
+    'WB': WHITE | BISHOP,
+    'WR': WHITE | ROOK,
+    'WQ': WHITE | QUEEN,
+    'WK': WHITE | KING,
+    'BP': BLACK | PAWN,
+    'BN': BLACK | KNIGHT,
+    'BB': BLACK | BISHOP,
+    'BR': BLACK | ROOK,
+    'BQ': BLACK | QUEEN,
+    'BK': BLACK | KING
+}
+
+# piece_names maps a square's code back to its piece code, so piece_names[code] is the reverse of piece_codes.
+piece_names = ['~~'] * (OFF_BOARD + 1)
+for name, code in piece_codes.items():
+    piece_names[code] = name
+
+# fen_pieces maps the letters used for pieces in FEN strings (upper case for White, lower case for Black) to piece
+# codes.
+fen_pieces = {letter: ('W' if letter.isupper() else 'B') + letter.upper() for letter in 'PNBRQKpnbrqk'}
+
+# The square_index() function converts a (row, col) square into its index in the mailbox.
+def square_index(row, col):
+    return 21 + row * 10 + col
+
+
+# board_indices lists the mailbox index of each of the 64 squares on the board, in the same order as the 2D list, so
+# board_indices[row * 8 + col] is the index of (row, col). coordinates maps a mailbox index back to its (row, col)
+# square and square_numbers to its square number row * 8 + col (None for off-board squares in both).
+board_indices = tuple(square_index(row, col) for row in range(8) for col in range(8))
+coordinates = [None] * 120
+square_numbers = [None] * 120
+for row in range(8):
+    for col in range(8):
+        coordinates[square_index(row, col)] = (row, col)
+        square_numbers[square_index(row, col)] = row * 8 + col
+
+# Castling rights are stored as four bits in a single integer. Any move from or to a king's or rook's starting square
+# clears the rights that depend on that piece, which is done by and-ing the rights with the square's mask.
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+castling_rights = {
+    ('W', 'Kingside'): WHITE_KINGSIDE,
+    ('W', 'Queenside'): WHITE_QUEENSIDE,
+    ('B', 'Kingside'): BLACK_KINGSIDE,
+    ('B', 'Queenside'): BLACK_QUEENSIDE
+}
+castling_letters = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+castling_masks = [ALL_CASTLING] * 120
+for (row, col), lost in (((7, 4), WHITE_KINGSIDE | WHITE_QUEENSIDE), ((7, 7), WHITE_KINGSIDE),
+                         ((7, 0), WHITE_QUEENSIDE), ((0, 4), BLACK_KINGSIDE | BLACK_QUEENSIDE),
+                         ((0, 7), BLACK_KINGSIDE), ((0, 0), BLACK_QUEENSIDE)):
+    castling_masks[square_index(row, col)] = ALL_CASTLING & ~lost
+
+# Moves are packed into a single integer: the origin square number in the lowest six bits, the destination square
+# number in the next six, the piece type a pawn promotes to (or 0) in the next three and a flag for special moves in
+# the top two. A game's move history is a plain list of these integers.
+NORMAL, CASTLING, EN_PASSANT, DOUBLE_PUSH = 0, 1, 2, 3
+
+
+def pack_move(origin, destination, promotion=EMPTY, flag=NORMAL):
+    return origin | destination << 6 | promotion << 12 | flag << 15
+
+
+def move_origin(move):
+    return move & 63
+
+
+def move_destination(move):
+    return move >> 6 & 63
+
+
+def move_promotion(move):
+    return move >> 12 & 7
+
+
+def move_flag(move):
+    return move >> 15
+
+
+# The square_name() and move_name() functions write square numbers and packed moves in coordinate notation, eg. 'e4'
+# for a square and 'e2e4' or 'e7e8q' for a move, which is how moves are shown in search output and sent over UCI.
+def square_name(number):
+    return 'abcdefgh'[number & 7] + str(8 - (number >> 3))
+
+
+def move_name(move):
+    promotion = move >> 12 & 7
+    return square_name(move & 63) + square_name(move >> 6 & 63) + (' pnbrqk'[promotion] if promotion else '')
+
+
+# The new_mailbox() function builds a mailbox from a 2D list of piece codes.
+def new_mailbox(rows):
+    squares = bytearray([OFF_BOARD]) * 120
+    for row in range(8):
+        for col in range(8):
+            squares[square_index(row, col)] = piece_codes[rows[row][col]]
+    return squares
+
+
+# A ReadOnlyList is a list that raises TypeError on any attempt to change it, so that the 2D view of a board can't be
+# written to by mistake and fall out of step with the mailbox. Reading it is ordinary list indexing. The owner of the
+# view changes it with the list methods themselves, eg. list.__setitem__(row, col, piece).
+class ReadOnlyList(list):
+    def read_only(self, *args):
+        raise TypeError('The board is read-only: change squares with GameState.put() or the make methods')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = read_only
+
+    # Copies and pickles are rebuilt from the items, as the default way of rebuilding a list appends to it.
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+# The board_rows() function turns a mailbox into the familiar 2D list of two-character piece codes, board[row][col].
+# GameState keeps its copy up to date square by square as it changes the mailbox, so reading it is ordinary list
+# indexing with nothing built on the way. The rows are ReadOnlyLists: changes go through the mailbox.
+def board_rows(squares):
+    return ReadOnlyList(ReadOnlyList(piece_names[code] for code in squares[21 + row * 10:29 + row * 10])
+                        for row in range(8))
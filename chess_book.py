@@ -0,0 +1,206 @@
+"""This file contains the opening book: a file of the moves played in each well-known opening position, so that the
+engine can play them straight away instead of searching.
+
+The book is a binary file of 16-byte entries in the style of a Polyglot book: the position's 64-bit hash, the move
+(16 bits), a weight (16 bits, how good or popular the move is) and a 32-bit 'learn' field left free for recording
+results, all big-endian. The hash is the position's Zobrist hash from chess_zobrist, whose keys never change, and the
+move is the origin, destination and promotion bits of a packed move (see chess_board.pack_move). The entries are
+sorted by hash, so the moves for a position are found by binary search in O(log n) reads. The file is memory-mapped
+rather than read in, so even a book of hundreds of megabytes takes no room on the heap, and every engine process on a
+machine shares the one copy in the operating system's page cache.
+
+Books are built from PGN files, counting the moves played from each position in the first few moves of every game and
+weighting them by how well they scored (2 for a win, 1 for a draw or an unknown result and 0 for a loss). The counts
+are sorted on disk in runs and merged, so a book can be built from more games than the counts would fit in memory for.
+
+Run it as 'python chess_book.py build games.pgn book.bin' to build a book (with '--plies N' to change how many moves of
+each game are used) and 'python chess_book.py probe book.bin e2e4 e7e5' to list the book moves after some moves."""
+
+import heapq
+import itertools
+import mmap
+import random
+import struct
+import sys
+import tempfile
+import time
+
+from chess_board import move_name
+from chess_game_state import GameState
+from chess_pgn import open_games, san_to_move
+
+entry_format = struct.Struct('>QHHI')  # Hash, move, weight, learn
+ENTRY_BYTES = entry_format.size
+BOOK_PLIES = 20  # How many moves (counting each side's separately) of each game go into the book
+MAX_WEIGHT = 0xFFFF
+run_format = struct.Struct('>QHII')  # Hash, move, games, weight: the records of the sorted runs build_book() writes
+RUN_ENTRIES = 500000  # How many (position, move) counts build_book() keeps in memory before writing them out
+
+
+class OpeningBook:
+    # An OpeningBook reads a book file through a memory map. It should be closed when it's no longer needed, or used
+    # in a with statement.
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # An empty file can't be memory-mapped
+            self.data = b''
+        self.entries = len(self.data) // ENTRY_BYTES
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        return self.entries
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    # The first_entry() method binary searches for the first entry with the given hash, returning the number of
+    # entries if there are none.
+    def first_entry(self, key):
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if entry_format.unpack_from(self.data, middle * ENTRY_BYTES)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # The probe() method returns the book moves for the position in a GameState as a list of (move, weight, learn),
+    # with each move as a full packed move (with its special-move flag) from the GameState's legal moves, heaviest
+    # first. Book moves that aren't legal in the position (which can only happen if two positions share a hash) are
+    # left out.
+    def probe(self, game):
+        key = game.hash
+        index = self.first_entry(key)
+        legal_moves = None
+        found = []
+        while index < self.entries:
+            entry_key, move, weight, learn = entry_format.unpack_from(self.data, index * ENTRY_BYTES)
+            if entry_key != key:
+                break
+            if legal_moves is None:
+                legal_moves = {legal_move & 0x7FFF: legal_move for legal_move in game.legal_moves()}
+            if move in legal_moves:
+                found.append((legal_moves[move], weight, learn))
+            index += 1
+        found.sort(key=lambda entry: -entry[1])
+        return found
+
+    # The choose_move() method picks a book move for the position in a GameState, at random in proportion to the
+    # weights so that the engine doesn't always play the same opening, or returns None if the position isn't in the
+    # book. Passing a random.Random makes the choice repeatable.
+    def choose_move(self, game, generator=random):
+        entries = [entry for entry in self.probe(game) if entry[1] > 0]
+        if not entries:
+            return None
+        return generator.choices([move for move, _, _ in entries], [weight for _, weight, _ in entries])[0]
+
+
+# The write_run() function writes the counts gathered so far to a temporary file as a run of records sorted by hash and
+# move, and returns the file.
+def write_run(counts):
+    run = tempfile.TemporaryFile()
+    for (key, move), (games, weight) in sorted(counts.items()):
+        run.write(run_format.pack(key, move, games, weight))
+    run.seek(0)
+    return run
+
+
+# The read_run() function yields the records of a run written by write_run(), reading it a block at a time.
+def read_run(run):
+    run.seek(0)
+    while True:
+        block = run.read(run_format.size * 4096)
+        if not block:
+            break
+        yield from run_format.iter_unpack(block)
+
+
+# The merge_runs() function merges sorted runs into one stream of (hash, move, games, weight) in hash order, adding up
+# the counts of a move that was played from the same position in more than one run.
+def merge_runs(runs):
+    merged = heapq.merge(*(read_run(run) for run in runs))
+    for (key, move), records in itertools.groupby(merged, key=lambda record: record[:2]):
+        games, weight = 0, 0
+        for _, _, run_games, run_weight in records:
+            games += run_games
+            weight += run_weight
+        yield key, move, games, weight
+
+
+# The build_book() function builds a book file from the games in PGN files, using the first plies moves of each game.
+# Moves played fewer than min_games times are left out. It returns the number of entries written. The counts are kept
+# in memory for at most run_entries moves at a time: each time that many have been counted they are written to a sorted
+# run on disk, and the runs are merged at the end (an external sort), so the size of the PGN files isn't limited by the
+# memory available.
+def build_book(pgn_paths, book_path, plies=BOOK_PLIES, min_games=1, run_entries=RUN_ENTRIES):
+    counts = {}  # (hash, move) -> [games, weight]
+    runs = []
+    try:
+        for path in pgn_paths:
+            for pgn_game in open_games(path):
+                scores = {'1-0': (2, 0), '0-1': (0, 2)}.get(pgn_game.result, (1, 1))
+                game = pgn_game.start()
+                try:
+                    for san in pgn_game.moves[:plies]:
+                        move = san_to_move(game, san)
+                        entry = counts.setdefault((game.hash, move & 0x7FFF), [0, 0])
+                        entry[0] += 1
+                        entry[1] += scores[0] if game.turn == 'W' else scores[1]
+                        game.play(move)
+                except ValueError:
+                    pass  # The moves before an unreadable one are still counted
+                if len(counts) >= run_entries:
+                    runs.append(write_run(counts))
+                    counts = {}
+        runs.append(write_run(counts))
+        del counts
+        # Weights are scaled down if needed to fit in 16 bits, keeping every move that scored at all above 0. The
+        # largest weight is only known once the runs have been merged, so they are merged twice.
+        largest = max((weight for _, _, games, weight in merge_runs(runs) if games >= min_games), default=0)
+        scale = MAX_WEIGHT / largest if largest > MAX_WEIGHT else 1
+        written = 0
+        with open(book_path, 'wb') as book:
+            for key, move, games, weight in merge_runs(runs):
+                if games >= min_games:
+                    book.write(entry_format.pack(key, move, max(1, int(weight * scale)) if weight else 0, 0))
+                    written += 1
+        return written
+    finally:
+        for run in runs:
+            run.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'build':
+        arguments = sys.argv[2:]
+        book_plies = BOOK_PLIES
+        if '--plies' in arguments:
+            book_plies = int(arguments[arguments.index('--plies') + 1])
+            del arguments[arguments.index('--plies'):arguments.index('--plies') + 2]
+        start = time.perf_counter()
+        written = build_book(arguments[:-1], arguments[-1], book_plies)
+        print(f'{written} entries written to {arguments[-1]} in {time.perf_counter() - start:.1f}s')
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'probe':
+        position = GameState()
+        for name in sys.argv[3:]:
+            position.play(next(move for move in position.legal_moves() if move_name(move) == name))
+        with OpeningBook(sys.argv[2]) as opening_book:
+            start = time.perf_counter()
+            book_moves = opening_book.probe(position)
+            elapsed = time.perf_counter() - start
+            for book_move, book_weight, book_learn in book_moves:
+                print(f'{move_name(book_move)} weight {book_weight} learn {book_learn}')
+            print(f'{len(book_moves)} book moves out of {len(opening_book)} entries, found in {elapsed * 1e6:.0f}us')
+    else:
+        sys.exit('Usage: python chess_book.py build games.pgn [more.pgn ...] book.bin [--plies N]\n'
+                 '       python chess_book.py probe book.bin [moves ...]')
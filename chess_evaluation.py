@@ -0,0 +1,258 @@
+"""This file contains the static evaluation used by the search: a score for a position, in centipawns (hundredths of a
+pawn), from the point of view of the side to move. The score is made up of the material on the board and piece-square
+tables, which give each piece a bonus or penalty depending on where it stands (eg. knights in the centre are worth
+more than knights on the edge). The tables are the widely used 'simplified evaluation function' ones.
+
+Each table is written out from White's side of the board, with the first row being the eighth rank, just like the 2D
+board in GameState. Black's tables are the same ones flipped top to bottom. Piece values and tables are combined into
+square_scores[code][index] when the module is imported, so scoring a position is just adding up one number per piece,
+and GameState keeps that sum up to date as moves are made and unmade.
+
+For scoring many positions at once there is also a batch evaluation built on NumPy (see evaluate_batch())."""
+
+from chess_board import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, board_indices, square_index
+
+numpy = None  # Only imported for batch evaluation, by load_numpy(), since it takes longer to import than the engine
+
+piece_values = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500, QUEEN: 900, KING: 0}
+
+piece_square_tables = {
+    PAWN: [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [50, 50, 50, 50, 50, 50, 50, 50],
+        [10, 10, 20, 30, 30, 20, 10, 10],
+        [5, 5, 10, 25, 25, 10, 5, 5],
+        [0, 0, 0, 20, 20, 0, 0, 0],
+        [5, -5, -10, 0, 0, -10, -5, 5],
+        [5, 10, 10, -20, -20, 10, 10, 5],
+        [0, 0, 0, 0, 0, 0, 0, 0]
+    ],
+    KNIGHT: [
+        [-50, -40, -30, -30, -30, -30, -40, -50],
+        [-40, -20, 0, 0, 0, 0, -20, -40],
+        [-30, 0, 10, 15, 15, 10, 0, -30],
+        [-30, 5, 15, 20, 20, 15, 5, -30],
+        [-30, 0, 15, 20, 20, 15, 0, -30],
+        [-30, 5, 10, 15, 15, 10, 5, -30],
+        [-40, -20, 0, 5, 5, 0, -20, -40],
+        [-50, -40, -30, -30, -30, -30, -40, -50]
+    ],
+    BISHOP: [
+        [-20, -10, -10, -10, -10, -10, -10, -20],
+        [-10, 0, 0, 0, 0, 0, 0, -10],
+        [-10, 0, 5, 10, 10, 5, 0, -10],
+        [-10, 5, 5, 10, 10, 5, 5, -10],
+        [-10, 0, 10, 10, 10, 10, 0, -10],
+        [-10, 10, 10, 10, 10, 10, 10, -10],
+        [-10, 5, 0, 0, 0, 0, 5, -10],
+        [-20, -10, -10, -10, -10, -10, -10, -20]
+    ],
+    ROOK: [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [5, 10, 10, 10, 10, 10, 10, 5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [0, 0, 0, 5, 5, 0, 0, 0]
+    ],
+    QUEEN: [
+        [-20, -10, -10, -5, -5, -10, -10, -20],
+        [-10, 0, 0, 0, 0, 0, 0, -10],
+        [-10, 0, 5, 5, 5, 5, 0, -10],
+        [-5, 0, 5, 5, 5, 5, 0, -5],
+        [0, 0, 5, 5, 5, 5, 0, -5],
+        [-10, 5, 5, 5, 5, 5, 0, -10],
+        [-10, 0, 5, 0, 0, 0, 0, -10],
+        [-20, -10, -10, -5, -5, -10, -10, -20]
+    ],
+    KING: [
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-20, -30, -30, -40, -40, -30, -30, -20],
+        [-10, -20, -20, -20, -20, -20, -20, -10],
+        [20, 20, 0, 0, 0, 0, 20, 20],
+        [20, 30, 10, 0, 0, 10, 30, 20]
+    ]
+}
+
+# square_scores[code][index] is what the piece with that code is worth on that mailbox index, counted positively for
+# White and negatively for Black. Empty and off-board squares are worth nothing.
+square_scores = [[0] * 120 for _ in range(BLACK | KING + 1)]
+for kind, table in piece_square_tables.items():
+    for row in range(8):
+        for col in range(8):
+            square_scores[WHITE | kind][square_index(row, col)] = piece_values[kind] + table[row][col]
+            square_scores[BLACK | kind][square_index(7 - row, col)] = -(piece_values[kind] + table[row][col])
+
+
+# The material_score() function adds up square_scores for a GameState from scratch, giving the material and
+# piece-square score from White's point of view. GameState uses it when a position is set up and then keeps the score
+# up to date square by square as moves are made and unmade, so the search never has to loop over the board.
+def material_score(game):
+    squares = game.squares
+    score = 0
+    for index in board_indices:
+        score += square_scores[squares[index]][index]
+    return score
+
+
+# The evaluate() function scores a GameState from the point of view of the side to move, using the score GameState
+# keeps up to date.
+def evaluate(game):
+    return game.score if game.turn == 'W' else -game.score
+
+
+# Batch evaluation scores many positions at once with NumPy, for bulk position analysis and producing training data.
+# Positions are given as piece planes: an array shaped (N, 12, 8, 8) with a 1 wherever a piece stands, one plane per
+# piece in the order of plane_codes (white pawn to white king, then black pawn to black king), laid out by (row, col)
+# like the 2D board. On top of the material and piece-square score, it adds pawn structure (doubled, isolated and
+# passed pawns) and mobility (the squares each knight, bishop, rook and queen can move to) terms, which would be too
+# slow to work out square by square in the search. NumPy is only needed for this, so the rest of the engine doesn't
+# depend on it and doesn't wait for it to import.
+plane_codes = [WHITE | kind for kind in range(PAWN, KING + 1)] + [BLACK | kind for kind in range(PAWN, KING + 1)]
+
+DOUBLED_PAWN = -10  # For each pawn on a file beyond the first
+ISOLATED_PAWN = -15  # For each pawn with no friendly pawns on the files next to it
+passed_pawn_bonus = [0, 70, 45, 25, 15, 10, 5, 0]  # By row for a white passed pawn, so the seventh rank is row 1
+mobility_weights = {KNIGHT: 4, BISHOP: 4, ROOK: 2, QUEEN: 1}  # For each square the piece can move to
+knight_steps = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+bishop_steps = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+rook_steps = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+
+plane_weights = code_planes = board_offsets = None
+
+
+# The load_numpy() function imports NumPy the first time batch evaluation is used and builds the arrays it needs.
+# plane_weights[plane][row][col] is square_scores laid out to match the piece planes.
+def load_numpy():
+    global numpy, plane_weights, code_planes, board_offsets
+    if numpy is None:
+        import numpy
+        plane_weights = numpy.array([[[square_scores[code][square_index(row, col)] for col in range(8)]
+                                      for row in range(8)] for code in plane_codes], dtype=numpy.int32)
+        code_planes = numpy.array(plane_codes, dtype=numpy.uint8)
+        board_offsets = numpy.array(board_indices)
+
+
+# The piece_planes() function converts a list of GameStates into piece planes.
+def piece_planes(games):
+    load_numpy()
+    codes = numpy.frombuffer(b''.join(bytes(game.squares) for game in games), dtype=numpy.uint8)
+    codes = codes.reshape(len(games), 120)[:, board_offsets]
+    return (codes[:, None, :] == code_planes[None, :, None]).reshape(len(games), 12, 8, 8).astype(numpy.uint8)
+
+
+# The shift() function moves everything on a batch of (N, 8, 8) planes by rows and cols, dropping whatever goes off the
+# edge of the board.
+def shift(planes, rows, cols):
+    shifted = numpy.zeros_like(planes)
+    shifted[:, max(rows, 0):8 + min(rows, 0), max(cols, 0):8 + min(cols, 0)] = \
+        planes[:, max(-rows, 0):8 - max(rows, 0), max(-cols, 0):8 - max(cols, 0)]
+    return shifted
+
+
+# The pawn_structure() function scores the doubled, isolated and passed pawns of one side. pawns and enemy_pawns are
+# (N, 8, 8) planes, and ahead is -1 if the side's pawns move up the board (White) and 1 if they move down (Black).
+def pawn_structure(pawns, enemy_pawns, ahead):
+    files = pawns.sum(axis=1, dtype=numpy.int32)
+    score = DOUBLED_PAWN * numpy.maximum(files - 1, 0).sum(axis=1)
+    occupied = files > 0
+    neighbours = numpy.zeros_like(occupied)
+    neighbours[:, 1:] |= occupied[:, :-1]
+    neighbours[:, :-1] |= occupied[:, 1:]
+    score += ISOLATED_PAWN * (files * ~neighbours).sum(axis=1)
+    # A pawn is passed if no enemy pawn stands ahead of it on its own file or the files next to it
+    guarded = enemy_pawns | shift(enemy_pawns, 0, -1) | shift(enemy_pawns, 0, 1)
+    if ahead == -1:
+        blocked = shift(numpy.maximum.accumulate(guarded, axis=1), 1, 0)
+        bonus = numpy.array(passed_pawn_bonus, dtype=numpy.int32)
+    else:
+        blocked = shift(numpy.maximum.accumulate(guarded[:, ::-1], axis=1)[:, ::-1], -1, 0)
+        bonus = numpy.array(passed_pawn_bonus[::-1], dtype=numpy.int32)
+    passed = pawns & (1 - blocked)
+    return score + (passed.sum(axis=2, dtype=numpy.int32) * bonus).sum(axis=1)
+
+
+# The mobility() function scores the squares one side's knights, bishops, rooks and queens can move to (empty squares
+# or enemy pieces), ignoring pins. Sliders are stepped along each direction one square at a time, stopping at the
+# first piece they reach.
+def mobility(planes, own, empty):
+    not_own = 1 - own
+    score = numpy.zeros(len(planes), dtype=numpy.int32)
+    knights = planes[:, KNIGHT - 1].astype(numpy.int32)
+    for rows, cols in knight_steps:
+        score += mobility_weights[KNIGHT] * (shift(knights, rows, cols) * not_own).sum(axis=(1, 2))
+    for kind, steps in ((BISHOP, bishop_steps), (ROOK, rook_steps), (QUEEN, bishop_steps + rook_steps)):
+        for rows, cols in steps:
+            ray = planes[:, kind - 1].astype(numpy.int32)
+            for _ in range(7):
+                ray = shift(ray, rows, cols)
+                score += mobility_weights[kind] * (ray * not_own).sum(axis=(1, 2))
+                ray = ray * empty
+    return score
+
+
+# The evaluate_batch() function scores a batch of piece planes, returning an array of N scores. Scores are from White's
+# point of view unless white_to_move (an array of N booleans) is given, in which case they are from the point of view
+# of the side to move like evaluate(). With both extra terms turned off the scores are exactly those of evaluate().
+def evaluate_batch(planes, white_to_move=None, pawns=True, pieces_mobility=True):
+    load_numpy()
+    planes = numpy.asarray(planes, dtype=numpy.uint8)
+    scores = numpy.einsum('npij,pij->n', planes.astype(numpy.int32), plane_weights)
+    if pawns:
+        scores += pawn_structure(planes[:, PAWN - 1], planes[:, 6 + PAWN - 1], -1)
+        scores -= pawn_structure(planes[:, 6 + PAWN - 1], planes[:, PAWN - 1], 1)
+    if pieces_mobility:
+        white, black = planes[:, :6].sum(axis=1, dtype=numpy.int32), planes[:, 6:].sum(axis=1, dtype=numpy.int32)
+        empty = 1 - white - black
+        scores += mobility(planes[:, :6], white, empty)
+        scores -= mobility(planes[:, 6:], black, empty)
+    if white_to_move is not None:
+        scores = numpy.where(white_to_move, scores, -scores)
+    return scores
+
+
+# The evaluate_games() function scores a list of GameStates with evaluate_batch(), from the point of view of the side
+# to move in each.
+def evaluate_games(games, pawns=True, pieces_mobility=True):
+    return evaluate_batch(piece_planes(games), numpy.array([game.turn == 'W' for game in games]), pawns,
+                          pieces_mobility)
+
+
+# Run this file to compare batch evaluation against evaluating positions one at a time, on positions from random games.
+if __name__ == '__main__':
+    import random
+    import time
+
+    from chess_game_state import GameState
+
+    generator = random.Random(0)
+    positions = []
+    while len(positions) < 2000:
+        game = GameState()
+        for _ in range(generator.randrange(10, 80)):
+            moves = game.legal_moves()
+            if not moves:
+                break
+            game.play(generator.choice(moves))
+        positions.append(game)
+
+    load_numpy()
+    start = time.perf_counter()
+    single = [material_score(game) for game in positions]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = evaluate_games(positions, False, False)
+    batch_time = time.perf_counter() - start
+    assert list(numpy.where([game.turn == 'W' for game in positions], single, [-score for score in single])) == \
+        list(batch), 'Batch scores differ from the incremental ones'
+    assert all(game.score == score for game, score in zip(positions, single)), 'Incremental scores are out of date'
+    start = time.perf_counter()
+    evaluate_games(positions)
+    full_time = time.perf_counter() - start
+    print(f'{len(positions)} positions: one at a time {len(positions) / single_time:.0f}/s, batch material '
+          f'{len(positions) / batch_time:.0f}/s, batch with pawns and mobility {len(positions) / full_time:.0f}/s')
@@ -1,15 +1,30 @@
 """This file contains the code necessary to keep track the state of the board at any given turn. The board is
-represented # by a 2D list. Each piece is represented by a piece 'code' (eg. BQ = Black Queen), while '~~' stands for
-an empty square. The rules for each piece are imported from the chess_pieces module and assigned as values to each
-piece code. The get_piece() and make_move() methods can be called in the main function to modify the GameState list.
-The rules for check, castling etc. will also be stored here."""
+stored as an integer-coded 10x12 mailbox (see the chess_board module), and can still be read as a 2D list through
+self.board, where each piece is represented by a piece 'code' (eg. BQ = Black Queen), while '~~' stands for an empty
+square. The rules for each piece are imported from the chess_pieces module and assigned as values to each piece code.
+The get_piece() and make_move() methods can be called in the main function to modify the GameState board.
+The rules for check, castling etc. will also be stored here. Besides the board, a GameState keeps the rest of the
+position as small fields (side to move, castling rights, en passant square and move counters) which the make methods
+update and unmake_move() restores, and the move history as a list of packed integer moves (see chess_board).
+Alongside the mailbox a GameState keeps the same position as bitboards (see chess_bitboard), updated square by square
+with it, and its moves and its attack and check tests come from those."""
 
+from collections import Counter
+
+from chess_board import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, piece_codes, square_index, \
+    board_indices, coordinates, square_numbers, new_mailbox, board_rows, ALL_CASTLING, castling_rights, \
+    castling_masks, castling_letters, NORMAL, CASTLING, EN_PASSANT, DOUBLE_PUSH, pack_move, fen_pieces, piece_names
+from chess_bitboard import BitboardPosition
+from chess_zobrist import piece_keys, castling_keys, en_passant_keys, black_to_move_key, position_hash
+from chess_evaluation import square_scores, material_score
 from chess_pieces import King, Queen, Rook, Bishop, Knight, Pawn
 
+starting_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
 
 class GameState:
     def __init__(self):
-        self.board = [
+        starting_board = [
             ['BR', 'BN', 'BB', 'BQ', 'BK', 'BB', 'BN', 'BR'],
             ['BP', 'BP', 'BP', 'BP', 'BP', 'BP', 'BP', 'BP'],
             ['~~', '~~', '~~', '~~', '~~', '~~', '~~', '~~'],
@@ -19,10 +34,25 @@ class GameState:
             ['WP', 'WP', 'WP', 'WP', 'WP', 'WP', 'WP', 'WP'],
             ['WR', 'WN', 'WB', 'WQ', 'WK', 'WB', 'WN', 'WR']
         ]
+        self.squares = new_mailbox(starting_board)
+        self.board = board_rows(self.squares)  # 2D view of self.squares, for reading
 
-        self.white_king = None
-        self.black_king = None
-        self.moves = []
+        self.kings = {}  # Mailbox index of each colour's king, kept up to date by the make methods
+        self.find_kings()
+        self.turn = 'W'  # The colour to move
+        self.castling = ALL_CASTLING  # Castling rights as bits (see chess_board)
+        self.en_passant = 0  # Mailbox index of the square a pawn can capture en passant onto, or 0 if there is none
+        self.halfmove_clock = 0  # Moves since the last capture or pawn move, for the fifty-move rule
+        self.fullmove_number = 1  # Starts at 1 and goes up after each black move
+        self.moves = []  # Packed integer moves (see chess_board.pack_move)
+        self.undo_stack = []
+        self.initial_fen = starting_fen  # The position the game started from, for writing it out (see chess_pgn)
+        self.hash = position_hash(self)  # 64-bit Zobrist hash, kept up to date by put() and the make methods
+        self.score = material_score(self)  # Material and piece-square score for White, kept up to date by put()
+        self.position_counts = Counter({self.hash: 1})  # How many times each position (by hash) has occurred
+        self.bitboards = BitboardPosition.from_game_state(self)  # The pieces as bitboards, kept up to date by put()
+        self.move_map = None  # Legal moves by origin square, cached by legal_move_map() for the position
+        self.move_map_hash = None  # with this hash
 
     piece_classes = {
         'WK': King,
@@ -39,94 +69,265 @@ class GameState:
         'BP': Pawn
     }
 
-    # The future_board() method duplicates the current board as dictated by the GameState class. We can use it in order
-    # to 'test out' moves in order to check that they are legal before making changes to the real board.
+    # The future_board() method duplicates the current board as dictated by the GameState class. Moves can be tested in
+    # place with the make methods and unmake_move(), so this is only needed when an independent copy is wanted.
     def future_board(self):
         future_board = GameState()
-        future_board.board = [row[:] for row in self.board]
+        future_board.squares[:] = self.squares
+        future_board.board = board_rows(future_board.squares)
+        future_board.kings = dict(self.kings)
+        future_board.turn, future_board.castling, future_board.en_passant = self.turn, self.castling, self.en_passant
+        future_board.halfmove_clock, future_board.fullmove_number = self.halfmove_clock, self.fullmove_number
+        future_board.moves, future_board.undo_stack = self.moves[:], self.undo_stack[:]  # So moves can be taken back
+        future_board.initial_fen = self.initial_fen
+        future_board.hash, future_board.score = self.hash, self.score
+        future_board.position_counts = Counter(self.position_counts)
+        future_board.bitboards = BitboardPosition.from_game_state(future_board)
         return future_board
 
+    # The from_fen() method sets up a GameState from a FEN string, the standard one-line description of a position:
+    # the pieces rank by rank from the eighth, the side to move, castling rights, the en passant square and the two move
+    # counters (which may be left off). A ValueError is raised if the string can't be read, if either side doesn't have
+    # exactly one king, if the en passant square isn't on the rank behind a pawn the other side has just pushed two
+    # squares (the sixth rank with White to move, the third with Black), or if the position can't arise in a game
+    # because the kings are next to each other or the side not to move is in check. As with the make methods, the en
+    # passant square is only kept if a pawn can actually capture onto it.
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError(f'A FEN string needs 4 or 6 fields: {fen!r}')
+        placement, turn, castling, en_passant = fields[:4]
+        rows = []
+        for rank in placement.split('/'):
+            row = []
+            for char in rank:
+                if char in '12345678':
+                    row.extend(['~~'] * int(char))
+                elif char in fen_pieces:
+                    row.append(fen_pieces[char])
+                else:
+                    raise ValueError(f'Unknown piece {char!r} in FEN string: {fen!r}')
+            if len(row) != 8:
+                raise ValueError(f'Rank {rank!r} does not have 8 squares in FEN string: {fen!r}')
+            rows.append(row)
+        if len(rows) != 8 or turn not in ('w', 'b') or (castling != '-' and not set(castling) <= set('KQkq')):
+            raise ValueError(f'Not a valid FEN string: {fen!r}')
+        for king in ('WK', 'BK'):
+            if sum(row.count(king) for row in rows) != 1:
+                raise ValueError(f'A FEN string needs exactly one {"white" if king == "WK" else "black"} king: {fen!r}')
+
+        game = cls()
+        game.squares = new_mailbox(rows)
+        game.board = board_rows(game.squares)
+        game.find_kings()
+        game.turn = turn.upper()
+        game.castling = 0
+        for letter, right in castling_letters:
+            if letter in castling:
+                game.castling |= right
+        game.en_passant = 0
+        if en_passant != '-':
+            expected_rank = '6' if turn == 'w' else '3'
+            if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' or en_passant[1] != expected_rank:
+                raise ValueError(f'Not a valid en passant square in FEN string: {fen!r}')
+            index = square_index(8 - int(en_passant[1]), 'abcdefgh'.index(en_passant[0]))
+            pawn = index + (10 if game.turn == 'W' else -10)  # The pawn that has just moved two squares
+            capturer = piece_codes[game.turn + 'P']
+            if game.squares[pawn - 1] == capturer or game.squares[pawn + 1] == capturer:
+                game.en_passant = index
+        if len(fields) == 6:
+            if not (fields[4].isdigit() and fields[5].isdigit()):
+                raise ValueError(f'Not valid move counters in FEN string: {fen!r}')
+            game.halfmove_clock, game.fullmove_number = int(fields[4]), max(1, int(fields[5]))
+        game.initial_fen = game.to_fen()
+        game.hash = position_hash(game)
+        game.score = material_score(game)
+        game.position_counts = Counter({game.hash: 1})
+        game.bitboards = BitboardPosition.from_game_state(game)
+        if abs(game.kings['W'] - game.kings['B']) in (1, 9, 10, 11):
+            raise ValueError(f'The kings are next to each other in FEN string: {fen!r}')
+        if game.in_check('B' if game.turn == 'W' else 'W'):
+            raise ValueError(f'The side not to move is in check in FEN string: {fen!r}')
+        return game
+
+    # The to_fen() method writes the current position out as a FEN string.
+    def to_fen(self):
+        ranks = []
+        for row in self.board:
+            rank, empty = '', 0
+            for piece in row:
+                if piece == '~~':
+                    empty += 1
+                    continue
+                if empty:
+                    rank, empty = rank + str(empty), 0
+                rank += piece[1] if piece[0] == 'W' else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ''))
+        castling = ''.join(letter for letter, right in castling_letters if self.castling & right) or '-'
+        en_passant = '-'
+        if self.en_passant:
+            row, col = coordinates[self.en_passant]
+            en_passant = 'abcdefgh'[col] + str(8 - row)
+        return f'{"/".join(ranks)} {self.turn.lower()} {castling} {en_passant} {self.halfmove_clock} ' \
+               f'{self.fullmove_number}'
+
     # The make_move() method alters the state of the board when called in the main function by swapping the element in
     # the target square with the element in the origin square, and then changing the origin square to an empty space.
-    # However we will first check if either of the special castling or promotion moves have been played, as those will
-    # require extra functionality beyond just swapping squares.
     def make_move(self, origin, destination):
-        self.board[destination[0]][destination[1]] = self.board[origin[0]][origin[1]]
-        self.board[origin[0]][origin[1]] = '~~'
+        start, end = square_index(*origin), square_index(*destination)
+        self.apply_move(start, end, self.squares[start], end, None, NORMAL)
 
-    # Add the most recent move as a list of tuples to the self.moves list, creating a 2D list.
-    def add_move(self, origin, destination):
-        move = [origin, destination]
+    # Add the most recent move, packed into an integer, to the self.moves list.
+    def add_move(self, move):
         self.moves.append(move)
 
-    # Separate function for pawn moves to check for en passant and promotion
+    # The put() method is the only place the make methods change a square, so that the 2D view, the bitboards, the hash
+    # and the score can be kept up to date: the key for the old piece on the square is XORed out of the hash and the key
+    # for the new one in, and the old piece's score (see chess_evaluation) is swapped for the new one's.
+    def put(self, index, code):
+        old = self.squares[index]
+        self.hash ^= piece_keys[old][index] ^ piece_keys[code][index]
+        self.score += square_scores[code][index] - square_scores[old][index]
+        self.squares[index] = code
+        list.__setitem__(self.board[index // 10 - 2], index % 10 - 1, piece_names[code])  # The rows are read-only
+        bitboards = self.bitboards  # BitboardPosition.remove() and place(), written out as put() is called so often
+        square = square_numbers[index]
+        bit = 1 << square
+        if old != EMPTY:
+            bitboards.pieces[old] ^= bit
+            bitboards.occupancy[old & BLACK] ^= bit
+        if code != EMPTY:
+            bitboards.pieces[code] |= bit
+            bitboards.occupancy[code & BLACK] |= bit
+        bitboards.squares[square] = code
 
-    def make_pawn_move(self, origin, destination):
-        if self.board[origin[0]][origin[1]] == 'WP' and destination[0] == 0:
-            self.board[destination[0]][destination[1]] = 'WQ'
-            self.board[origin[0]][origin[1]] = '~~'
-        elif self.board[origin[0]][origin[1]] == 'BP' and destination[0] == 7:
-            self.board[destination[0]][destination[1]] = 'BQ'
-            self.board[origin[0]][origin[1]] = '~~'
+    # The apply_move() method does the work shared by all of the make methods. start and end are the mailbox squares
+    # the piece moves between, placed is the piece that ends up on end (different from the moving piece when a pawn
+    # promotes), capture_index is the square of any captured piece (only different from end for en passant) and
+    # rook_move gives the rook's start and end squares when castling. Before changing anything it pushes an undo record
+    # with the squares, pieces and position fields involved, so that unmake_move() can take the move back in place.
+    # Every position field is then updated directly, without looking back through the move history, and the hash has
+    # the keys for the changed fields XORed in and out. An en passant square is only set when an enemy pawn stands next
+    # to the pawn that moved two squares, so that positions only differ in their hash when the moves available differ.
+    def apply_move(self, start, end, placed, capture_index, rook_move, flag):
+        squares = self.squares
+        piece, captured = squares[start], squares[capture_index]
+        castling, en_passant = self.castling, self.en_passant
+        self.undo_stack.append((start, end, piece, captured, capture_index, rook_move, castling, en_passant,
+                                self.halfmove_clock, self.hash))
+        if capture_index != end:
+            self.put(capture_index, EMPTY)
+        self.put(end, placed)
+        self.put(start, EMPTY)
+        if rook_move:
+            rook_start, rook_end = rook_move
+            self.put(rook_end, squares[rook_start])
+            self.put(rook_start, EMPTY)
+        colour = 'W' if piece & BLACK == WHITE else 'B'
+        if piece & 7 == KING:
+            self.kings[colour] = end
+        self.castling &= castling_masks[start] & castling_masks[end]
+        self.en_passant = 0
+        if flag == DOUBLE_PUSH and (squares[end - 1] == piece ^ BLACK or squares[end + 1] == piece ^ BLACK):
+            self.en_passant = (start + end) // 2
+        self.hash ^= castling_keys[castling] ^ castling_keys[self.castling] ^ en_passant_keys[en_passant] ^ \
+            en_passant_keys[self.en_passant] ^ black_to_move_key
+        self.halfmove_clock = 0 if piece & 7 == PAWN or captured != EMPTY else self.halfmove_clock + 1
+        if colour == 'B':
+            self.fullmove_number += 1
+        self.turn = 'B' if colour == 'W' else 'W'
+        self.position_counts[self.hash] += 1
+        self.add_move(pack_move(square_numbers[start], square_numbers[end], placed & 7 if placed != piece else EMPTY,
+                                flag))
+
+    # The unmake_move() method takes back the last move made by any of the make methods, restoring the board and the
+    # position fields exactly as they were. This lets us try moves out on the real board instead of copying it with
+    # future_board().
+    def unmake_move(self):
+        start, end, piece, captured, capture_index, rook_move, self.castling, self.en_passant, self.halfmove_clock, \
+            previous_hash = self.undo_stack.pop()
+        count = self.position_counts[self.hash] - 1
+        if count:
+            self.position_counts[self.hash] = count
         else:
-            self.board[destination[0]][destination[1]] = self.board[origin[0]][origin[1]]
-            self.board[origin[0]][origin[1]] = '~~'
+            del self.position_counts[self.hash]  # So that a search doesn't leave a count for every position it visits
+        self.moves.pop()
+        self.put(start, piece)
+        self.put(end, EMPTY)
+        self.put(capture_index, captured)
+        if rook_move:
+            rook_start, rook_end = rook_move
+            self.put(rook_start, self.squares[rook_end])
+            self.put(rook_end, EMPTY)
+        colour = 'W' if piece & BLACK == WHITE else 'B'
+        if piece & 7 == KING:
+            self.kings[colour] = start
+        if colour == 'B':
+            self.fullmove_number -= 1
+        self.turn = colour
+        self.hash = previous_hash
+
+    # Separate function for pawn moves to check for en passant and promotion. A pawn reaching the last rank becomes the
+    # piece given by promotion (a queen unless told otherwise), and a pawn moving diagonally onto the en passant square
+    # captures the pawn that has just moved past it.
+
+    def make_pawn_move(self, origin, destination, promotion='Q'):
+        self.move_pawn(square_index(*origin), square_index(*destination), piece_codes['W' + promotion])
+
+    # The move_pawn() method does the work of make_pawn_move() on mailbox indices, with the promotion given as a piece
+    # type, so that play() can call it without converting squares back and forth.
+    def move_pawn(self, start, end, promotion=QUEEN):
+        piece = self.squares[start]
+        placed, capture_index, flag = piece, end, NORMAL
+        if coordinates[end][0] in (0, 7):
+            placed = piece & BLACK | promotion
+        elif end == self.en_passant and (end - start) % 10:
+            capture_index, flag = end + 10 if piece & BLACK == WHITE else end - 10, EN_PASSANT
+        elif abs(end - start) == 20:
+            flag = DOUBLE_PUSH
+        self.apply_move(start, end, placed, capture_index, None, flag)
 
-    # Separate function to make a king move to allow for castling:
+    # Separate function to make a king move to allow for castling. When castling, the rook also jumps from its corner
+    # to the square on the other side of the king.
 
     def make_king_move(self, origin, destination, colour):
-        if colour == 'W':
-            if destination == (7, 6) and origin == (7, 4):
-                self.board[7][6] = 'WK'
-                self.board[7][5] = 'WR'
-                self.board[7][4] = '~~'
-            elif destination == (7, 2) and origin == (7, 4):
-                self.board[7][2] = 'WK'
-                self.board[7][3] = 'WR'
-                self.board[7][4] = '~~'
-            else:
-                self.board[destination[0]][destination[1]] = self.board[origin[0]][origin[1]]
-                self.board[origin[0]][origin[1]] = '~~'
-        elif colour == 'B':
-            if destination == (0, 6) and origin == (0, 4):
-                self.board[0][6] = 'BK'
-                self.board[0][5] = 'BR'
-                self.board[0][4] = '~~'
-            elif destination == (0, 2) and origin == (0, 4):
-                self.board[0][2] = 'BK'
-                self.board[0][3] = 'BR'
-                self.board[0][4] = '~~'
-            else:
-                self.board[destination[0]][destination[1]] = self.board[origin[0]][origin[1]]
-                self.board[origin[0]][origin[1]] = '~~'
-
-        # If a player attempts to castle, we must check if either the king or the rook on the side which the player is
-        # trying to castle on has moved during the game. If either one has, castling would be illegal and we should
-        # return False.
+        self.move_king(square_index(*origin), square_index(*destination))
+
+    # The move_king() method does the work of make_king_move() on mailbox indices. A king moving two squares from its
+    # starting square is castling, and the rook moves from its corner to the square the king passed over.
+    def move_king(self, start, end):
+        rook_move, flag = None, NORMAL
+        if start == (square_index(7, 4) if self.squares[start] & BLACK == WHITE else square_index(0, 4)):
+            if end == start + 2:
+                rook_move, flag = (start + 3, start + 1), CASTLING
+            elif end == start - 2:
+                rook_move, flag = (start - 4, start - 1), CASTLING
+        self.apply_move(start, end, self.squares[start], end, rook_move, flag)
+
+    # If a player attempts to castle, we must check if either the king or the rook on the side which the player is
+    # trying to castle on has moved during the game. If either one has, castling would be illegal and we should
+    # return False. The make methods clear the rights as soon as the king or rook moves (or the rook is captured), so
+    # this is a single bit test.
 
     def castle(self, colour, side):
-        if colour == 'W':
-            if side == 'Kingside':
-                for move in self.moves:
-                    if (7, 4) in move or (7, 7) in move:
-                        return False
-                return True
-            elif side == 'Queenside':
-                for move in self.moves:
-                    if (7, 4) in move or (7, 0) in move:
-                        return False
-                return True
-        elif colour == 'B':
-            if side == 'Kingside':
-                for move in self.moves:
-                    if (0, 4) in move or (0, 7) in move:
-                        return False
-                return True
-            elif side == 'Queenside':
-                for move in self.moves:
-                    if (0, 4) in move or (0, 0) in move:
-                        return False
-                return True
+        return bool(self.castling & castling_rights[colour, side])
+
+    # The castling_allowed() method checks every condition for castling: the right to castle on that side, the rook
+    # still in its corner, the squares between the king and rook empty and the king not in check and not passing
+    # through an attacked square. Whether the king lands on an attacked square is left to the usual in_check() test.
+    def castling_allowed(self, colour, side):
+        squares = self.squares
+        king = square_index(7 if colour == 'W' else 0, 4)
+        enemy = 'B' if colour == 'W' else 'W'
+        if not self.castle(colour, side) or squares[king] != piece_codes[colour + 'K']:
+            return False
+        if side == 'Kingside':
+            rook, between, passed = king + 3, (king + 1, king + 2), king + 1
+        else:
+            rook, between, passed = king - 4, (king - 1, king - 2, king - 3), king - 1
+        return squares[rook] == piece_codes[colour + 'R'] and all(squares[index] == EMPTY for index in between) and \
+            not self.attacked(king, enemy) and not self.attacked(passed, enemy)
 
     # The get_piece() method accesses the piece_classes dictionary and returns the piece present at any given square.
     def get_piece(self, row, col):
@@ -143,35 +344,169 @@ class GameState:
         else:
             return False
 
+    # The find_kings() method scans the board for both kings. It is only needed when a board is set up, since from
+    # then on make_king_move() and unmake_move() keep self.kings up to date.
+    def find_kings(self):
+        self.kings = {}
+        for index in board_indices:
+            if self.squares[index] == WHITE | KING:
+                self.kings['W'] = index
+            elif self.squares[index] == BLACK | KING:
+                self.kings['B'] = index
+
+    # The squares of the kings as (row, col) tuples, for code that works with the 2D board.
+    @property
+    def white_king(self):
+        return coordinates[self.kings['W']] if 'W' in self.kings else None
+
+    @property
+    def black_king(self):
+        return coordinates[self.kings['B']] if 'B' in self.kings else None
+
+    # The en passant square as a (row, col) tuple, or None if there isn't one, for the Pawn rules.
+    @property
+    def en_passant_square(self):
+        return coordinates[self.en_passant]
+
+    # The attacked() method returns True if a piece of the given colour attacks the square at a mailbox index, using the
+    # bitboard attack tables.
+    def attacked(self, index, colour):
+        return self.bitboards.attacked(square_numbers[index], WHITE if colour == 'W' else BLACK)
+
+    # The in_check() method returns True if the king of the given colour is attacked by the other colour.
     def in_check(self, colour):
-        # Find the positions of the kings
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                if self.board[row][col] == 'WK':
-                    self.white_king = (row, col)
-                elif self.board[row][col] == 'BK':
-                    self.black_king = (row, col)
-
-        if colour == 'W':
-            # Check if any black piece can attack the white king
-            for row in range(len(self.board)):
-                for col in range(len(self.board[row])):
-                    piece = self.board[row][col]
-                    if piece[0] == 'B' and piece != 'BK':
-                        piece_square = (row, col)
-                        attacking_piece = self.piece_classes[piece](piece_square, self.white_king, self.board)
-                        if attacking_piece.check_move():
-                            return True
-            return False
-        elif colour == 'B':
-            # Check if any white piece can attack the black king
-            for row in range(len(self.board)):
-                for col in range(len(self.board[row])):
-                    piece = self.board[row][col]
-                    if piece[0] == 'W' and piece != 'WK':
-                        piece_square = (row, col)
-                        attacking_piece = self.piece_classes[piece](piece_square, self.black_king, self.board)
-                        if attacking_piece.check_move():
-                            return True
-            return False
+        return self.bitboards.in_check(WHITE if colour == 'W' else BLACK)
+
+    # The bitboards_for() method readies the bitboards to generate the moves of a colour, copying the position fields
+    # they need across. The en passant square only counts for the side to move.
+    def bitboards_for(self, colour):
+        bitboards = self.bitboards
+        bitboards.side = WHITE if colour == 'W' else BLACK
+        bitboards.castling = self.castling
+        bitboards.en_passant = square_numbers[self.en_passant] if colour == self.turn else None
+        return bitboards
+
+    # The is_repetition() method returns True if the current position has already occurred in the game, which is a
+    # single lookup in the count of each position's hash that the make methods and unmake_move() keep.
+    def is_repetition(self):
+        return self.position_counts[self.hash] > 1
+
+    # The has_legal_move() method returns True if the given colour (the side to move by default) has any legal move.
+    # Unlike legal_moves() it stops at the first one it finds, so it is cheap enough to call after every move.
+    def has_legal_move(self, colour=None):
+        return self.bitboards_for(colour or self.turn).has_legal_move()
+
+    # The insufficient_material() method returns True if neither side has the pieces to ever give checkmate: kings
+    # alone, a king and a single knight or bishop against a bare king, or kings and bishops that all stand on squares
+    # of the same colour.
+    def insufficient_material(self):
+        minor_pieces = []
+        for index in board_indices:
+            code = self.squares[index]
+            kind = code & 7
+            if kind in (PAWN, ROOK, QUEEN):
+                return False
+            if kind in (KNIGHT, BISHOP):
+                minor_pieces.append((kind, square_numbers[index]))
+        if len(minor_pieces) <= 1:
+            return True
+        return all(kind == BISHOP for kind, _ in minor_pieces) and \
+            len({(square >> 3) + (square & 7) & 1 for _, square in minor_pieces}) == 1
+
+    # The outcome() method returns how the game has ended, as the result ('1-0', '0-1' or '1/2-1/2') and the reason
+    # ('checkmate', 'stalemate', 'insufficient material', 'fifty-move rule' or 'threefold repetition'), or None if it
+    # hasn't. The fifty-move rule and threefold repetition are treated as ending the game straight away, as if the draw
+    # had been claimed. Checkmate is looked for first, since a mate on the fiftieth move still wins.
+    def outcome(self):
+        if not self.has_legal_move():
+            if self.in_check(self.turn):
+                return ('0-1' if self.turn == 'W' else '1-0'), 'checkmate'
+            return '1/2-1/2', 'stalemate'
+        if self.insufficient_material():
+            return '1/2-1/2', 'insufficient material'
+        if self.halfmove_clock >= 100:
+            return '1/2-1/2', 'fifty-move rule'
+        if self.position_counts[self.hash] >= 3:
+            return '1/2-1/2', 'threefold repetition'
+        return None
+
+    # The play() method makes a packed move (as returned by legal_moves()) by handing it to the right make method for
+    # the piece being moved. En passant and castling are recognised from the squares, so only the promotion piece
+    # needs to be packed into the move.
+    def play(self, move):
+        start, end = board_indices[move & 63], board_indices[move >> 6 & 63]
+        kind = self.squares[start] & 7
+        if kind == PAWN:
+            self.move_pawn(start, end, move >> 12 & 7 or QUEEN)
+        elif kind == KING:
+            self.move_king(start, end)
+        else:
+            self.apply_move(start, end, self.squares[start], end, None, NORMAL)
+
+    # The pseudo_legal_moves() method generates every move the pieces of one colour could make from the bitboards,
+    # without worrying yet about whether the move leaves the king in check. Moves are returned as packed integers (see
+    # chess_board.pack_move), with flags for promotions, en passant, double pawn pushes and castling. With noisy True
+    # only captures, en passant and promotions are generated.
+    def pseudo_legal_moves(self, colour, noisy=False):
+        return self.bitboards_for(colour).pseudo_legal_moves(noisy)
+
+    # The leaves_king_safe() method tries a move out on the bitboards and returns True if the king of the side making it
+    # is not in check afterwards. The move is always taken back again before returning. Moves from the chess_pieces
+    # rules come without the special-move flag, which is worked out from the squares as play() does: a king moving two
+    # squares is castling and a pawn moving diagonally onto the en passant square captures en passant.
+    def leaves_king_safe(self, move, colour):
+        bitboards = self.bitboards_for(colour)
+        if move >> 15 == NORMAL:
+            origin, destination = move & 63, move >> 6 & 63
+            kind = bitboards.squares[origin] & 7
+            if kind == KING and abs(destination - origin) == 2:
+                move |= CASTLING << 15
+            elif kind == PAWN and destination == bitboards.en_passant and (destination - origin) % 8:
+                move |= EN_PASSANT << 15
+        side = bitboards.side
+        bitboards.make(move)
+        safe = not bitboards.in_check(side)
+        bitboards.unmake()
+        return safe
+
+    # The legal_moves() method returns every legal move for the given colour (the side to move by default) by
+    # generating the pseudo-legal moves and filtering out those that would leave the king in check, trying each one
+    # out on the bitboards alone.
+    def legal_moves(self, colour=None):
+        return self.bitboards_for(colour or self.turn).legal_moves()
+
+    # The legal_move_map() method returns the legal moves for the side to move as a dictionary from each origin square
+    # to a dictionary of the destination squares it can move to, with the packed move for each (a queen promotion where
+    # a pawn has a choice), using (row, col) squares. This lets a click be checked with a lookup. The map is worked out
+    # once per position and cached along with the position's hash, so it is recalculated after any make method (or
+    # unmake_move()) changes the position, without the make methods having to do anything themselves.
+    def legal_move_map(self):
+        if self.move_map is None or self.move_map_hash != self.hash:
+            move_map = {}
+            for move in self.legal_moves():
+                if move >> 12 & 7 in (EMPTY, QUEEN):
+                    move_map.setdefault(divmod(move & 63, 8), {})[divmod(move >> 6 & 63, 8)] = move
+            self.move_map, self.move_map_hash = move_map, self.hash
+        return self.move_map
+
+    # The probe_tablebase() method looks the position up in a set of endgame tablebases (a chess_tablebase.Tablebases),
+    # returning (result, plies) for the side to move, where result is 3 for a win, 2 for a draw or 1 for a loss and
+    # plies is the number of plies to mate. It returns None if the tables don't cover the position.
+    def probe_tablebase(self, tablebases):
+        return tablebases.probe(self)
 
+    # The perft() method walks the tree of legal moves down to the given depth and counts the leaf nodes. Comparing
+    # the counts against known reference values is the standard way of testing a move generator, and timing it gives
+    # a measure of its speed (see chess_perft.py).
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        moves = self.legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.play(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+        return nodes
@@ -0,0 +1,313 @@
+"""This file measures where the time goes: how many times the hot functions of each part of the program (move
+validation, check detection, board copies, move generation, the search, tablebase probes and rendering) are called
+for each move, and how long they take in total.
+
+Nothing is measured until enable() is called, and until then it costs nothing at all, since none of the measured code
+is changed: enable() replaces each registered function (a module function or a method of a class) with a wrapper that
+counts its calls and times them, and disable() puts the originals back. Calls made from inside another call to the same
+function (eg. the search's recursion) are counted but not timed again, so a function's time is never counted twice.
+The registry at the bottom of this file lists the functions measured for each part of the program, and more can be
+added with register() or the @instrumented decorator. Code can also be timed directly with 'with timer(name):' and
+events counted with count(name), which only do anything while measuring is enabled.
+
+The results are given by report() as a text table (calls, total, average and longest time, and calls per move, using
+the 'moves played' counter that the GUI and the workload add to) or by results() as a dictionary to be written out as
+JSON with dump_json(). Wrappers are shared by all threads, so times measured while two threads run the same function
+at once are approximate.
+
+Run 'python chess_instrument.py' to measure a standard workload (move generation, the chess_pieces rules, board copies,
+a search and, if pygame is installed, rendering), with '--json path' to also write the results to a file."""
+
+import functools
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+enabled = False
+registry = []  # (subsystem, module name, qualified name) of every function to measure
+stats = {}  # 'subsystem: name' -> Stat
+patched = []  # (owner, attribute, original) for everything replaced by enable()
+
+
+class Stat:
+    # A Stat holds the measurements of one function or timer. depth counts the calls currently running, so that only
+    # the outermost call of a recursion is timed.
+    def __init__(self, subsystem, name):
+        self.subsystem = subsystem
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+        self.depth = 0
+
+    def add_time(self, seconds):
+        self.seconds += seconds
+        self.longest = max(self.longest, seconds)
+
+    def as_dict(self):
+        return {'subsystem': self.subsystem, 'name': self.name, 'calls': self.calls, 'seconds': round(self.seconds, 6),
+                'average_us': round(self.seconds / self.calls * 1e6, 3) if self.calls else 0.0,
+                'longest_us': round(self.longest * 1e6, 3)}
+
+
+def stat_for(subsystem, name):
+    key = f'{subsystem}: {name}'
+    if key not in stats:
+        stats[key] = Stat(subsystem, name)
+    return stats[key]
+
+
+# The register() function adds a function to be measured, by the name of its module and its qualified name (eg.
+# 'GameState.in_check'), under a subsystem. It takes effect the next time measuring is enabled.
+def register(subsystem, module_name, qualified_name):
+    if (subsystem, module_name, qualified_name) not in registry:
+        registry.append((subsystem, module_name, qualified_name))
+
+
+# The instrumented() decorator registers the function it decorates, leaving the function itself unchanged.
+def instrumented(subsystem):
+    def decorate(function):
+        register(subsystem, function.__module__, function.__qualname__)
+        return function
+    return decorate
+
+
+def wrap(stat, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stat.calls += 1
+        if stat.depth:
+            stat.depth += 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat.depth -= 1
+        stat.depth = 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stat.add_time(time.perf_counter() - start)
+            stat.depth = 0
+    return wrapper
+
+
+# The find_module() function returns the loaded module with the given name. A module being run as a script is loaded
+# as __main__, and importing it by name would load a second copy that isn't the one running, so __main__ is returned
+# when it is the module's file.
+def find_module(module_name):
+    main = sys.modules.get('__main__')
+    if module_name not in sys.modules and getattr(main, '__file__', None):
+        spec = importlib.util.find_spec(module_name)
+        if spec and spec.origin and os.path.abspath(spec.origin) == os.path.abspath(main.__file__):
+            return main
+    return importlib.import_module(module_name)
+
+
+# The enable() function starts measuring, replacing every registered function with a wrapper. A module function is
+# also replaced in every other loaded module that imported it by name. Modules that aren't installed are skipped.
+def enable():
+    global enabled
+    if enabled:
+        return
+    enabled = True
+    for subsystem, module_name, qualified_name in registry:
+        try:
+            owner = find_module(module_name)
+        except ImportError:
+            continue
+        *class_names, attribute = qualified_name.split('.')
+        for class_name in class_names:
+            owner = getattr(owner, class_name)
+        original = inspect.getattr_static(owner, attribute)
+        stat = stat_for(subsystem, qualified_name)
+        if isinstance(original, staticmethod):
+            replacement = staticmethod(wrap(stat, original.__func__))
+        elif isinstance(original, classmethod):
+            replacement = classmethod(wrap(stat, original.__func__))
+        else:
+            replacement = wrap(stat, original)
+        patched.append((owner, attribute, original))
+        setattr(owner, attribute, replacement)
+        if not class_names:
+            for module in list(sys.modules.values()):
+                if module is not owner and getattr(module, attribute, None) is original:
+                    patched.append((module, attribute, original))
+                    setattr(module, attribute, replacement)
+
+
+# The disable() function stops measuring and puts every original function back. The measurements are kept until
+# reset() is called.
+def disable():
+    global enabled
+    for owner, attribute, original in reversed(patched):
+        setattr(owner, attribute, original)
+    patched.clear()
+    enabled = False
+
+
+def reset():
+    stats.clear()
+
+
+# The profile() context manager measures the code inside it: 'with profile(): ...'.
+@contextmanager
+def profile():
+    enable()
+    try:
+        yield stats
+    finally:
+        disable()
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class Timer:
+    def __init__(self, stat):
+        self.stat = stat
+
+    def __enter__(self):
+        self.stat.calls += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.stat.add_time(time.perf_counter() - self.start)
+        return False
+
+
+# The timer() function returns a context manager that times the code inside it under a name (eg. 'rendering: frame'),
+# or does nothing if measuring isn't enabled.
+def timer(name, subsystem='timers'):
+    if not enabled:
+        return null_timer
+    return Timer(stat_for(subsystem, name))
+
+
+# The count() function adds to a counter, if measuring is enabled.
+def count(name, amount=1, subsystem='counters'):
+    if enabled:
+        stat_for(subsystem, name).calls += amount
+
+
+def results():
+    ordered = sorted(stats.values(), key=lambda stat: (stat.subsystem, -stat.seconds))
+    return {'enabled': enabled, 'stats': [stat.as_dict() for stat in ordered]}
+
+
+def dump_json(path):
+    with open(path, 'w') as file:
+        json.dump(results(), file, indent=1)
+
+
+# The report() function returns the measurements as a text table grouped by subsystem, slowest first. If per is the
+# name of a counter or measured function (eg. 'moves played'), each function's calls per count of that one are shown
+# as well. GameState.play() itself is no use for this, as it is also called to try moves out.
+def report(per=None):
+    units = next((stat.calls for stat in stats.values() if stat.name == per), 0)
+    lines = [f'{"":40}{"calls":>12}{"total ms":>12}{"avg us":>10}{"max us":>10}' +
+             (f'{"per " + per:>28}' if units else '')]
+    subsystems = sorted({stat.subsystem for stat in stats.values()})
+    for subsystem in subsystems:
+        lines.append(subsystem)
+        for stat in sorted((stat for stat in stats.values() if stat.subsystem == subsystem),
+                           key=lambda stat: -stat.seconds):
+            average = stat.seconds / stat.calls * 1e6 if stat.calls else 0.0
+            line = f'  {stat.name:38}{stat.calls:>12,}{stat.seconds * 1000:>12.1f}{average:>10.2f}' \
+                   f'{stat.longest * 1e6:>10.0f}'
+            if units:
+                line += f'{stat.calls / units:>28.2f}'
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+# The functions measured for each part of the program.
+for registered in [('move validation', 'chess_pieces', name + '.check_move') for name in
+                   ('Pawn', 'Knight', 'Bishop', 'Rook', 'Queen', 'King')] + [
+        ('move validation', 'chess_pieces', 'piece_rules_allow'),
+        ('move validation', 'chess_game_state', 'GameState.leaves_king_safe'),
+        ('check detection', 'chess_game_state', 'GameState.in_check'),
+        ('board copy', 'chess_game_state', 'GameState.future_board'),
+        ('move generation', 'chess_game_state', 'GameState.legal_moves'),
+        ('move generation', 'chess_game_state', 'GameState.pseudo_legal_moves'),
+        ('move generation', 'chess_game_state', 'GameState.legal_move_map'),
+        ('moves', 'chess_game_state', 'GameState.play'),
+        ('moves', 'chess_game_state', 'GameState.unmake_move'),
+        ('evaluation', 'chess_evaluation', 'evaluate'),
+        ('search', 'chess_search', 'Search.search'),
+        ('search', 'chess_search', 'Search.negamax'),
+        ('search', 'chess_search', 'Search.quiescence'),
+        ('search', 'chess_search', 'Search.order_moves'),
+        ('tablebases', 'chess_tablebase', 'Tablebases.probe'),
+        ('rendering', 'chess_main', 'render_board'),
+        ('rendering', 'chess_main', 'render_squares'),
+        ('rendering', 'chess_main', 'square_states')]:
+    register(*registered)
+
+
+# The workload() function runs a little of everything that is measured, for a standard report.
+def workload():
+    import random
+    from chess_board import board_indices, coordinates
+    from chess_game_state import GameState
+    from chess_pieces import piece_rules_allow
+    from chess_search import Search
+
+    generator = random.Random(1)
+    game = GameState()
+    for _ in range(60):  # A random game, checking every legal move against the chess_pieces rules and copying boards
+        moves = game.legal_moves()
+        if not moves:
+            break
+        for move in moves:
+            piece_rules_allow(game, coordinates[board_indices[move & 63]], coordinates[board_indices[move >> 6 & 63]])
+        game.future_board()
+        game.play(generator.choice(moves))
+        count('moves played', subsystem='moves')
+    GameState().perft(3)
+    with timer('search to depth 4', 'search'):
+        Search(megabytes=4).search(GameState(), depth=4)
+    try:
+        import pygame
+    except ImportError:
+        return
+    import chess_main
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    chess_main.pygame = pygame
+    pygame.init()
+    screen = pygame.display.set_mode((chess_main.width, chess_main.height))
+    chess_main.load_images()
+    chess_main.load_highlights()
+    board_surface = chess_main.render_board()
+    shown = {}
+    game = GameState()
+    move_map = game.legal_move_map()
+    for selected in list(move_map) * 5:  # Selecting each piece in turn changes the highlights drawn every frame
+        with timer('frame', 'rendering'):
+            states = chess_main.square_states(game, selected, move_map[selected], None)
+            chess_main.render_squares(screen, board_surface, states, shown)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    with profile():
+        workload()
+    print(report(per='moves played'))
+    print(f'\nWorkload took {time.perf_counter() - start:.2f}s with measuring enabled')
+    if '--json' in sys.argv:
+        dump_json(sys.argv[sys.argv.index('--json') + 1])
@@ -1,16 +1,28 @@
 """This file acts as the main driver for our chess game. It handles the running of the game, user inputs and displaying
-the game graphically to the user. It gets the piece restrictions from the chess_pieces module, and the state of the
- board and other important information (location of pieces rules like check, etc.) from the game_state module. """
+the game graphically to the user. It gets the state of the board, the legal moves and other important information
+(location of pieces rules like check, etc.) from the game_state module. """
 
+import os
+import sys
+
+from chess_board import move_name
 from chess_game_state import GameState
-from chess_pieces import King, Queen, Rook, Bishop, Knight, Pawn
-import pygame
+from chess_instrument import count
+from chess_worker import EngineWorker
+
+pygame = None  # Imported by main(), so that this module can be imported without pygame or a display
 
 # We start by defining the board dimensions and initialising a dictionary that will store the piece images.
 
 width = height = 512
 sq_size = height // 8
+status_height = 28  # The bar under the board that shows how the game ended and the engine's thinking
+max_fps = 30  # The most times a second the screen is redrawn, however many events come in
 images = {}
+highlights = {}
+highlight_colours = {'selected': (246, 246, 105, 160), 'destination': (90, 140, 220, 120),
+                     'last move': (205, 210, 106, 110)}
+images_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Images')
 white_pieces = ['WP', 'WN', 'WB', 'WR', 'WQ', 'WK']
 black_pieces = ['BP', 'BN', 'BB', 'BR', 'BQ', 'BK']
 
@@ -20,124 +32,231 @@ black_pieces = ['BP', 'BN', 'BB', 'BR', 'BQ', 'BK']
 def load_images():
     pieces = white_pieces + black_pieces
     for piece in pieces:
-        images[piece] = pygame.transform.scale(pygame.image.load('/Users/james/Desktop/Python Projects/Chess/Images/' +
-                                                                 piece + '.png'), (sq_size, sq_size))
+        images[piece] = pygame.transform.scale(pygame.image.load(os.path.join(images_folder, piece + '.png')),
+                                               (sq_size, sq_size))
 
 
-# The render_board() function draws the board by alternating colours on odd and even squares, based on the screen size.
-def render_board(screen):
+# The render_board() function draws the empty board once, by alternating colours on odd and even squares, onto a
+# surface of its own. Squares are then redrawn by copying them from this surface rather than drawing them again.
+def render_board():
+    board_surface = pygame.Surface((width, height))
     for row in range(8):
         for col in range(8):
             color = pygame.Color('white') if (row + col) % 2 == 0 else pygame.Color('dark green')
-            pygame.draw.rect(screen, color, pygame.Rect(row * sq_size, col * sq_size, sq_size, sq_size))
+            pygame.draw.rect(board_surface, color, pygame.Rect(col * sq_size, row * sq_size, sq_size, sq_size))
+    return board_surface
+
+
+# The load_highlights() function makes the see-through squares laid over the board to highlight the selected piece,
+# the squares it can move to and the last move played.
+def load_highlights():
+    for highlight, color in highlight_colours.items():
+        highlights[highlight] = pygame.Surface((sq_size, sq_size), pygame.SRCALPHA)
+        highlights[highlight].fill(color)
 
 
-# The render_pieces() function blits the corresponding image of the piece occupying each square onto the board, relative
-# to the state of the board as tracked by the GameState module.
-def render_pieces(screen, board):
+# The square_states() function works out what each square should look like, as the piece on it and its highlight (or
+# None), from the state of the board as tracked by the GameState module, the square selected by the first click (or
+# the piece being dragged) and the squares the selected piece can move to. While a piece is being dragged its square is
+# drawn empty, since the piece is drawn under the mouse instead.
+def square_states(game, selected, destinations, dragging):
+    last_move = game.moves[-1] if game.moves else None
+    last_squares = (last_move & 63, last_move >> 6 & 63) if last_move is not None else ()
+    states = {}
     for row in range(8):
         for col in range(8):
-            piece = board[row][col]
+            highlight = None
+            if (row, col) == selected:
+                highlight = 'selected'
+            elif (row, col) in destinations:
+                highlight = 'destination'
+            elif row * 8 + col in last_squares:
+                highlight = 'last move'
+            piece = '~~' if dragging and (row, col) == selected else game.board[row][col]
+            states[(row, col)] = (piece, highlight)
+    return states
+
+
+# The squares_under() function returns the squares a rectangle on the screen overlaps, so that they can be redrawn
+# when a dragged piece moves off them.
+def squares_under(rect):
+    return [(row, col) for row in range(max(rect.top // sq_size, 0), min((rect.bottom - 1) // sq_size, 7) + 1)
+            for col in range(max(rect.left // sq_size, 0), min((rect.right - 1) // sq_size, 7) + 1)]
+
+
+# The render_squares() function redraws only the squares whose state has changed since they were last drawn (shown
+# holds what is on the screen for each square) and returns their rectangles, so that only those parts of the display
+# need updating. Clearing shown makes the next call redraw the whole board.
+def render_squares(screen, board_surface, states, shown):
+    dirty = []
+    for (row, col), state in states.items():
+        if shown.get((row, col)) != state:
+            piece, highlight = state
+            rect = pygame.Rect(col * sq_size, row * sq_size, sq_size, sq_size)
+            screen.blit(board_surface, rect, rect)
+            if highlight:
+                screen.blit(highlights[highlight], rect)
             if piece != '~~':
-                screen.blit(images[piece], pygame.Rect(col * sq_size, row * sq_size, sq_size, sq_size))
+                screen.blit(images[piece], rect)
+            shown[(row, col)] = state
+            dirty.append(rect)
+    return dirty
+
+
+# The render_status() function draws a line of text in the status bar under the board (how the game ended, or the
+# engine's thinking) and returns its rectangle.
+def render_status(screen, font, text):
+    rect = pygame.Rect(0, height, width, status_height)
+    screen.fill((40, 40, 40), rect)
+    screen.blit(font.render(text, True, (230, 230, 230)), (6, height + (status_height - font.get_height()) // 2))
+    return rect
 
 
-# The render_game_state() function combines the above functions and is called to update the graphical representation
-# of the board to the user after each move.
-def render_game_state(screen, gs):
-    render_board(screen)
-    render_pieces(screen, gs.board)
-    pygame.display.update()
+# The thinking_text() function describes an engine reply for the status bar: the depth, score and principal variation.
+def thinking_text(pondering, result):
+    score = f'mate {result.mate_in()}' if result.mate_in() is not None else f'{result.score / 100:+.2f}'
+    return f'{"Pondering" if pondering else "Thinking"}: depth {result.depth} {score} ' \
+           f'{" ".join(move_name(move) for move in result.pv[:6])}'
 
 
 # The main() function handles the running of the game. We start by initialising GameState and display the board and
-# pieces to the user. While the game is running, we accept user input in the form of a double click: first on the piece
-# they wish to move and the second click on the target square. We then call the relevant methods from the game_state
-# module to evaluate whether the request constitutes a legal move. If it does, we execute the move and graphically
-# represent it to the user.
-def main():
+# pieces to the user. While the game is running, we accept user input either as two clicks (first on the piece they
+# wish to move and then on the target square) or by dragging the piece to the target square. The legal moves for the
+# side to move come from GameState.legal_move_map(), which works them out once per turn, so checking a move is just a
+# lookup, and the same moves are used to highlight where the selected piece can go. The loop sleeps until an event
+# arrives rather than spinning, only redraws the squares that have changed, and never redraws more than max_fps times
+# a second, so an idle board uses no CPU. After every move GameState.outcome() checks whether the game has ended, and
+# if it has the result is shown in a status bar under the board and no more moves can be made.
+#
+# If engine_colour is 'W' or 'B' the engine plays that side, thinking for think_ms milliseconds a move in a background
+# process (see chess_worker) whose replies arrive as pygame events, so the window keeps responding while it thinks.
+# Its depth, score and principal variation are shown in the status bar. During the player's turn it
+# ponders on the reply it expects. Clicking while it thinks makes it play the best move it has found so far, and
+# pressing R resigns the game for the player.
+def main(engine_colour=None, think_ms=1000):
+    global pygame
+    import pygame
+    engine_event = pygame.USEREVENT + 1
+    engine = None
+    if engine_colour:  # Started before pygame.init(), so that the engine process doesn't inherit the display
+        engine = EngineWorker(on_reply=lambda reply: pygame.event.post(pygame.event.Event(engine_event, reply=reply)))
     pygame.init()
-    screen = pygame.display.set_mode((width, height))
+    screen = pygame.display.set_mode((width, height + status_height))
+    clock = pygame.time.Clock()
+    font = pygame.font.Font(None, 22)
     game = GameState()  # gs is now an instance of the game
-    future_board = game.future_board()
     load_images()
-    piece_classes = {  # Now when we check what piece code is at a square, we can evaluate its move restrictions too.
-        'WP': Pawn,
-        'BP': Pawn,
-        'WN': Knight,
-        'BN': Knight,
-        'WB': Bishop,
-        'BB': Bishop,
-        'WR': Rook,
-        'BR': Rook,
-        'WQ': Queen,
-        'BQ': Queen,
-        'WK': King,
-        'BK': King
-    }
-    move_queue = []  # Keeps track of last two clicks to determine the move intended
-    turns = 0
-    colours = ['W', 'B']  # List will be used to keep track of whose turn it is
-    colour = colours[0]  # White always starts
+    load_highlights()
+    board_surface = render_board()
+    shown = {}  # What is currently drawn on each square, so that only changed squares are redrawn
+    selected = None  # The square of the piece picked up by the first click or being dragged
+    dragging = False
+    drag_rect = None  # Where the dragged piece was last drawn
+    search_id = None  # The engine search whose replies are being followed
+    status, shown_status = '', None
+    game_over = False
+
+    # After either side moves, the game is checked for an ending (see GameState.outcome()), and otherwise the engine
+    # starts thinking if it is its turn
+    def after_move():
+        nonlocal game_over, search_id, status
+        ending = game.outcome()
+        if ending:
+            game_over, search_id = True, None
+            status = f'{ending[0]} by {ending[1]}'
+        elif engine and game.turn == engine_colour:
+            search_id, status = engine.search(game, think_ms), 'Thinking...'
+
+    def play_player_move(move):
+        if engine:
+            engine.stop()  # Stops pondering
+        game.play(move)
+        count('moves played', subsystem='moves')  # Only does anything with --profile
+        after_move()
+
+    after_move()
     running = True
     while running:
-        for event in pygame.event.get():
+        legal_moves = game.legal_move_map() if not game_over and game.turn != engine_colour else {}
+        for event in [pygame.event.wait()] + pygame.event.get():  # Wait for an event, then take any others queued up
             if event.type == pygame.QUIT:
                 running = False
-            elif event.type == pygame.MOUSEBUTTONDOWN:  # Getting user mouse input
-                x, y = pygame.mouse.get_pos()
-                row = y // sq_size
-                col = x // sq_size
-                sq_clicked = (row, col)  # xy coordinates of the square clicked
-                move_queue.append(sq_clicked)
-                if len(move_queue) == 2:  # Call move function after second click
-                    piece_code = game.board[move_queue[0][0]][move_queue[0][1]]
-                    if piece_code in piece_classes:
-                        piece_class = piece_classes[piece_code]
-                        if piece_class == Pawn:
-                            piece_selected = piece_class(move_queue[0], move_queue[1], game.board)
-                            if piece_selected.check_move() and game.check_turn(colour, move_queue[0]):
-                                future_board.make_pawn_move(move_queue[0], move_queue[1])
-                                if not future_board.in_check(colour):
-                                    game.make_pawn_move(move_queue[0], move_queue[1])
-                                    turns += 1
-                                    if turns % 2 == 0:
-                                        colour = colours[0]  # White's turn next
-                                    else:
-                                        colour = colours[1]  # Black's turn next
-                                    move_queue = []  # Reset variable to be used for the next move
-                        elif piece_class == King:
-                            piece_selected = King(move_queue[0], move_queue[1], game.board)
-                            if piece_selected.check_move() and game.check_turn(colour, move_queue[0]):
-                                future_board.make_king_move(move_queue[0], move_queue[1], colour)
-                                if not future_board.in_check(colour):
-                                    game.make_king_move(move_queue[0], move_queue[1], colour)
-                                    turns += 1
-                                    if turns % 2 == 0:
-                                        colour = colours[0]  # White's turn next
-                                    else:
-                                        colour = colours[1]  # Black's turn next
-                                    move_queue = []  # Reset variable to be used for the next move
-                        else:
-                            piece_selected = piece_class(move_queue[0], move_queue[1], game.board)
-                            if piece_selected.check_move() and game.check_turn(colour, move_queue[0]):
-                                future_board.make_move(move_queue[0], move_queue[1])
-                                if not future_board.in_check(colour):
-                                    game.make_move(move_queue[0], move_queue[1])
-                                    turns += 1
-                                    if turns % 2 == 0:
-                                        colour = colours[0]  # White's turn next
-                                    else:
-                                        colour = colours[1]  # Black's turn next
-                                    move_queue = []  # Reset variable to be used for the next move
-                                else:
-                                    print('King is in check!')
-                                    future_board = game.future_board()
-                                    move_queue = []
-                            else:
-                                move_queue = []
-        render_game_state(screen, game)
+            elif event.type == pygame.WINDOWEXPOSED:
+                shown.clear()  # Part of the window was covered or cleared, so draw the whole board again
+                shown_status = None
+            elif event.type == engine_event:
+                kind, reply_id, pondering, result = event.reply
+                if reply_id != search_id:
+                    continue  # A reply to a search that has since been replaced
+                status = thinking_text(pondering, result)
+                if kind == 'bestmove' and not pondering and result.best_move is not None and not game_over:
+                    game.play(result.best_move)
+                    count('moves played', subsystem='moves')
+                    status = f'Played {move_name(result.best_move)} ({status})'
+                    search_id = None
+                    after_move()
+                    if not game_over and len(result.pv) > 1 and result.pv[1] in game.legal_moves():
+                        search_id = engine.ponder(game, result.pv[1])
+                    legal_moves = game.legal_move_map() if not game_over else {}
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r and engine and not game_over:
+                engine.stop(wait=False)
+                game_over, search_id, selected = True, None, None
+                status = f'{"White" if engine_colour == "B" else "Black"} resigns'
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:  # Getting user mouse input
+                if engine and game.turn == engine_colour:
+                    engine.stop(wait=False)  # Move now: the engine plays the best move it has found so far
+                    continue
+                x, y = event.pos
+                sq_clicked = (y // sq_size, x // sq_size)  # Row and column of the square clicked
+                if selected is not None and sq_clicked in legal_moves[selected]:
+                    # Second click on a square the piece can move to
+                    play_player_move(legal_moves[selected][sq_clicked])
+                    legal_moves = game.legal_move_map() if not game_over and game.turn != engine_colour else {}
+                    selected = None
+                elif sq_clicked in legal_moves:
+                    selected, dragging = sq_clicked, True  # Pick the piece up, to be dropped or clicked elsewhere
+                else:
+                    selected = None
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1 and dragging:
+                x, y = event.pos
+                sq_released = (y // sq_size, x // sq_size)
+                if selected in legal_moves and sq_released in legal_moves[selected]:
+                    play_player_move(legal_moves[selected][sq_released])
+                    legal_moves = game.legal_move_map() if not game_over and game.turn != engine_colour else {}
+                    selected = None
+                elif sq_released != selected:
+                    selected = None  # Dropped somewhere it can't go, so put it back
+                dragging = False  # Released on its own square, so it stays selected for a second click
+        if drag_rect:
+            for square in squares_under(drag_rect):
+                shown.pop(square, None)  # Redraw the squares under where the dragged piece was
+            drag_rect = None
+        destinations = legal_moves.get(selected, {}) if selected is not None else {}
+        dirty = render_squares(screen, board_surface, square_states(game, selected, destinations, dragging), shown)
+        if dragging and selected is not None:
+            x, y = pygame.mouse.get_pos()
+            drag_rect = pygame.Rect(x - sq_size // 2, y - sq_size // 2, sq_size, sq_size)
+            screen.blit(images[game.board[selected[0]][selected[1]]], drag_rect)
+            dirty.append(drag_rect)
+        if status != shown_status:
+            dirty.append(render_status(screen, font, status))
+            shown_status = status
+        if dirty:
+            pygame.display.update(dirty)
+        clock.tick(max_fps)
+    if engine:
+        engine.close()
     pygame.quit()
 
 
-main()
+if __name__ == '__main__':
+    if '--profile' in sys.argv:  # Measure the game with chess_instrument and print where the time went at the end
+        import chess_instrument
+        with chess_instrument.profile():
+            main()
+        print(chess_instrument.report(per='moves played'))
+    elif '--engine' in sys.argv:  # eg. 'python chess_main.py --engine B --think 2000' to play White against it
+        main(sys.argv[sys.argv.index('--engine') + 1].upper(),
+             int(sys.argv[sys.argv.index('--think') + 1]) if '--think' in sys.argv else 1000)
+    else:
+        main()
@@ -0,0 +1,132 @@
+"""This file contains the parallel search, which spreads a search over several processes so that it can use more than
+one core (a single CPython process can only search on one core at a time).
+
+The legal moves at the root are dealt out between the workers in turn, in the order the search would try them, so each
+worker gets a share of the promising moves. Every worker runs its own iterative deepening search (see chess_search) on
+its share of the moves and reports back each depth it finishes. The position's score at a depth is the best score any
+worker found at that depth, so the results are combined at the deepest depth every worker finished. Each worker
+process keeps its own Search, and so its own transposition table, from one search to the next.
+
+With one worker no processes are started and the search runs in this process exactly as chess_search.Search would,
+so its results are deterministic whenever the search has a depth or node limit.
+
+Run this file to compare the parallel search against the single-process one at a fixed depth, eg.
+'python chess_parallel.py 4 5' for four workers searching to depth 5."""
+
+import multiprocessing
+import os
+import sys
+import time
+
+from chess_board import move_name
+from chess_game_state import GameState
+from chess_search import Search, SearchResult, MATE_BOUND
+
+worker_search = None  # The Search belonging to a worker process, made when the process starts
+
+
+def start_worker(megabytes, stop_event):
+    global worker_search
+    worker_search = Search(megabytes=megabytes, stop_event=stop_event)
+
+
+# The search_share() function runs in a worker process. It searches the position with the root moves limited to the
+# worker's share and returns the result of every depth it finished, along with its final result (for the nodes).
+def search_share(game, root_moves, time_ms, depth, nodes):
+    finished = []
+    worker_search.on_info = finished.append
+    final = worker_search.search(game, time_ms, depth, nodes, root_moves)
+    return finished, final
+
+
+class ParallelSearch:
+    # A ParallelSearch starts its worker processes once and reuses them for every search, so it should be kept for the
+    # whole game and closed at the end (or used in a with statement). workers defaults to the number of cores, and
+    # megabytes sets the size of each worker's transposition table.
+    def __init__(self, workers=None, megabytes=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.stop_event = multiprocessing.Event()
+        self.local_search = Search(megabytes=megabytes, stop_event=self.stop_event)
+        self.pool = None
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers, start_worker, (megabytes, self.stop_event))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    # The stop() method asks every worker to finish as soon as possible, as Search.stop() does.
+    def stop(self):
+        self.stop_event.set()
+
+    # The search() method takes the same limits as Search.search() and returns a SearchResult. A node limit is shared
+    # out evenly between the workers.
+    def search(self, game, time_ms=None, depth=None, nodes=None):
+        self.stop_event.clear()
+        moves = game.legal_moves()
+        if self.pool is None or len(moves) < 2:
+            return self.local_search.search(game, time_ms, depth, nodes)
+
+        start = time.perf_counter()
+        entry = self.local_search.table.probe(game.hash)
+        moves = self.local_search.order_moves(game, moves, entry[0] if entry else 0, 0)
+        shares = [moves[worker::self.workers] for worker in range(min(self.workers, len(moves)))]
+        share_nodes = max(1, nodes // len(shares)) if nodes else None
+        results = self.pool.starmap(search_share, [(game, share, time_ms, depth, share_nodes) for share in shares])
+
+        result = combine_results(results)
+        result.elapsed = time.perf_counter() - start
+        result.nodes_per_second = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+
+# The combine_results() function merges what the workers found into one SearchResult. A worker that stopped deepening
+# because it found a forced mate has its last result counted at every depth, since searching deeper wouldn't change
+# it. Ties go to the worker with the earlier share, so the result doesn't depend on which process finished first.
+def combine_results(results):
+    total_nodes = sum(final.nodes for _, final in results)
+    unfinished = [len(finished) for finished, _ in results if not finished or abs(finished[-1].score) < MATE_BOUND]
+    depth = min(unfinished) if unfinished else max(len(finished) for finished, _ in results)
+    if depth == 0:
+        # No worker finished a single depth in time, so fall back on the first share, which has the most likely move
+        final = results[0][1]
+        return SearchResult(final.best_move, final.score, 0, final.pv, total_nodes, 0.0)
+    best = None
+    for finished, _ in results:
+        candidate = finished[min(depth, len(finished)) - 1]
+        if best is None or candidate.score > best.score:
+            best = candidate
+    return SearchResult(best.best_move, best.score, depth, best.pv, total_nodes, 0.0)
+
+
+# The benchmark() function searches a few positions to a fixed depth with a single process and with the parallel
+# search, printing the time each took and the speedup.
+def benchmark(workers, depth):
+    openings = ([], ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6'], ['d2d4', 'd7d5', 'c2c4', 'e7e6', 'b1c3', 'g8f6'])
+    single_time = parallel_time = 0.0
+    with ParallelSearch(workers) as parallel:
+        for opening in openings:
+            game = GameState()
+            for name in opening:
+                game.play(next(move for move in game.legal_moves() if move_name(move) == name))
+            single = Search().search(game, depth=depth)
+            multiple = parallel.search(game, depth=depth)
+            single_time += single.elapsed
+            parallel_time += multiple.elapsed
+            print(f'{" ".join(opening) or "start"}: single {single.elapsed:.2f}s {move_name(single.best_move)} '
+                  f'({single.score}), {workers} workers {multiple.elapsed:.2f}s {move_name(multiple.best_move)} '
+                  f'({multiple.score})')
+    print(f'Speedup with {workers} workers at depth {depth}: {single_time / parallel_time:.2f}x')
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1,
+              int(sys.argv[2]) if len(sys.argv) > 2 else 4)
@@ -0,0 +1,60 @@
+"""This file runs perft ('performance test') counts on the move generator in the GameState module. Perft walks the tree
+of legal moves to a fixed depth and counts the leaf nodes. Because the correct counts for the standard reference
+positions are well known, any difference points to a bug in the move rules, and timing the walk tells us how fast move
+generation is. Run it from the command line with an optional maximum depth, eg. 'python chess_perft.py 3', and add
+'--bitboard' to walk the tree with a chess_bitboard BitboardPosition alone. GameState gets its moves from the same
+bitboards, but makes each move on its whole position (the mailbox, hash and score as well), so the difference between
+the two is the cost of keeping the rest of the position up to date."""
+
+import sys
+import time
+
+from chess_bitboard import BitboardPosition
+from chess_game_state import GameState
+
+# Each reference position has a function that sets it up and the known leaf counts for each depth. Besides the
+# starting position, they are the well-known test positions that exercise castling, en passant, promotions and checks.
+reference_positions = {
+    'Starting position': (GameState, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    'Kiwipete': (lambda: GameState.from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'),
+                 {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    'Position 3': (lambda: GameState.from_fen('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'),
+                   {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    'Position 4': (lambda: GameState.from_fen('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1'),
+                   {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    'Position 5': (lambda: GameState.from_fen('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8'),
+                   {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+}
+
+
+# The run_perft() function times a single perft count and returns the number of nodes together with the nodes per
+# second reached. If bitboard is True the count is made by a BitboardPosition set up from the same game.
+def run_perft(game, depth, bitboard=False):
+    position = BitboardPosition.from_game_state(game) if bitboard else None
+    start = time.perf_counter()
+    nodes = position.perft(depth) if bitboard else game.perft(depth)
+    elapsed = time.perf_counter() - start
+    return nodes, nodes / elapsed if elapsed > 0 else 0.0
+
+
+# The main() function runs every reference position up to the maximum depth, printing the count, whether it matches
+# the reference value and the speed. It returns False if any of the counts were wrong.
+def main(max_depth=3, bitboard=False):
+    all_passed = True
+    for name, (setup, expected_counts) in reference_positions.items():
+        print(name)
+        for depth, expected in sorted(expected_counts.items()):
+            if depth > max_depth:
+                break
+            nodes, nodes_per_second = run_perft(setup(), depth, bitboard)
+            passed = nodes == expected
+            all_passed = all_passed and passed
+            print(f'  depth {depth}: {nodes} nodes (expected {expected}) {"ok" if passed else "FAILED"}, '
+                  f'{nodes_per_second:,.0f} nodes/sec')
+    return all_passed
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--bitboard']
+    if not main(int(arguments[0]) if arguments else 3, '--bitboard' in sys.argv):
+        sys.exit(1)
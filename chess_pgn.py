@@ -0,0 +1,274 @@
+"""This file reads and writes games in PGN (Portable Game Notation), the standard text format for chess games, and
+converts moves to and from SAN (Standard Algebraic Notation, eg. 'Nf3', 'exd5', 'O-O' or 'e8=Q+'), the notation PGN
+uses for moves.
+
+The reader is a generator: read_games() yields one PgnGame at a time as it reaches the end of each game, so a file of
+any size is read with the memory needed for a single game, and games can be processed (or the reading stopped) as
+they arrive. A PgnGame holds the game's tags and its moves as SAN strings; replay() plays them out on a GameState,
+which is also where illegal moves are found. Comments, variations and numeric annotation glyphs are skipped.
+
+Run this file on a PGN file to time reading it, eg. 'python chess_pgn.py games.pgn', and add '--replay' to also play
+out every move."""
+
+import re
+import sys
+import time
+
+from chess_board import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, CASTLING, board_indices, square_name
+from chess_game_state import GameState, starting_fen
+
+piece_letters = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q', KING: 'K'}
+letter_pieces = {letter: kind for kind, letter in piece_letters.items()}
+results = ('1-0', '0-1', '1/2-1/2', '*')
+seven_tag_roster = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+san_pattern = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+tag_pattern = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+token_pattern = re.compile(r'\{[^}]*\}?|;.*|\(|\)|\$\d+|[^\s{}();$]+')
+move_number_pattern = re.compile(r'^\d+\.+')
+
+
+# The move_to_san() function writes a legal packed move (see chess_board.pack_move) in SAN for the position in a
+# GameState. The file or rank of the piece is only added when another piece of the same kind could also move to the
+# same square, and a '+' or '#' is added for check or checkmate (which means trying the move out on the board).
+def move_to_san(game, move):
+    origin, destination = move & 63, move >> 6 & 63
+    kind = game.squares[board_indices[origin]] & 7
+    captured = game.squares[board_indices[destination]] != EMPTY
+    if move >> 15 == CASTLING:
+        san = 'O-O' if destination > origin else 'O-O-O'
+    elif kind == PAWN:
+        captured = origin & 7 != destination & 7
+        san = (square_name(origin)[0] + 'x' if captured else '') + square_name(destination)
+        if move >> 12 & 7:
+            san += '=' + piece_letters[move >> 12 & 7]
+    else:
+        rivals = [other & 63 for other in game.legal_moves() if other >> 6 & 63 == destination and
+                  other & 63 != origin and game.squares[board_indices[other & 63]] & 7 == kind]
+        qualifier = ''
+        if rivals:
+            if all(rival & 7 != origin & 7 for rival in rivals):
+                qualifier = square_name(origin)[0]
+            elif all(rival >> 3 != origin >> 3 for rival in rivals):
+                qualifier = square_name(origin)[1]
+            else:
+                qualifier = square_name(origin)
+        san = piece_letters[kind] + qualifier + ('x' if captured else '') + square_name(destination)
+    game.play(move)
+    if game.in_check(game.turn):
+        san += '#' if not game.legal_moves() else '+'
+    game.unmake_move()
+    return san
+
+
+# The san_to_move() function finds the legal packed move in a GameState that a SAN string describes. Check marks and
+# annotations such as '!' or '?' are ignored, and castling may be written with zeros. A ValueError is raised if no
+# legal move, or more than one, matches.
+def san_to_move(game, san):
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        long_castle = len(text) == 5
+        for move in game.pseudo_legal_moves(game.turn):
+            if move >> 15 == CASTLING and (move >> 6 & 63 < move & 63) == long_castle and \
+                    game.leaves_king_safe(move, game.turn):
+                return move
+        raise ValueError(f'Illegal move {san!r} in position {game.to_fen()}')
+    match = san_pattern.match(text)
+    if not match:
+        raise ValueError(f'Not a SAN move: {san!r}')
+    letter, file, rank, destination, promotion = match.groups()
+    kind = letter_pieces[letter] if letter else PAWN
+    destination = (8 - int(destination[1])) * 8 + 'abcdefgh'.index(destination[0])
+    promotion = letter_pieces[promotion] if promotion else (QUEEN if kind == PAWN and destination >> 3 in (0, 7)
+                                                             else EMPTY)
+    matches = []
+    for move in game.pseudo_legal_moves(game.turn):  # Only the moves that match are checked for legality
+        origin = move & 63
+        if move >> 6 & 63 != destination or game.squares[board_indices[origin]] & 7 != kind or \
+                move >> 12 & 7 != promotion or move >> 15 == CASTLING:
+            continue
+        if (file and square_name(origin)[0] != file) or (rank and square_name(origin)[1] != rank):
+            continue
+        if kind == PAWN and not file and origin & 7 != destination & 7:
+            continue  # A pawn move without a file is a push, not a capture
+        if game.leaves_king_safe(move, game.turn):
+            matches.append(move)
+    if len(matches) != 1:
+        raise ValueError(f'{"Ambiguous" if matches else "Illegal"} move {san!r} in position {game.to_fen()}')
+    return matches[0]
+
+
+class PgnGame:
+    # A PgnGame is one game as read from a PGN file: its tags (eg. headers['White']), its moves as SAN strings and its
+    # result ('1-0', '0-1', '1/2-1/2' or '*' if unknown).
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    # The start() method returns a GameState set up in the position the game starts from, which is the position in the
+    # FEN tag if there is one.
+    def start(self):
+        fen = self.headers.get('FEN')
+        return GameState.from_fen(fen) if fen else GameState()
+
+    # The replay() method plays every move of the game out on a GameState and returns it. A ValueError naming the move
+    # is raised if a move can't be read or isn't legal.
+    def replay(self):
+        game = self.start()
+        for number, san in enumerate(self.moves):
+            try:
+                game.play(san_to_move(game, san))
+            except ValueError as error:
+                raise ValueError(f'Move {number // 2 + 1}{"." if number % 2 == 0 else "..."} {san}: {error}')
+        return game
+
+    # The format() method writes the game back out as PGN text.
+    def format(self):
+        game = self.start()
+        return format_pgn(self.headers, self.moves, self.result, game.fullmove_number, game.turn)
+
+
+# The read_games() function reads PGN text from lines (an open file or any other iterable of strings) and yields a
+# PgnGame for each game in turn. Only the current game is kept in memory.
+def read_games(lines):
+    headers, moves = {}, []
+    in_comment = False
+    variation_depth = 0
+    for line in lines:
+        if in_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line, in_comment = line[end + 1:], False
+        stripped = line.strip()
+        if not stripped or stripped.startswith('%'):
+            continue
+        if stripped.startswith('[') and variation_depth == 0:
+            tag = tag_pattern.match(stripped)
+            if tag:
+                if moves:  # A tag after some moves starts the next game, even if this one had no result
+                    yield PgnGame(headers, moves, headers.get('Result', '*'))
+                    headers, moves = {}, []
+                headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+        for token in token_pattern.findall(line):
+            first = token[0]
+            if first == '{':
+                in_comment = not token.endswith('}')
+            elif first == '(':
+                variation_depth += 1
+            elif first == ')':
+                variation_depth = max(0, variation_depth - 1)
+            elif first in ';$' or variation_depth:
+                continue
+            elif token in results:
+                yield PgnGame(headers, moves, token)
+                headers, moves = {}, []
+            else:
+                token = move_number_pattern.sub('', token)
+                if token:
+                    moves.append(token)
+    if headers or moves:
+        yield PgnGame(headers, moves, headers.get('Result', '*'))
+
+
+# The open_games() function reads the games in a PGN file, opening the file itself. Characters that aren't valid UTF-8
+# are replaced rather than stopping the read, since old PGN files often use other encodings in names.
+def open_games(path):
+    with open(path, encoding='utf-8', errors='replace') as file:
+        yield from read_games(file)
+
+
+# The format_pgn() function writes a game's tags and SAN moves as PGN text. The tags of the seven tag roster come first
+# (with '?' for any that are missing) and the move text is wrapped to 80 characters. first_move_number and first_turn
+# give the move number and side to move of the starting position, for games that don't start from the usual position.
+def format_pgn(headers, moves, result='*', first_move_number=1, first_turn='W'):
+    headers = dict(headers)
+    headers['Result'] = result
+    lines = []
+    for name in seven_tag_roster:
+        lines.append(f'[{name} "{escape_tag(headers.get(name, "????.??.??" if name == "Date" else "?"))}"]')
+    for name, value in headers.items():
+        if name not in seven_tag_roster:
+            lines.append(f'[{name} "{escape_tag(value)}"]')
+    lines.append('')
+
+    tokens = []
+    number, turn = first_move_number, first_turn
+    for position, san in enumerate(moves):
+        if turn == 'W':
+            tokens.append(f'{number}. {san}')  # A move number is kept on the same line as its move
+        elif position == 0:
+            tokens.append(f'{number}... {san}')
+        else:
+            tokens.append(san)
+        if turn == 'B':
+            number += 1
+        turn = 'B' if turn == 'W' else 'W'
+    tokens.append(result)
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f'{line} {token}' if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+def escape_tag(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+# The format_game() function writes out the moves played in a GameState as PGN text, with any extra tags given in
+# headers. Games that didn't start from the usual position get SetUp and FEN tags.
+def format_game(game, headers=None, result='*'):
+    headers = dict(headers or {})
+    replay = GameState.from_fen(game.initial_fen)
+    if game.initial_fen != starting_fen:
+        headers['SetUp'], headers['FEN'] = '1', game.initial_fen
+    first_move_number, first_turn = replay.fullmove_number, replay.turn
+    moves = []
+    for move in game.moves:
+        moves.append(move_to_san(replay, move))
+        replay.play(move)
+    return format_pgn(headers, moves, result, first_move_number, first_turn)
+
+
+# The write_games() function writes PGN text for each game given to an open file, one at a time, so any number of
+# games can be written without holding them all in memory. Each game is either a PgnGame or a GameState.
+def write_games(file, games):
+    count = 0
+    for game in games:
+        file.write(game.format() if isinstance(game, PgnGame) else format_game(game))
+        count += 1
+    return count
+
+
+# The benchmark() function reads every game in a PGN file (replaying the moves too if replay is True) and reports
+# how many games a second were read.
+def benchmark(path, replay=False):
+    start = time.perf_counter()
+    games = moves = errors = 0
+    for pgn_game in open_games(path):
+        games += 1
+        moves += len(pgn_game.moves)
+        if replay:
+            try:
+                pgn_game.replay()
+            except ValueError as error:
+                errors += 1
+                print(f'Game {games}: {error}')
+        if games % 10000 == 0:
+            print(f'{games} games, {games / (time.perf_counter() - start):,.0f} games/sec')
+    elapsed = time.perf_counter() - start
+    print(f'{games} games ({moves} moves{f", {errors} with errors" if replay else ""}) in {elapsed:.2f}s: '
+          f'{games / elapsed if elapsed > 0 else 0:,.0f} games/sec')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python chess_pgn.py games.pgn [--replay]')
+    benchmark(sys.argv[1], '--replay' in sys.argv)
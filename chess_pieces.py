@@ -5,26 +5,34 @@ The first square clicked on (self.start_row + self.start_col -> self.origin) wil
 (self.board) when the move is played. The check_move() methods for each evaluate whether the move being requested by the
 player is legal for the given piece."""
 
+from chess_board import pack_move
+
 # Each of these piece 'codes' stand for one of the six piece types and are used to keep track of positions on the
-# board in the GameState module
+# board in the GameState module. They are kept in sets so that the 'destination in white_pieces' tests in each
+# check_move() method are a single hash lookup rather than a scan through a list.
 
-white_pieces = ['WP', 'WN', 'WB', 'WR', 'WQ', 'WK']
-black_pieces = ['BP', 'BN', 'BB', 'BR', 'BQ', 'BK']
+white_pieces = {'WP', 'WN', 'WB', 'WR', 'WQ', 'WK'}
+black_pieces = {'BP', 'BN', 'BB', 'BR', 'BQ', 'BK'}
 
 
 class Pawn:
-    def __init__(self, start, end, board):
+    def __init__(self, start, end, board, en_passant=None):
         self.start_row, self.start_col = start
         self.end_row, self.end_col = end
         self.origin, self.destination = board[self.start_row][self.start_col], board[self.end_row][self.end_col]
         self.board = board
+        self.en_passant = en_passant  # The (row, col) square a pawn can capture en passant onto, if there is one
 
     # Pawns can move forward one square if that square is unoccupied. They capture enemy pieces by moving diagonally
     # forward. Additionally, pawns on their starting square may move forward two spaces, providing both are unoccupied.
     # We need to check the colour of the pawn because pawns are the only piece that can't move backwards, so the
-    # coordinate delta conditions will be different for white and black.
+    # coordinate delta conditions will be different for white and black. A pawn may also capture en passant by moving
+    # diagonally forward onto the en passant square.
 
     def check_move(self):
+        if (self.end_row, self.end_col) == self.en_passant and self.start_col - self.end_col in [-1, 1] and \
+                self.end_row - self.start_row == (-1 if self.origin == 'WP' else 1):
+            return True
         if self.origin == 'WP':
             if self.start_row == 6:  # Starting row for white in our code
                 if self.end_row == 4 and self.start_col == self.end_col and self.destination == '~~' and \
@@ -98,7 +106,7 @@ class Bishop:
                     else -1  # The differences here dictate the direction of piece travel
                 r, c = self.start_row + row_step, self.start_col + col_step
                 while r != self.end_row and c != self.end_col:
-                    if self.board[r][c] != '~~' and self.board[r][c] != self.destination:
+                    if self.board[r][c] != '~~':
                         return False  # If square is not empty or the target square, there must be a piece in the way
                     r, c = r + row_step, c + col_step
                 return True
@@ -122,7 +130,7 @@ class Rook:
                 row_step = 1 if self.end_row > self.start_row else -1
                 r = self.start_row + row_step
                 while r != self.end_row:
-                    if self.board[r][self.start_col] != '~~' and self.board[r][self.start_col] != self.destination:
+                    if self.board[r][self.start_col] != '~~':
                         return False
                     r += row_step
                 return True
@@ -154,7 +162,7 @@ class Queen:
                     row_step = 1 if self.end_row > self.start_row else -1
                     r = self.start_row + row_step
                     while r != self.end_row:
-                        if self.board[r][self.start_col] != '~~' and self.board[r][self.start_col] != self.destination:
+                        if self.board[r][self.start_col] != '~~':
                             return False
                         r += row_step
                     return True
@@ -173,7 +181,7 @@ class Queen:
                                                                                           self.start_col else -1
                     r, c = self.start_row + row_step, self.start_col + col_step
                     while r != self.end_row and c != self.end_col:
-                        if self.board[r][c] != '~~' and self.board[r][c] != self.destination:
+                        if self.board[r][c] != '~~':
                             return False
                         r, c = r + row_step, c + col_step
                     return True
@@ -181,7 +189,7 @@ class Queen:
 
 
 class King:
-    def __init__(self, start, end, board, move_tracker):
+    def __init__(self, start, end, board, move_tracker=None):
         self.start_row, self.start_col = start
         self.end_row, self.end_col = end
         self.origin, self.destination = board[self.start_row][self.start_col], board[self.end_row][self.end_col]
@@ -190,32 +198,35 @@ class King:
 
     # The king can move in any direction by one square (unless castling). We just need to make sure the move
     # requested has a maximum delta of 1 and check whether the target is occupied by a friendly piece. However we
-    # will first check whether the player is attempting to castle and evaluate the legality by calling the castle()
-    # method from the MoveTracker class. We will handle 'check' restrictions in a separate function.
+    # will first check whether the player is attempting to castle (moving the king two squares along its home row) and
+    # evaluate the legality by calling the castling_allowed() method of the GameState passed in as move_tracker.
+    # Without a move_tracker castling is never allowed. We will handle 'check' restrictions in a separate function.
     def check_move(self):
-        if self.origin == 'WK' and self.destination not in white_pieces:
-            if (self.start_row == 7 and self.end_col == 4) and (self.end_row == 7 and self.end_col == 6):
-                move = self.move_tracker.castle('W', 'kingside')
-                if move:
-                    return True
-            elif (self.start_row == 7 and self.end_col == 4) and (self.end_row == 7 and self.end_col == 2):
-                move = self.move_tracker.castle('W', 'queenside')
-                if move:
-                    return True
-            else:
-                valid_moves = (
-                (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))  # The 8 possible moves
-                return (self.end_row - self.start_row, self.end_col - self.start_col) in valid_moves
-        elif self.origin == 'BK' and self.destination not in black_pieces:
-            if (self.start_row == 0 and self.end_col == 4) and (self.end_row == 0 and self.end_col == 6):
-                move = self.move_tracker.castle('B', 'kingside')
-                if move:
-                    return True
-            elif (self.start_row == 0 and self.end_col == 4) and (self.end_row == 0 and self.end_col == 6):
-                move = self.move_tracker.castle('B', 'queenside')
-                if move:
-                    return True
-            else:
-                valid_moves = (
+        if (self.origin == 'WK' and self.destination not in white_pieces) or (self.origin == 'BK' and self.destination
+                                                                              not in black_pieces):
+            colour = self.origin[0]
+            home_row = 7 if colour == 'W' else 0
+            if (self.start_row, self.start_col) == (home_row, 4) and self.end_row == home_row and \
+                    self.end_col in (2, 6):
+                side = 'Kingside' if self.end_col == 6 else 'Queenside'
+                return self.move_tracker is not None and self.move_tracker.castling_allowed(colour, side)
+            valid_moves = (
                 (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))  # The 8 possible moves
-                return (self.end_row - self.start_row, self.end_col - self.start_col) in valid_moves
+            return (self.end_row - self.start_row, self.end_col - self.start_col) in valid_moves
+        return False
+
+
+# The piece_rules_allow() function asks the chess_pieces rules whether a move is legal in a GameState: the piece class
+# must accept the move and the mover's king must not be in check once it has been made.
+def piece_rules_allow(game, origin, destination):
+    piece = game.get_piece(*origin)
+    if piece is None or not game.check_turn(game.turn, origin):
+        return False
+    if piece == King:
+        allowed = piece(origin, destination, game.board, game).check_move()
+    elif piece == Pawn:
+        allowed = piece(origin, destination, game.board, game.en_passant_square).check_move()
+    else:
+        allowed = piece(origin, destination, game.board).check_move()
+    return bool(allowed) and game.leaves_king_safe(pack_move(origin[0] * 8 + origin[1],
+                                                             destination[0] * 8 + destination[1]), game.turn)
@@ -0,0 +1,355 @@
+"""This file contains the search, which picks a move for the side to move in a GameState. It is a negamax alpha-beta
+search: every score is from the point of view of the side to move, so a child position's score is negated on the way
+back up, and branches that can't change the result (because the opponent would never allow them) are cut off.
+
+The search runs by iterative deepening: it searches to depth 1, then depth 2, and so on until its budget of time or
+nodes is spent, always keeping the best move from the last depth it finished. That way there is an answer ready as soon
+as the budget runs out, however little time it is given. Each new depth also starts from the best moves found so far,
+which makes the cut-offs much more effective. At depth 0, a quiescence search plays out the captures still available,
+so that the position isn't scored in the middle of an exchange.
+
+Moves are searched in the order most likely to cause a cut-off: the best move stored in the transposition table, then
+captures ordered by MVV-LVA (most valuable victim, least valuable attacker), then the 'killer' quiet moves that caused
+cut-offs at the same depth elsewhere, then the other quiet moves by their history score.
+
+Run this file to search the starting position, eg. 'python chess_search.py 2000' for a two second search."""
+
+import sys
+import time
+
+from chess_board import EMPTY, QUEEN, EN_PASSANT, board_indices, move_name
+from chess_evaluation import evaluate, piece_values
+from chess_game_state import GameState
+from chess_transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+MATE = 30000  # The score for checkmate. Being mated in n plies scores -(MATE - n), so quicker mates score higher
+MATE_BOUND = MATE - 1000  # Any score beyond this is a mate score
+INFINITY = 32000
+MAX_PLY = 64
+CHECK_INTERVAL = 64  # How many nodes to search between checks of the clock
+
+
+class SearchAborted(Exception):
+    # Raised inside the search when the time or node budget runs out or stop() is called. It unwinds the search back
+    # to the root, which takes back any moves still on the board.
+    pass
+
+
+class SearchResult:
+    # What a search found: the best move (a packed move, or None if there are no legal moves), its score in centipawns
+    # from the point of view of the side to move, the depth fully searched, the principal variation (the line of best
+    # play the search expects), the nodes searched and the time taken in seconds.
+    def __init__(self, best_move, score, depth, pv, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.pv = pv
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.nodes_per_second = int(nodes / elapsed) if elapsed > 0 else 0
+
+    # The mate_in() method returns the number of moves to mate (negative if the side to move is getting mated), or
+    # None if the score isn't a mate score.
+    def mate_in(self):
+        if abs(self.score) < MATE_BOUND:
+            return None
+        plies = MATE - abs(self.score)
+        return (plies + 1) // 2 if self.score > 0 else -((plies + 1) // 2)
+
+    def __repr__(self):
+        score = f'mate {self.mate_in()}' if self.mate_in() is not None else f'cp {self.score}'
+        return (f'depth {self.depth} score {score} nodes {self.nodes} nps {self.nodes_per_second} '
+                f'time {int(self.elapsed * 1000)} pv {" ".join(move_name(move) for move in self.pv)}')
+
+
+class Search:
+    # A Search keeps what it learns between searches (the transposition table and history scores), so the same object
+    # should be reused for the moves of a game. on_info, if given, is called with a SearchResult each time a depth is
+    # finished. stop_event, if given, is an Event (from threading or multiprocessing) that stops the search when it is
+    # set, for searches running in another process where stop() can't be called. tablebases, if given, is a
+    # chess_tablebase.Tablebases, and positions it covers are played from the tables instead of being searched.
+    def __init__(self, table=None, megabytes=16, on_info=None, stop_event=None, tablebases=None):
+        self.table = table if table is not None else TranspositionTable(megabytes)
+        self.tablebases = tablebases
+        self.on_info = on_info
+        self.stop_event = stop_event
+        self.history = [0] * 4096  # Indexed by the origin and destination bits of a move
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.pv = [[] for _ in range(MAX_PLY + 2)]
+        self.nodes = 0
+        self.next_check = CHECK_INTERVAL
+        self.node_limit = None
+        self.deadline = None
+        self.stopped = False
+
+    # The stop() method asks a running search to finish as soon as possible. It is safe to call from another thread;
+    # the search will return the best move found so far.
+    def stop(self):
+        self.stopped = True
+
+    # The search() method searches the position in a GameState and returns a SearchResult. The search runs until
+    # time_ms milliseconds have passed, nodes nodes have been searched or depth has been reached, whichever comes first
+    # (with no limit given it searches to MAX_PLY). root_moves restricts the search to some of the legal moves. The
+    # GameState is left exactly as it was.
+    def search(self, game, time_ms=None, depth=None, nodes=None, root_moves=None):
+        start = time.perf_counter()
+        self.deadline = start + time_ms / 1000 if time_ms is not None else None
+        self.node_limit = nodes
+        self.nodes = 0
+        self.next_check = min(CHECK_INTERVAL, nodes) if nodes else CHECK_INTERVAL
+        self.stopped = False
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.table.new_search()
+
+        moves = game.legal_moves()
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        if not moves:
+            score = -MATE if game.in_check(game.turn) else 0
+            return SearchResult(None, score, 0, [], 0, time.perf_counter() - start)
+        if self.tablebases is not None:
+            result = self.tablebase_result(game, moves, start)
+            if result is not None:
+                return result
+        entry = self.table.probe(game.hash)
+        moves = self.order_moves(game, moves, entry[0] if entry else 0, 0)
+
+        # Until the first depth is finished the answer is the first move in order, so there is always a move to play
+        result = SearchResult(moves[0], 0, 0, [moves[0]], 0, 0.0)
+        root_length = len(game.undo_stack)
+        for current_depth in range(1, min(depth or MAX_PLY, MAX_PLY) + 1):
+            self.root_best = None
+            try:
+                score, best_move, pv = self.search_root(game, moves, current_depth)
+            except SearchAborted:
+                while len(game.undo_stack) > root_length:
+                    game.unmake_move()
+                # The previous best move is searched first, so a move that beat it before the search stopped is
+                # still a better choice than the previous result
+                if self.root_best and self.root_best[0] != result.best_move:
+                    best_move, score, pv = self.root_best
+                    result = SearchResult(best_move, score, result.depth, pv, self.nodes,
+                                          time.perf_counter() - start)
+                break
+            result = SearchResult(best_move, score, current_depth, pv, self.nodes, time.perf_counter() - start)
+            if self.on_info:
+                self.on_info(result)
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            if abs(score) >= MATE_BOUND and MATE - abs(score) <= current_depth:
+                break
+            # A new depth takes several times as long as the last one, so don't start one that can't finish in time
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        result.nodes_per_second = int(self.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    # The tablebase_result() method looks up the position after each move in the tablebases and returns the best move
+    # as a SearchResult: the quickest win, else a draw, else the slowest loss. It returns None if any of the positions
+    # isn't covered.
+    def tablebase_result(self, game, moves, start):
+        best_move, best_score = None, -INFINITY
+        for move in moves:
+            game.play(move)
+            found = game.probe_tablebase(self.tablebases)
+            game.unmake_move()
+            if found is None:
+                return None
+            result, plies = found  # For the opponent: 3 for a win, 2 for a draw and 1 for a loss
+            score = MATE - plies - 1 if result == 1 else -(MATE - plies - 1) if result == 3 else 0
+            if score > best_score:
+                best_move, best_score = move, score
+        result = SearchResult(best_move, best_score, 1, [best_move], len(moves), time.perf_counter() - start)
+        if self.on_info:
+            self.on_info(result)
+        return result
+
+    # The search_root() method searches each of the root moves to the given depth, keeping track of the best so far in
+    # self.root_best in case the search is stopped part of the way through.
+    def search_root(self, game, moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        best_move, pv = moves[0], [moves[0]]
+        for number, move in enumerate(moves):
+            game.play(move)
+            if number == 0:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, 1)
+            else:
+                score = -self.negamax(game, depth - 1, -alpha - 1, -alpha, 1)
+                if score > alpha:
+                    score = -self.negamax(game, depth - 1, -beta, -alpha, 1)
+            game.unmake_move()
+            if score > alpha:
+                alpha, best_move, pv = score, move, [move] + self.pv[1]
+                self.root_best = (best_move, score, pv)
+        self.table.store(game.hash, best_move, alpha, depth, EXACT)
+        return alpha, best_move, pv
+
+    # The check_limits() method is called every CHECK_INTERVAL nodes and raises SearchAborted once the search has been
+    # stopped or has used up its time or nodes.
+    def check_limits(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+        if self.stopped or (self.deadline is not None and time.perf_counter() >= self.deadline) or \
+                (self.node_limit is not None and self.nodes >= self.node_limit):
+            raise SearchAborted
+        self.next_check = self.nodes + CHECK_INTERVAL
+        if self.node_limit is not None:
+            self.next_check = min(self.next_check, self.node_limit)
+
+    # The negamax() method is the alpha-beta search below the root. It returns the score of the position for the side
+    # to move, searched depth plies deep. Scores at or below alpha mean the side to move can do better elsewhere, and
+    # scores at or above beta mean the opponent can avoid this position, so in either case the exact score isn't needed.
+    def negamax(self, game, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        self.pv[ply] = []
+        if game.halfmove_clock >= 100 or game.is_repetition():
+            return 0
+        colour = game.turn
+        in_check = game.in_check(colour)
+        if in_check:
+            depth += 1  # Search checks one ply deeper, so that forced sequences of checks aren't cut short
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(game, alpha, beta, ply)
+
+        key = game.hash
+        entry = self.table.probe(key)
+        table_move = 0
+        if entry:
+            table_move, score, entry_depth, bound = entry
+            # Only use the stored score away from the principal variation, so that the PV is still searched in full
+            if entry_depth >= depth and beta - alpha == 1:
+                score = score_from_table(score, ply)
+                if bound == EXACT or (bound == LOWER_BOUND and score >= beta) or \
+                        (bound == UPPER_BOUND and score <= alpha):
+                    return score
+
+        original_alpha = alpha
+        best_score, best_move, legal_moves = -INFINITY, 0, 0
+        for move in self.order_moves(game, game.pseudo_legal_moves(colour), table_move, ply):
+            game.play(move)
+            if game.in_check(colour):
+                game.unmake_move()
+                continue
+            legal_moves += 1
+            if legal_moves == 1:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            else:
+                # Search the remaining moves with a null window first, just to prove they are no better than alpha
+                score = -self.negamax(game, depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self.negamax(game, depth - 1, -beta, -alpha, ply + 1)
+            game.unmake_move()
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        if not self.is_capture(game, move):
+                            self.add_killer(move, ply)
+                            self.history[move & 4095] += depth * depth
+                        break
+
+        if not legal_moves:
+            return -(MATE - ply) if in_check else 0
+        if best_score >= beta:
+            bound = LOWER_BOUND
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+        self.table.store(key, best_move, score_to_table(best_score, ply), depth, bound)
+        return best_score
+
+    # The quiescence() method only searches captures (and queen promotions), until the position is quiet. The side to
+    # move can always 'stand pat' on the static evaluation instead of capturing, since it isn't forced to capture.
+    def quiescence(self, game, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_limits()
+        self.pv[ply] = []
+        stand_pat = evaluate(game)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        colour = game.turn
+        captures = [move for move in game.pseudo_legal_moves(colour, noisy=True) if move >> 12 & 7 in (EMPTY, QUEEN)]
+        for move in self.order_moves(game, captures, 0, ply):
+            game.play(move)
+            if game.in_check(colour):
+                game.unmake_move()
+                continue
+            score = -self.quiescence(game, -beta, -alpha, ply + 1)
+            game.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+                self.pv[ply] = [move] + self.pv[ply + 1]
+        return alpha
+
+    # Captures, en passant and promotions count as 'noisy' moves: they are ordered by MVV-LVA and searched in the
+    # quiescence search, and they are not used as killer moves.
+    @staticmethod
+    def is_capture(game, move):
+        return game.squares[board_indices[move >> 6 & 63]] != EMPTY or move >> 12 & 7 != EMPTY or \
+            move >> 15 == EN_PASSANT
+
+    def add_killer(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1], killers[0] = killers[0], move
+
+    # The order_moves() method sorts moves so that those most likely to be best are searched first (see the top of
+    # this file).
+    def order_moves(self, game, moves, table_move, ply):
+        squares = game.squares
+        killers = self.killers[ply]
+        history = self.history
+
+        def order(move):
+            if move == table_move:
+                return 10000000
+            victim = squares[board_indices[move >> 6 & 63]]
+            promotion = move >> 12 & 7
+            if victim != EMPTY or promotion or move >> 15 == EN_PASSANT:
+                attacker = squares[board_indices[move & 63]]
+                victim_value = piece_values[victim & 7] if victim != EMPTY else piece_values[1]
+                return 5000000 + victim_value * 10 - piece_values[attacker & 7] // 10 + \
+                    (piece_values[promotion] if promotion else 0)
+            if move == killers[0]:
+                return 4000002
+            if move == killers[1]:
+                return 4000001
+            return history[move & 4095]
+
+        moves.sort(key=order, reverse=True)
+        return moves
+
+
+# Mate scores are stored in the transposition table relative to the position they were found in rather than the root,
+# since the same position can be reached at different distances from the root.
+def score_to_table(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+if __name__ == '__main__':
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    final = Search(on_info=print).search(GameState(), time_ms=budget)
+    print('bestmove', move_name(final.best_move))
@@ -0,0 +1,479 @@
+"""This file generates and reads endgame tablebases: files holding the result with perfect play (win, draw or loss for
+the side to move, and how many moves it takes to mate) of every position with a given set of material, such as king
+and queen against king ('KQK'). Looking a position up is far quicker than searching it, and the answer is exact.
+
+A table is generated by retrograde analysis. Every position with the material is listed and its moves are worked out
+once with the GameState move rules, recording which positions each move leads to. Working backwards from the
+checkmates, a position is a win if some move leads to a position lost for the opponent, and a loss once every move
+leads to a position won for the opponent, so the results spread back move by move, shortest mates first. Whatever is
+left at the end is a draw. Moves that capture or promote leave the table's material, and are looked up in the smaller
+table they lead to (generated first if needed), except for king against king, king and knight or king and bishop,
+which are always draws. Working out the moves is the slow part, and it can be spread over several processes.
+
+Positions are numbered by where each piece stands and the side to move, so a position's result is found by working
+out its number and reading that byte of the table. The board's symmetry is used to leave out positions that are mirror
+images of each other: the white king is always brought into the a1-d1-d4 triangle by flipping and reflecting the board
+(only left to right, onto files a to d, if there are pawns, since pawns only move one way). Tables hold the side with
+more material as White; positions with the colours the other way round are flipped before being looked up.
+
+Each position's result takes one byte: the result (1 for a loss, 2 for a draw, 3 for a win, 0 for an impossible
+position) in the top two bits and the number of moves to mate (up to 63) in the other six. A table file is a short
+header (the magic bytes, the material and the number of positions) followed by these bytes, and it is memory-mapped
+when it's read. Castling and en passant are not part of a table, so positions where either is possible aren't looked
+up.
+
+Run it as 'python chess_tablebase.py generate KQK KRK KPK' (with '--workers N' and '--folder path' to set the number
+of processes and where the files go) and 'python chess_tablebase.py probe <FEN>' to look a position up."""
+
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+from chess_board import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, board_indices, move_name
+from chess_game_state import GameState
+
+IMPOSSIBLE, LOSS, DRAW, WIN = 0, 1, 2, 3
+MAGIC = b'CTB1'
+header_format = struct.Struct('>4s8sI')  # Magic, material, number of positions
+FILE_EXTENSION = '.ctb'
+DEFAULT_FOLDER = 'tablebases'
+NO_EXIT = 0xFFFF
+
+piece_kinds = {'K': KING, 'Q': QUEEN, 'R': ROOK, 'B': BISHOP, 'N': KNIGHT, 'P': PAWN}
+kind_letters = {kind: letter for letter, kind in piece_kinds.items()}
+letter_order = 'KQRBNP'
+letter_values = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+drawn_materials = {'KK', 'KBK', 'KNK'}  # Neither side can ever mate
+
+
+# Squares are numbered row * 8 + col as everywhere else, with row 0 being the eighth rank.
+def file_and_rank(square):
+    return square & 7, 7 - (square >> 3)
+
+
+def square_at(file, rank):
+    return (7 - rank) * 8 + file
+
+
+# king_regions lists the squares the white king is brought onto: the a1-d1-d4 triangle without pawns and files a to d
+# with them. symmetries[pawns][square] maps every square through the flips that bring a white king on that square into
+# its region.
+king_regions = {False: [square_at(file, rank) for file in range(4) for rank in range(file + 1)],
+                True: [square for square in range(64) if square & 7 < 4]}
+
+
+def symmetry(king, pawns):
+    king_file, king_rank = file_and_rank(king)
+    flip_file = king_file > 3
+    flip_rank = not pawns and king_rank > 3
+    king_file, king_rank = (7 - king_file if flip_file else king_file), (7 - king_rank if flip_rank else king_rank)
+    transpose = not pawns and king_rank > king_file
+    mapping = []
+    for square in range(64):
+        file, rank = file_and_rank(square)
+        file, rank = (7 - file if flip_file else file), (7 - rank if flip_rank else rank)
+        if transpose:
+            file, rank = rank, file
+        mapping.append(square_at(file, rank))
+    return mapping
+
+
+symmetries = {pawns: [symmetry(king, pawns) for king in range(64)] for pawns in (False, True)}
+
+
+# The material_name() function gives the name of the table for a set of pieces, from the letters of each side's pieces,
+# as the stronger side's pieces followed by the weaker side's (eg. 'KRKQ' is named 'KQKR'). It also returns True if
+# the colours have to be swapped to match the table.
+def material_name(white_letters, black_letters):
+    white = 'K' + ''.join(sorted(white_letters.replace('K', ''), key=letter_order.index))
+    black = 'K' + ''.join(sorted(black_letters.replace('K', ''), key=letter_order.index))
+
+    def strength(side):
+        return (sum(letter_values[letter] for letter in side), len(side),
+                [-letter_order.index(letter) for letter in side])
+
+    if strength(black) > strength(white):
+        return black + white, True
+    return white + black, False
+
+
+class TableLayout:
+    # A TableLayout numbers the positions of one table. Each piece has a slot: the white king, the black king, then the
+    # other white pieces and the other black pieces in the order of the table's name. A position's number is made from
+    # the white king's place in its region, each other piece's square and the side to move.
+    def __init__(self, name):
+        split = name.index('K', 1)
+        self.name = name
+        self.slots = [('W', KING), ('B', KING)] + [('W', piece_kinds[letter]) for letter in name[1:split]] + \
+            [('B', piece_kinds[letter]) for letter in name[split + 1:]]
+        self.pawns = 'P' in name
+        self.region = king_regions[self.pawns]
+        self.region_index = {square: number for number, square in enumerate(self.region)}
+        self.size = len(self.region) * 64 ** (len(self.slots) - 1) * 2
+
+    def index(self, squares, white_to_move):
+        mapping = symmetries[self.pawns][squares[0]]
+        number = self.region_index[mapping[squares[0]]]
+        for square in squares[1:]:
+            number = number * 64 + mapping[square]
+        return number * 2 + (0 if white_to_move else 1)
+
+    def position(self, number):
+        white_to_move = number % 2 == 0
+        number //= 2
+        squares = []
+        for _ in range(len(self.slots) - 1):
+            squares.append(number % 64)
+            number //= 64
+        squares.append(self.region[number])
+        squares.reverse()
+        return squares, white_to_move
+
+
+# Values are stored as result << 6 | moves to mate. A won position mates in plies = 2 * moves - 1 and a lost one is
+# mated in plies = 2 * moves.
+def encode_value(result, plies):
+    return result << 6 | min((plies + 1) // 2, 63)
+
+
+def decode_value(value):
+    result, moves = value >> 6, value & 63
+    if result == WIN:
+        return result, 2 * moves - 1
+    if result == LOSS:
+        return result, 2 * moves
+    return result, 0
+
+
+class Tablebases:
+    # A Tablebases object holds the tables that have been generated or read from files in a folder, loading each file
+    # the first time it is needed.
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.tables = {}
+        self.files = []
+
+    def close(self):
+        for name, values in list(self.tables.items()):
+            if isinstance(values, memoryview):
+                values.release()  # A memory map can't be closed while a view of it is held
+                del self.tables[name]
+        for file, data in self.files:
+            data.close()
+            file.close()
+        self.files = []
+
+    # The table() method returns the values of a table, or None if there isn't one.
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = None
+            path = os.path.join(self.folder, name + FILE_EXTENSION) if self.folder else None
+            if path and os.path.exists(path):
+                file = open(path, 'rb')
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, material, size = header_format.unpack_from(data)
+                if magic != MAGIC or material.rstrip(b'\0').decode() != name:
+                    raise ValueError(f'{path} is not a tablebase for {name}')
+                self.files.append((file, data))
+                self.tables[name] = memoryview(data)[header_format.size:header_format.size + size]
+        return self.tables[name]
+
+    # The probe_pieces() method looks up a position given as a list of (colour, kind, square) for every piece,
+    # returning (result, plies to mate) for the side to move, or None if there is no table for the material.
+    def probe_pieces(self, pieces, white_to_move):
+        white = ''.join(kind_letters[kind] for colour, kind, _ in pieces if colour == 'W')
+        black = ''.join(kind_letters[kind] for colour, kind, _ in pieces if colour == 'B')
+        name, swapped = material_name(white, black)
+        if name in drawn_materials:
+            return DRAW, 0
+        table = self.table(name)
+        if table is None:
+            return None
+        if swapped:
+            pieces = [('B' if colour == 'W' else 'W', kind, square ^ 56) for colour, kind, square in pieces]
+            white_to_move = not white_to_move
+        layout = layout_for(name)
+        remaining = list(pieces)
+        squares = []
+        for slot in layout.slots:
+            piece = next(piece for piece in remaining if piece[:2] == slot)
+            remaining.remove(piece)
+            squares.append(piece[2])
+        return decode_value(table[layout.index(squares, white_to_move)])
+
+    # The probe() method looks up the position in a GameState (see GameState.probe_tablebase()). A position the table
+    # marks as impossible (the side not to move in check, say) has no result, so it isn't covered either.
+    def probe(self, game):
+        if game.castling or game.en_passant:
+            return None
+        pieces = []
+        for square, index in enumerate(board_indices):
+            code = game.squares[index]
+            if code != EMPTY:
+                pieces.append(('W' if code & BLACK == WHITE else 'B', code & 7, square))
+        if len(pieces) > 5:
+            return None
+        found = self.probe_pieces(pieces, game.turn == 'W')
+        if found is None or found[0] == IMPOSSIBLE:
+            return None
+        return found
+
+    # The save() method writes a table to a file in the folder.
+    def save(self, name):
+        os.makedirs(self.folder, exist_ok=True)
+        values = self.tables[name]
+        with open(os.path.join(self.folder, name + FILE_EXTENSION), 'wb') as file:
+            file.write(header_format.pack(MAGIC, name.encode(), len(values)))
+            file.write(values)
+
+
+layouts = {}
+
+
+def layout_for(name):
+    if name not in layouts:
+        layouts[name] = TableLayout(name)
+    return layouts[name]
+
+
+# The sub_tables() function lists the tables a table's captures and promotions can lead to.
+def sub_tables(name):
+    split = name.index('K', 1)
+    white, black = name[:split], name[split:]
+    names = set()
+    for side, other, index in [(white, black, position) for position in range(1, len(white))] + \
+            [(black, white, position) for position in range(1, len(black))]:
+        names.add(material_name(side[:index] + side[index + 1:], other)[0])  # The piece is captured
+        if side[index] == 'P':
+            for promotion in 'QRBN':
+                names.add(material_name(side[:index] + promotion + side[index + 1:], other)[0])
+    return names
+
+
+worker_state = {}
+
+
+def start_worker(name, tables):
+    tablebases = Tablebases()
+    tablebases.tables.update(tables)
+    game = GameState()
+    for index in board_indices:
+        game.put(index, EMPTY)
+    worker_state.update(layout=layout_for(name), tablebases=tablebases, game=game)
+
+
+# The analyse_range() function works out the moves from each position numbered from start up to end. It runs in a
+# worker process (or in this one). For every position it returns a status (0 for an ordinary position, -1 if the
+# position is impossible, 1 if the side to move is checkmated and 2 if it is stalemated), the numbers of the positions
+# in the same table that its moves lead to, and a summary of the moves that leave the table: the quickest win, the
+# slowest loss and whether there is a draw among them.
+def analyse_range(start, end):
+    layout, tablebases, game = worker_state['layout'], worker_state['tablebases'], worker_state['game']
+    status = array('b', bytes(end - start))
+    child_counts = array('H', bytes(2 * (end - start)))
+    children = array('I')
+    win_exits = array('H', [NO_EXIT]) * (end - start)
+    loss_exits = array('H', [NO_EXIT]) * (end - start)
+    draw_exits = array('b', bytes(end - start))
+    squares_used = []
+    for number in range(start, end):
+        offset = number - start
+        squares, white_to_move = layout.position(number)
+        for square in squares_used:
+            game.put(board_indices[square], EMPTY)
+        squares_used = []
+        if not possible(layout, squares):
+            status[offset] = -1
+            continue
+        for (colour, kind), square in zip(layout.slots, squares):
+            game.put(board_indices[square], (WHITE if colour == 'W' else BLACK) | kind)
+        squares_used = squares
+        game.kings = {'W': board_indices[squares[0]], 'B': board_indices[squares[1]]}
+        game.turn = 'W' if white_to_move else 'B'
+        game.castling, game.en_passant = 0, 0
+        if game.in_check('B' if white_to_move else 'W'):
+            status[offset] = -1
+            continue
+        moves = game.legal_moves()
+        if not moves:
+            status[offset] = 1 if game.in_check(game.turn) else 2
+            continue
+        slot_of = {square: slot for slot, square in enumerate(squares)}
+        for move in moves:
+            origin, destination, promotion = move & 63, move >> 6 & 63, move >> 12 & 7
+            mover, captured = slot_of[origin], slot_of.get(destination)
+            if captured is None and not promotion:
+                child = list(squares)
+                child[mover] = destination
+                children.append(layout.index(child, not white_to_move))
+                child_counts[offset] += 1
+                continue
+            pieces = []
+            for slot, ((colour, kind), square) in enumerate(zip(layout.slots, squares)):
+                if slot == mover:
+                    pieces.append((colour, promotion or kind, destination))
+                elif slot != captured:
+                    pieces.append((colour, kind, square))
+            result, plies = tablebases.probe_pieces(pieces, not white_to_move)
+            if result == LOSS:
+                win_exits[offset] = min(win_exits[offset], plies + 1)
+            elif result == WIN:
+                loss_exits[offset] = plies + 1 if loss_exits[offset] == NO_EXIT else max(loss_exits[offset], plies + 1)
+            else:
+                draw_exits[offset] = 1
+    for square in squares_used:
+        game.put(board_indices[square], EMPTY)
+    return status, child_counts, children, win_exits, loss_exits, draw_exits
+
+
+# Positions with two pieces on one square, kings next to each other or pawns on the first or last rank can't occur.
+def possible(layout, squares):
+    if len(set(squares)) < len(squares):
+        return False
+    white_king, black_king = squares[0], squares[1]
+    if abs((white_king >> 3) - (black_king >> 3)) <= 1 and abs((white_king & 7) - (black_king & 7)) <= 1:
+        return False
+    for (_, kind), square in zip(layout.slots, squares):
+        if kind == PAWN and square >> 3 in (0, 7):
+            return False
+    return True
+
+
+# The solve() function runs the retrograde analysis on the moves found by analyse_range() and returns the table's
+# values. Positions are settled in order of their distance to mate, using a list of positions for each distance.
+def solve(size, status, child_counts, children, win_exits, loss_exits, draw_exits):
+    # Turn the list of each position's children round into a list of each position's parents
+    first_child = array('I', bytes(4 * (size + 1)))
+    parent_counts = array('I', bytes(4 * (size + 1)))
+    total = 0
+    for number in range(size):
+        first_child[number] = total
+        total += child_counts[number]
+    first_child[size] = total
+    for child in children:
+        parent_counts[child + 1] += 1
+    for number in range(size):
+        parent_counts[number + 1] += parent_counts[number]
+    parents = array('I', bytes(4 * total))
+    filled = array('I', parent_counts)
+    for number in range(size):
+        for child in children[first_child[number]:first_child[number + 1]]:
+            parents[filled[child]] = number
+            filled[child] += 1
+
+    values = bytearray(size)
+    remaining = array('H', child_counts)
+    by_distance = {}
+    for number in range(size):
+        if status[number] == 1:
+            by_distance.setdefault(0, []).append((number, LOSS))
+        elif status[number] == 2:
+            values[number] = encode_value(DRAW, 0)
+        elif status[number] == 0:
+            if win_exits[number] != NO_EXIT:
+                by_distance.setdefault(win_exits[number], []).append((number, WIN))
+            elif remaining[number] == 0 and not draw_exits[number]:
+                by_distance.setdefault(loss_exits[number], []).append((number, LOSS))
+    distance = 0
+    while by_distance:
+        for number, result in by_distance.pop(distance, []):
+            if values[number]:
+                continue  # Already settled by a quicker win
+            values[number] = encode_value(result, distance)
+            for parent in parents[parent_counts[number]:parent_counts[number + 1]]:
+                if values[parent]:
+                    continue
+                if result == LOSS:
+                    by_distance.setdefault(distance + 1, []).append((parent, WIN))
+                else:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0 and win_exits[parent] == NO_EXIT and not draw_exits[parent]:
+                        slowest = distance + 1 if loss_exits[parent] == NO_EXIT else max(distance + 1,
+                                                                                          loss_exits[parent])
+                        by_distance.setdefault(slowest, []).append((parent, LOSS))
+        distance += 1
+    for number in range(size):
+        if status[number] == 0 and not values[number]:
+            values[number] = encode_value(DRAW, 0)
+    return bytes(values)
+
+
+# The generate() function generates the table for a material name, first generating any smaller tables it depends on,
+# and adds them all to tablebases. The moves are worked out by a pool of worker processes if workers is more than 1.
+def generate(name, tablebases, workers=1, report=print):
+    for sub_name in sorted(sub_tables(name), key=len):
+        if sub_name not in drawn_materials and tablebases.table(sub_name) is None:
+            generate(sub_name, tablebases, workers, report)
+    start = time.perf_counter()
+    layout = layout_for(name)
+    tables = {table_name: bytes(values) for table_name, values in tablebases.tables.items() if values is not None}
+    chunk = max(1024, layout.size // (workers * 16))
+    ranges = [(first, min(first + chunk, layout.size)) for first in range(0, layout.size, chunk)]
+    if workers > 1:
+        with multiprocessing.Pool(workers, start_worker, (name, tables)) as pool:
+            results = pool.starmap(analyse_range, ranges)
+    else:
+        start_worker(name, tables)
+        results = [analyse_range(first, last) for first, last in ranges]
+    status, child_counts, children = array('b'), array('H'), array('I')
+    win_exits, loss_exits, draw_exits = array('H'), array('H'), array('b')
+    for part in results:
+        for combined, piece in zip((status, child_counts, children, win_exits, loss_exits, draw_exits), part):
+            combined.extend(piece)
+    values = solve(layout.size, status, child_counts, children, win_exits, loss_exits, draw_exits)
+    tablebases.tables[name] = values
+    counts = {result: 0 for result in (WIN, DRAW, LOSS)}
+    longest = 0
+    for value in values:
+        if value:
+            counts[value >> 6] += 1
+            longest = max(longest, value & 63)
+    report(f'{name}: {layout.size} positions ({sum(counts.values())} possible), {counts[WIN]} wins, {counts[DRAW]} '
+           f'draws, {counts[LOSS]} losses, longest mate {longest} moves, {time.perf_counter() - start:.1f}s')
+    return values
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    folder, worker_count = DEFAULT_FOLDER, os.cpu_count() or 1
+    if '--folder' in arguments:
+        folder = arguments.pop(arguments.index('--folder') + 1)
+        arguments.remove('--folder')
+    if '--workers' in arguments:
+        worker_count = int(arguments.pop(arguments.index('--workers') + 1))
+        arguments.remove('--workers')
+    collection = Tablebases(folder)
+    if arguments[:1] == ['generate']:
+        for material in arguments[1:]:
+            material = material_name(material[:material.index('K', 1)], material[material.index('K', 1):])[0]
+            generate(material, collection, worker_count)
+        for material in list(collection.tables):
+            if collection.tables[material] is not None and not isinstance(collection.tables[material], memoryview):
+                collection.save(material)
+    elif arguments[:1] == ['probe'] and len(arguments) > 1:
+        try:
+            position = GameState.from_fen(' '.join(arguments[1:]))
+        except ValueError as error:
+            sys.exit(str(error))
+        probe_start = time.perf_counter()
+        found = position.probe_tablebase(collection)
+        probe_time = time.perf_counter() - probe_start
+        if found is None:
+            print('Not in the tablebases')
+        else:
+            outcome, mate_plies = found
+            print({WIN: f'Win, mate in {(mate_plies + 1) // 2}', LOSS: f'Loss, mated in {mate_plies // 2}',
+                   DRAW: 'Draw'}[outcome], f'({probe_time * 1e6:.0f}us)')
+            for legal_move in position.legal_moves():
+                position.play(legal_move)
+                child = position.probe_tablebase(collection)
+                position.unmake_move()
+                print(' ', move_name(legal_move), child)
+        collection.close()
+    else:
+        sys.exit('Usage: python chess_tablebase.py generate KQK [KRK ...] [--workers N] [--folder path]\n'
+                 '       python chess_tablebase.py probe <FEN> [--folder path]')
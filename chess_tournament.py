@@ -0,0 +1,313 @@
+"""This file runs engine-against-engine matches without a display, to measure whether a change to the engine makes it
+stronger. Two engines (normally two versions of the search) play each other from every position of an opening suite,
+once with each colour, and the results give an Elo difference between them.
+
+Games are played on GameState by a pool of worker processes, one game per task, so a match uses every core. Each
+worker makes its own copy of both engines when it starts and keeps them for all its games, clearing their
+transposition tables before each game. Every move gets the same limit (a number of milliseconds, nodes or a depth). A
+game ends when GameState.outcome() says so, or is adjudicated a draw once it reaches a maximum number of plies,
+counted from the opening's starting position (so the opening's own moves are included).
+
+Results arrive as each game finishes. The PGN of every game is appended to a file, and a JSON line with its result is
+appended to a log, so a match can be watched (or stopped) as it runs. After each game the Elo difference is estimated
+with its 95% error margin, and a sequential probability ratio test (SPRT) weighs the hypothesis that the first engine
+is elo1 stronger against the hypothesis that it is only elo0 stronger. The match stops early once either is accepted
+with the chosen error rates, which often takes far fewer games than a fixed-length match. The log ends with a summary,
+including the throughput in games per minute per core.
+
+An engine is given as 'name=module:factory[,option=value...]', where factory is called with the options to make an
+object with a search(game, time_ms, depth, nodes) method returning a SearchResult, eg. 'new=chess_search:Search' or
+'big=chess_search:Search,megabytes=64'. Run it as
+'python chess_tournament.py --engine new=chess_search:Search --engine old=chess_search:Search --movetime 100', with
+'--games N', '--workers N', '--openings path' (a file of FENs or coordinate-notation move lists, one per line, or a PGN
+file), '--sprt elo0 elo1', '--pgn path' and '--log path'."""
+
+import argparse
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from chess_board import move_name
+from chess_game_state import GameState, starting_fen
+from chess_pgn import format_game, open_games, san_to_move
+
+MAX_PLIES = 300  # Games still going after this many plies, opening moves included, are adjudicated draws
+
+# A small default suite of common openings, in coordinate notation, so that the games aren't all the same
+default_openings = [
+    'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6', 'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5', 'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4',
+    'e2e4 c7c5 b1c3 b8c6 g2g3 g7g6', 'e2e4 e7e6 d2d4 d7d5 b1c3 g8f6', 'e2e4 c7c6 d2d4 d7d5 e4e5 c8f5',
+    'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6', 'd2d4 d7d5 c2c4 c7c6 g1f3 g8f6', 'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7',
+    'd2d4 g8f6 c2c4 e7e6 b1c3 f8b4', 'c2c4 e7e5 b1c3 g8f6 g2g3 d7d5', 'g1f3 d7d5 g2g3 g8f6 f1g2 c7c6',
+]
+
+
+class EngineSpec:
+    # An EngineSpec describes how to make an engine, so that every worker process can make its own: a name for the
+    # PGN and the results, the module and factory to import and the options to call the factory with.
+    def __init__(self, text):
+        name, _, target = text.partition('=')
+        if not target:
+            name, target = text, text
+        target, *options = target.split(',')
+        self.name = name
+        self.module, _, self.factory = target.partition(':')
+        self.options = {}
+        for option in options:
+            key, _, value = option.partition('=')
+            self.options[key] = parse_value(value)
+        if not self.factory:
+            raise ValueError(f'An engine is given as name=module:factory[,option=value...], not {text!r}')
+
+    def make(self):
+        return getattr(importlib.import_module(self.module), self.factory)(**self.options)
+
+
+def parse_value(value):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+# The play_opening() function sets up the position a game starts from: the opening's FEN with its moves (in coordinate
+# notation) played. A ValueError is raised if the FEN can't be read or a move isn't legal.
+def play_opening(fen, opening):
+    game = GameState.from_fen(fen)
+    for name in opening:
+        move = next((move for move in game.legal_moves() if move_name(move) == name), None)
+        if move is None:
+            raise ValueError(f'Illegal move {name!r} in opening {" ".join(opening)!r}')
+        game.play(move)
+    return game
+
+
+# The load_openings() function reads an opening suite as a list of (FEN, moves), where moves are in coordinate notation
+# and played from the FEN. A PGN file gives the first plies moves of each game, and any other file has a FEN or a list
+# of moves on each line ('#' starts a comment). Every opening is played out as it is read, and a ValueError naming the
+# line is raised if one can't be, so that a bad opening stops the match before it starts rather than in a worker.
+def load_openings(path=None, plies=8):
+    if path is None:
+        return [(starting_fen, line.split()) for line in default_openings]
+    openings = []
+    if path.lower().endswith('.pgn'):
+        for number, pgn_game in enumerate(open_games(path), 1):
+            game = pgn_game.start()
+            moves = []
+            for san in pgn_game.moves[:plies]:
+                try:
+                    move = san_to_move(game, san)
+                except ValueError as error:
+                    raise ValueError(f'{path} game {number}: {error}')
+                moves.append(move_name(move))
+                game.play(move)
+            openings.append((game.initial_fen, moves))
+        return openings
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if '/' in line:
+                fields = line.split()
+                opening = (' '.join(fields[:4] + (fields[4:6] if len(fields) >= 6 and fields[4].isdigit()
+                                                  else ['0', '1'])), [])
+            else:
+                opening = (starting_fen, line.split())
+            try:
+                play_opening(*opening)
+            except ValueError as error:
+                raise ValueError(f'{path} line {number}: {error}')
+            openings.append(opening)
+    return openings
+
+
+worker_engines = {}  # The engines of a worker process, by name, made when the process starts
+
+
+def start_worker(specs):
+    for spec in specs:
+        worker_engines[spec.name] = spec.make()
+
+
+# The play_game() function runs in a worker process and plays one game between two of its engines from an opening,
+# returning a dictionary with the result, how the game ended and its PGN.
+def play_game(task):
+    number, (fen, opening), white, black, limits, max_plies = task
+    start = time.perf_counter()
+    game = play_opening(fen, opening)
+    engines = {'W': worker_engines[white], 'B': worker_engines[black]}
+    for engine in engines.values():
+        if hasattr(engine, 'table'):
+            engine.table.clear()
+    ending = game.outcome()
+    while ending is None:
+        if len(game.moves) >= max_plies:
+            ending = ('1/2-1/2', 'adjudication')
+            break
+        result = engines[game.turn].search(game, limits['time_ms'], limits['depth'], limits['nodes'])
+        game.play(result.best_move)
+        ending = game.outcome()
+    result, reason = ending
+    headers = {'Event': 'Engine match', 'Site': 'chess_tournament', 'Date': time.strftime('%Y.%m.%d'),
+               'Round': str(number), 'White': white, 'Black': black, 'Termination': reason}
+    return {'game': number, 'white': white, 'black': black, 'result': result, 'reason': reason,
+            'plies': len(game.moves), 'seconds': round(time.perf_counter() - start, 3),
+            'pgn': format_game(game, headers, result)}
+
+
+class MatchStatistics:
+    # A MatchStatistics counts the wins, draws and losses of the first engine against the second and works out the Elo
+    # difference and the SPRT log-likelihood ratio from them.
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        self.wins = self.draws = self.losses = 0
+        self.elo0, self.elo1 = elo0, elo1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+    def add(self, score):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    # The score() method returns the first engine's average score per game and the variance of a game's score.
+    def score(self):
+        games = self.games
+        mean = (self.wins + self.draws / 2) / games
+        variance = (self.wins * (1 - mean) ** 2 + self.draws * (0.5 - mean) ** 2 + self.losses * mean ** 2) / games
+        return mean, variance
+
+    # The elo() method returns the Elo difference and its 95% error margin (None if the score is 0 or 1, where the
+    # difference is unbounded).
+    def elo(self):
+        if not self.games:
+            return 0.0, None
+        mean, variance = self.score()
+        if mean <= 0 or mean >= 1:
+            return (math.inf if mean >= 1 else -math.inf), None
+        margin = 1.96 * math.sqrt(variance / self.games)
+        low, high = max(mean - margin, 1e-6), min(mean + margin, 1 - 1e-6)
+        return score_to_elo(mean) + 0.0, (score_to_elo(high) - score_to_elo(low)) / 2  # + 0.0 turns -0.0 into 0.0
+
+    # The llr() method returns the SPRT log-likelihood ratio, using the normal approximation to the trinomial
+    # distribution of win, draw and loss: it grows as the results favour elo1 and falls as they favour elo0.
+    def llr(self):
+        if not self.games:
+            return 0.0
+        mean, variance = self.score()
+        if variance == 0:
+            return 0.0
+        score0, score1 = elo_to_score(self.elo0), elo_to_score(self.elo1)
+        return self.games * (score1 - score0) * (2 * mean - score0 - score1) / (2 * variance)
+
+    # The decision() method returns 'H1' once the first engine is accepted as elo1 stronger, 'H0' once it is accepted
+    # as no more than elo0 stronger, or None while the test goes on.
+    def decision(self):
+        llr = self.llr()
+        if llr >= self.upper_bound:
+            return 'H1'
+        if llr <= self.lower_bound:
+            return 'H0'
+        return None
+
+
+def score_to_elo(score):
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_to_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+# The run_match() function plays a match of up to games games between two EngineSpecs from the openings, alternating
+# colours, with a pool of worker processes. Each finished game is appended to pgn_path and log_path and reported, and
+# the match stops early if sprt is True and the SPRT reaches a decision. It returns the summary that ends the log.
+def run_match(first, second, openings, games, limits, workers=None, pgn_path='match.pgn', log_path='match.jsonl',
+              statistics=None, sprt=True, max_plies=MAX_PLIES, report=print):
+    workers = workers or os.cpu_count() or 1
+    statistics = statistics or MatchStatistics()
+    tasks = []
+    for number in range(games):  # Each opening is played twice in a row, with the colours swapped
+        white, black = (first.name, second.name) if number % 2 == 0 else (second.name, first.name)
+        tasks.append((number + 1, openings[number // 2 % len(openings)], white, black, limits, max_plies))
+    start = time.perf_counter()
+    decision = None
+    with multiprocessing.Pool(workers, start_worker, ([first, second],)) as pool, open(pgn_path, 'a') as pgn_file, \
+            open(log_path, 'a') as log_file:
+        for game in pool.imap_unordered(play_game, tasks):
+            pgn_file.write(game.pop('pgn'))
+            pgn_file.flush()
+            log_file.write(json.dumps(game) + '\n')
+            log_file.flush()
+            score = {'1-0': 1, '0-1': 0}.get(game['result'], 0.5)
+            statistics.add(score if game['white'] == first.name else 1 - score)
+            elo, margin = statistics.elo()
+            minutes = (time.perf_counter() - start) / 60
+            report(f'Game {game["game"]}: {game["white"]} - {game["black"]} {game["result"]} ({game["reason"]}, '
+                   f'{game["plies"]} plies). {first.name} +{statistics.wins} ={statistics.draws} -{statistics.losses}, '
+                   f'Elo {elo:+.1f}{f" +/- {margin:.1f}" if margin is not None else ""}, LLR {statistics.llr():.2f} '
+                   f'[{statistics.lower_bound:.2f}, {statistics.upper_bound:.2f}], '
+                   f'{statistics.games / minutes / workers:.1f} games/min/core')
+            decision = statistics.decision() if sprt else None
+            if decision:
+                pool.terminate()  # The games still being played can't change the decision
+                break
+        elapsed = time.perf_counter() - start
+        elo, margin = statistics.elo()
+        throughput = statistics.games / (elapsed / 60) / workers
+        summary = {'summary': True, 'first': first.name, 'second': second.name, 'games': statistics.games,
+                   'wins': statistics.wins, 'draws': statistics.draws, 'losses': statistics.losses,
+                   'elo': round(elo, 1) if math.isfinite(elo) else str(elo),
+                   'elo_margin': round(margin, 1) if margin is not None else None, 'llr': round(statistics.llr(), 3),
+                   'sprt': [statistics.elo0, statistics.elo1], 'decision': decision, 'seconds': round(elapsed, 1),
+                   'workers': workers, 'games_per_minute_per_core': round(throughput, 2)}
+        log_file.write(json.dumps(summary) + '\n')
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a match between two engines and measure the Elo difference.')
+    parser.add_argument('--engine', action='append', default=[], help='name=module:factory[,option=value...]')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--movetime', type=int, default=None, help='Milliseconds per move')
+    parser.add_argument('--depth', type=int, default=None, help='Depth per move')
+    parser.add_argument('--nodes', type=int, default=None, help='Nodes per move')
+    parser.add_argument('--openings', default=None, help='File of FENs or move lists, or a PGN file')
+    parser.add_argument('--opening-plies', type=int, default=8, help='Moves taken from each game of a PGN suite')
+    parser.add_argument('--sprt', type=float, nargs=2, default=[0.0, 5.0], metavar=('ELO0', 'ELO1'))
+    parser.add_argument('--no-sprt', action='store_true', help='Play every game rather than stopping early')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help='Plies, opening included, before a draw')
+    parser.add_argument('--pgn', default='match.pgn')
+    parser.add_argument('--log', default='match.jsonl')
+    arguments = parser.parse_args()
+    engine_texts = arguments.engine or ['new=chess_search:Search', 'old=chess_search:Search']
+    if len(engine_texts) != 2:
+        sys.exit('Give two engines with --engine')
+    if arguments.movetime is None and arguments.depth is None and arguments.nodes is None:
+        arguments.movetime = 100
+    engine_specs = [EngineSpec(text) for text in engine_texts]
+    if engine_specs[0].name == engine_specs[1].name:
+        sys.exit('The two engines need different names')
+    try:
+        opening_suite = load_openings(arguments.openings, arguments.opening_plies)
+    except ValueError as error:
+        sys.exit(str(error))
+    match_summary = run_match(engine_specs[0], engine_specs[1], opening_suite, arguments.games,
+                              {'time_ms': arguments.movetime, 'depth': arguments.depth, 'nodes': arguments.nodes},
+                              arguments.workers, arguments.pgn, arguments.log,
+                              MatchStatistics(*arguments.sprt), not arguments.no_sprt, arguments.max_plies)
+    print(json.dumps(match_summary))
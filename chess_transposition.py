@@ -0,0 +1,113 @@
+"""This file contains the transposition table: a fixed-size store of what a search has already found out about
+positions, looked up by their Zobrist hash (see chess_zobrist). The same position is often reached by different move
+orders, and the table lets a search reuse the score, depth and best move it found the first time instead of starting
+again.
+
+The table's size is set by a memory budget in megabytes and never grows. Each entry is two 64-bit words held in flat
+arrays (the full hash, to tell positions that share a slot apart, and the packed data), so there is no per-entry
+Python object. Entries are grouped into buckets of two. When a bucket is full, the entry to overwrite is one left over
+from an earlier search (an older age) if there is one, and otherwise the one searched to the lowest depth, since deeper
+results cost more to recreate."""
+
+from array import array
+
+# What the stored score means: the exact score, a lower bound (the search failed high, so the true score is at least
+# this) or an upper bound (the search failed low, so the true score is at most this).
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+ENTRY_BYTES = 16  # One 64-bit word for the hash and one for the data
+BUCKET_SIZE = 2
+
+# The data word packs the best move (17 bits, see chess_board.pack_move), the score offset to be positive (16 bits),
+# the depth (8 bits), the bound (2 bits) and the age of the search that stored it (8 bits).
+SCORE_OFFSET = 1 << 15
+
+
+class TranspositionTable:
+    def __init__(self, megabytes=16):
+        buckets = 1
+        while (buckets * 2) * BUCKET_SIZE * ENTRY_BYTES <= megabytes * 1024 * 1024:
+            buckets *= 2
+        self.bucket_mask = buckets - 1  # A power of two number of buckets, so a bucket is picked with a bit mask
+        self.keys = array('Q', bytes(8 * buckets * BUCKET_SIZE))
+        self.data = array('Q', bytes(8 * buckets * BUCKET_SIZE))
+        self.age = 0
+        self.probes = self.hits = self.stores = self.overwrites = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    # The new_search() method moves the table on to a new age, so that entries from earlier searches are the first to
+    # be replaced. Ages wrap around after 255.
+    def new_search(self):
+        self.age = (self.age + 1) & 255
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * len(self.keys)))
+        self.data = array('Q', bytes(8 * len(self.data)))
+        self.age = 0
+        self.probes = self.hits = self.stores = self.overwrites = 0
+
+    # The probe() method looks a position up by its hash, returning (move, score, depth, bound) if it is stored and
+    # None if it isn't.
+    def probe(self, key):
+        self.probes += 1
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        keys = self.keys
+        for index in (slot, slot + 1):
+            if keys[index] == key:
+                data = self.data[index]
+                if data:
+                    self.hits += 1
+                    return (data & 0x1FFFF, (data >> 17 & 0xFFFF) - SCORE_OFFSET, data >> 33 & 0xFF,
+                            data >> 41 & 3)
+        return None
+
+    # The store() method saves what a search found about a position. An entry for the same position is always updated
+    # (keeping its best move if the new result doesn't have one). Otherwise the replacement policy described at the top
+    # of this file picks which entry in the bucket to overwrite.
+    def store(self, key, move, score, depth, bound):
+        self.stores += 1
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        keys, data = self.keys, self.data
+        if keys[slot] == key:
+            index = slot
+        elif keys[slot + 1] == key:
+            index = slot + 1
+        else:
+            index = min((slot, slot + 1), key=self.replacement_priority)
+            if data[index]:
+                self.overwrites += 1
+        if not move and keys[index] == key:
+            move = data[index] & 0x1FFFF
+        keys[index] = key
+        score = max(-SCORE_OFFSET, min(SCORE_OFFSET - 1, score))
+        data[index] = move | (score + SCORE_OFFSET) << 17 | min(depth, 255) << 33 | bound << 41 | self.age << 43
+
+    # Empty entries are replaced first, then entries from earlier searches, then the shallower of the current ones.
+    def replacement_priority(self, index):
+        data = self.data[index]
+        if not data:
+            return -1
+        entry_age = data >> 43 & 0xFF
+        return ((entry_age - self.age) & 255 == 0) * 256 + (data >> 33 & 0xFF)
+
+    # The hashfull() method estimates how full the table is in permille, from the first thousand entries, as reported
+    # by UCI engines.
+    def hashfull(self):
+        sample = min(1000, len(self.data))
+        return sum(1 for index in range(sample) if self.data[index]) * 1000 // sample
+
+    # The statistics() method returns the counters kept by the table, for sizing it to the machine it runs on.
+    def statistics(self):
+        return {
+            'entries': len(self.keys),
+            'megabytes': len(self.keys) * ENTRY_BYTES / (1024 * 1024),
+            'probes': self.probes,
+            'hits': self.hits,
+            'misses': self.probes - self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'hashfull': self.hashfull()
+        }
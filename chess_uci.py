@@ -0,0 +1,239 @@
+"""This file contains the UCI (Universal Chess Interface) front end, which lets standard chess tools (GUIs, match
+runners, analysis scripts) drive the engine by sending text commands on stdin and reading its replies on stdout.
+It needs nothing but the rules and the search, so it runs without pygame or a display.
+
+The commands understood are uci, isready, ucinewgame, setoption (for the Hash size in megabytes and the BookFile, an
+opening book built by chess_book that is played from before searching), position (startpos or fen, followed by any
+moves in coordinate notation, eg. 'position startpos moves e2e4 e7e5'), go (with wtime, btime, winc, binc, movestogo,
+movetime, depth, nodes, infinite and searchmoves), stop and quit. The search runs in its own thread, so that stop can
+be read while it is thinking.
+
+Engines are often started many times over (eg. one process per game in a match), so the time from starting the process
+to answering isready is kept short: nothing slow is imported, and the transposition table is only allocated when the
+first search starts. Run 'python chess_uci.py --startup' to measure it."""
+
+import subprocess
+import sys
+import threading
+import time
+
+from chess_board import move_name
+from chess_book import OpeningBook
+from chess_game_state import GameState
+from chess_search import Search, MATE_BOUND
+from chess_transposition import TranspositionTable
+
+ENGINE_NAME = 'Chess'
+ENGINE_AUTHOR = 'sben0379'
+DEFAULT_HASH = 16  # Megabytes
+MOVE_OVERHEAD = 30  # Milliseconds kept back from every move for the time taken to send it
+
+
+class UciEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.game = GameState()
+        self.hash_megabytes = DEFAULT_HASH
+        self.book = None  # An OpeningBook, once the BookFile option is set
+        self.search = None  # Made by the first go command, so that startup doesn't wait for the table to be allocated
+        self.search_thread = None
+        self.stop_requested = threading.Event()
+
+    # The send() method writes one line to the GUI. The search thread and the command loop both send lines, so they
+    # take turns through a lock.
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    # The handle() method carries out a single command, returning False when the engine should quit.
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, arguments = words[0], words[1:]
+        if command == 'uci':
+            self.send(f'id name {ENGINE_NAME}')
+            self.send(f'id author {ENGINE_AUTHOR}')
+            self.send(f'option name Hash type spin default {DEFAULT_HASH} min 1 max 1024')
+            self.send('option name BookFile type string default <empty>')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.stop()
+            if self.search is not None:
+                self.search.table.clear()
+            self.game = GameState()
+        elif command == 'setoption':
+            self.set_option(arguments)
+        elif command == 'position':
+            self.stop()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop()
+            self.go(arguments)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'quit':
+            self.stop()
+            return False
+        else:
+            self.send(f'info string unknown command {command}')
+        return True
+
+    # The set_option() method handles 'setoption name Hash value <megabytes>' and 'setoption name BookFile value
+    # <path>' (an opening book built by chess_book, or <empty> for none). Other options, and a Hash value that isn't a
+    # number, are ignored.
+    def set_option(self, arguments):
+        if arguments[:1] != ['name'] or 'value' not in arguments:
+            return
+        name = ' '.join(arguments[1:arguments.index('value')]).lower()
+        value = ' '.join(arguments[arguments.index('value') + 1:])
+        if name == 'hash':
+            try:
+                self.hash_megabytes = max(1, min(1024, int(value)))
+            except ValueError:
+                self.send(f'info string Hash must be a number of megabytes, not {value!r}')
+                return
+            if self.search is not None:
+                self.search.table = TranspositionTable(self.hash_megabytes)
+        elif name == 'bookfile':
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != '<empty>':
+                try:
+                    self.book = OpeningBook(value)
+                except OSError as error:
+                    self.send(f'info string cannot open book: {error}')
+
+    # The set_position() method sets up the position from 'startpos' or 'fen' followed by a FEN string, and plays any
+    # moves after 'moves'. A move that isn't legal stops the list there and is reported, rather than leaving the board
+    # in a broken state.
+    def set_position(self, arguments):
+        end = arguments.index('moves') if 'moves' in arguments else len(arguments)
+        if arguments[:1] == ['startpos']:
+            self.game = GameState()
+        elif arguments[:1] == ['fen']:
+            try:
+                self.game = GameState.from_fen(' '.join(arguments[1:end]))
+            except ValueError as error:
+                self.send(f'info string {error}')
+                return
+        else:
+            self.send('info string position needs startpos or fen')
+            return
+        if 'moves' in arguments:
+            for name in arguments[arguments.index('moves') + 1:]:
+                move = self.find_move(name)
+                if move is None:
+                    self.send(f'info string illegal move {name}')
+                    return
+                self.game.play(move)
+
+    # The find_move() method returns the legal move with the given coordinate notation, or None if there isn't one.
+    def find_move(self, name):
+        for move in self.game.legal_moves():
+            if move_name(move) == name:
+                return move
+        return None
+
+    # The go() method reads the search limits and starts the search in its own thread, which sends info lines as each
+    # depth is finished and bestmove at the end. A limit that isn't a number is reported and ignored.
+    def go(self, arguments):
+        limits, root_moves = {}, None
+        numbers = ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes')
+        for position, word in enumerate(arguments):
+            if word in numbers and position + 1 < len(arguments):
+                try:
+                    limits[word] = int(arguments[position + 1])
+                except ValueError:  # The limit is left out and the search goes ahead with the others
+                    self.send(f'info string ignoring {word} {arguments[position + 1]}: not a number')
+            elif word == 'infinite':
+                limits['infinite'] = True
+            elif word == 'searchmoves':
+                root_moves = [self.find_move(name) for name in arguments[position + 1:]]
+                root_moves = [move for move in root_moves if move is not None] or None
+        if self.book is not None and not limits.get('infinite') and root_moves is None:
+            book_move = self.book.choose_move(self.game)
+            if book_move is not None:
+                self.send(f'bestmove {move_name(book_move)}')
+                return
+        if self.search is None:
+            self.search = Search(megabytes=self.hash_megabytes)
+        self.search.on_info = self.send_info
+        self.stop_requested.clear()
+        self.search_thread = threading.Thread(target=self.think, args=(limits, root_moves), daemon=True)
+        self.search_thread.start()
+
+    def think(self, limits, root_moves):
+        result = self.search.search(self.game, time_budget(limits, self.game.turn), limits.get('depth'),
+                                    limits.get('nodes'), root_moves)
+        if limits.get('infinite'):
+            self.stop_requested.wait()  # An infinite search only gives its move once it is told to stop
+        self.send(f'bestmove {move_name(result.best_move) if result.best_move is not None else "0000"}')
+
+    def send_info(self, result):
+        score = f'mate {result.mate_in()}' if abs(result.score) >= MATE_BOUND else f'cp {result.score}'
+        self.send(f'info depth {result.depth} score {score} nodes {result.nodes} nps {result.nodes_per_second} '
+                  f'time {int(result.elapsed * 1000)} hashfull {self.search.table.hashfull()} '
+                  f'pv {" ".join(move_name(move) for move in result.pv)}')
+
+    # The stop() method stops a running search and waits for it to send its bestmove.
+    def stop(self):
+        if self.search_thread is not None:
+            self.stop_requested.set()
+            self.search.stop()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+# The time_budget() function works out how many milliseconds to search for from the go command's limits, or None if
+# the search has no time limit. With a clock, each move gets an even share of the time left (assuming 30 more moves
+# when movestogo isn't given) plus most of the increment, but never more than half of the time left.
+def time_budget(limits, colour):
+    if 'movetime' in limits:
+        return max(1, limits['movetime'] - MOVE_OVERHEAD)
+    remaining = limits.get('wtime' if colour == 'W' else 'btime')
+    if remaining is None:
+        return None
+    increment = limits.get('winc' if colour == 'W' else 'binc', 0)
+    budget = remaining / limits.get('movestogo', 30) + increment * 3 / 4
+    return max(1, int(min(budget, remaining / 2) - MOVE_OVERHEAD))
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+# The measure_startup() function starts the engine as a new process several times and reports how long it takes to
+# answer isready, which is the delay every new engine process adds.
+def measure_startup(runs=10):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        engine = subprocess.Popen([sys.executable, __file__], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        engine.stdin.write('isready\n')
+        engine.stdin.flush()
+        while engine.stdout.readline().strip() != 'readyok':
+            pass
+        times.append(time.perf_counter() - start)
+        engine.stdin.write('quit\n')
+        engine.stdin.flush()
+        engine.wait()
+    times.sort()
+    print(f'Time to readyok over {runs} runs: median {times[runs // 2] * 1000:.0f}ms, '
+          f'fastest {times[0] * 1000:.0f}ms, slowest {times[-1] * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    if '--startup' in sys.argv:
+        measure_startup()
+    else:
+        main()
@@ -0,0 +1,191 @@
+"""This file checks large PGN game archives by replaying every move of every game. Each move is read from its SAN,
+looked up among the moves GameState generates (whose king safety check is GameState.in_check) and then put to the
+chess_pieces rules as well, so a move is flagged if it can't be read, is illegal or ambiguous, or is rejected by the
+piece rules. Along the way it counts some statistics for each game (its length, result, captures, checks, castling,
+promotions and whether it ended in checkmate or stalemate) and adds them up.
+
+To use more than one core, the file is split into byte ranges ('chunks') of a few megabytes, each starting at the
+beginning of a game (the '[Event ' tag that starts every game in the PGN standard). The chunks are handed out to a
+pool of worker processes, which read their byte range straight from a memory-mapped copy of the file, so no process
+reads more of the file than it needs and nothing is copied between processes but the results. Each chunk's results are
+merged into the totals as they come back, and the summary is written to a small JSON file at the end.
+
+Run it as 'python chess_validate.py games.pgn', with '--workers N' to set the number of processes (the number of cores
+by default), '--chunk-mb M' for the chunk size and '--summary path' for where to write the summary."""
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+from chess_board import EMPTY, CASTLING, EN_PASSANT, board_indices, coordinates
+from chess_pgn import read_games, san_to_move
+from chess_pieces import piece_rules_allow
+
+GAME_START = b'\n[Event '
+LENGTH_BUCKET = 20  # Game lengths are counted in buckets of this many plies
+MAX_ERRORS = 100  # How many errors are kept, for each chunk and in the totals; the rest are only counted
+
+
+# The chunk_ranges() function splits a file into (start, end) byte ranges of about chunk_bytes each, moving each
+# boundary forward to the start of the next game so that no game is split between two chunks.
+def chunk_ranges(path, chunk_bytes):
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            boundary = data.find(GAME_START, min(start + chunk_bytes, size))
+            end = size if boundary < 0 else boundary + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# The game_texts() function yields each game in a byte range of a memory-mapped file as (offset, text).
+def game_texts(data, start, end):
+    while start < end:
+        boundary = data.find(GAME_START, start + 1, end)
+        stop = end if boundary < 0 else boundary + 1
+        yield start, data[start:stop].decode('utf-8', errors='replace')
+        start = stop
+
+
+# The new_totals() function returns the counters that validating a chunk adds to and merge_totals() combines. Only the
+# first MAX_ERRORS errors are kept, so that an archive full of bad games can't fill the memory or the summary, and
+# 'errors_not_kept' counts the others.
+def new_totals():
+    return {'games': 0, 'plies': 0, 'bytes': 0, 'valid_games': 0, 'invalid_games': 0, 'results': {}, 'captures': 0,
+            'checks': 0, 'castles': 0, 'promotions': 0, 'checkmates': 0, 'stalemates': 0, 'lengths': {}, 'errors': [],
+            'errors_not_kept': 0}
+
+
+# The merge_totals() function adds one chunk's totals to the running totals. Chunks can finish in any order, so the
+# merged errors are put in file order before all but the first MAX_ERRORS are dropped.
+def merge_totals(totals, other):
+    for name, value in other.items():
+        if isinstance(value, dict):
+            for key, count in value.items():
+                totals[name][key] = totals[name].get(key, 0) + count
+        else:
+            totals[name] += value
+    if len(totals['errors']) > MAX_ERRORS:
+        totals['errors'].sort(key=lambda error: error['offset'])
+        totals['errors_not_kept'] += len(totals['errors']) - MAX_ERRORS
+        del totals['errors'][MAX_ERRORS:]
+
+
+# The validate_game() function replays a PgnGame and returns its statistics, or raises a ValueError describing the
+# first bad move.
+def validate_game(pgn_game):
+    game = pgn_game.start()
+    captures = checks = castles = promotions = 0
+    for number, san in enumerate(pgn_game.moves):
+        try:
+            move = san_to_move(game, san)
+        except ValueError as error:
+            raise ValueError(f'ply {number + 1} {san}: {error}')
+        origin, destination = coordinates[board_indices[move & 63]], coordinates[board_indices[move >> 6 & 63]]
+        if not piece_rules_allow(game, origin, destination):
+            raise ValueError(f'ply {number + 1} {san}: rejected by the chess_pieces rules in {game.to_fen()}')
+        captures += game.squares[board_indices[move >> 6 & 63]] != EMPTY or move >> 15 == EN_PASSANT
+        castles += move >> 15 == CASTLING
+        promotions += move >> 12 & 7 != 0
+        game.play(move)
+        checks += game.in_check(game.turn)
+    ending = game.outcome()
+    ending = ending[1] if ending and ending[1] in ('checkmate', 'stalemate') else None
+    return len(pgn_game.moves), captures, checks, castles, promotions, ending
+
+
+# The validate_chunk() function runs in a worker process. It validates every game in one byte range of the file and
+# returns the totals for the chunk.
+def validate_chunk(path, start, end):
+    totals = new_totals()
+    totals['bytes'] = end - start
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset, text in game_texts(data, start, end):
+            for pgn_game in read_games(text.splitlines()):
+                totals['games'] += 1
+                totals['results'][pgn_game.result] = totals['results'].get(pgn_game.result, 0) + 1
+                try:
+                    plies, captures, checks, castles, promotions, ending = validate_game(pgn_game)
+                except ValueError as error:
+                    totals['invalid_games'] += 1
+                    if len(totals['errors']) < MAX_ERRORS:
+                        totals['errors'].append({'offset': offset, 'White': pgn_game.headers.get('White', '?'),
+                                                 'Black': pgn_game.headers.get('Black', '?'), 'error': str(error)})
+                    else:
+                        totals['errors_not_kept'] += 1
+                    continue
+                totals['valid_games'] += 1
+                totals['plies'] += plies
+                totals['captures'] += captures
+                totals['checks'] += checks
+                totals['castles'] += castles
+                totals['promotions'] += promotions
+                if ending:
+                    totals[ending + 's'] += 1
+                low = plies // LENGTH_BUCKET * LENGTH_BUCKET
+                bucket = f'{low}-{low + LENGTH_BUCKET - 1}'
+                totals['lengths'][bucket] = totals['lengths'].get(bucket, 0) + 1
+    return totals
+
+
+def validate_chunk_range(arguments):
+    return validate_chunk(*arguments)
+
+
+# The validate_file() function validates a whole PGN file with a pool of worker processes, printing progress as
+# chunks finish, and returns the merged totals. With one worker the chunks are validated in this process.
+def validate_file(path, workers=None, chunk_mb=4, progress=True):
+    workers = workers or os.cpu_count() or 1
+    ranges = chunk_ranges(path, int(chunk_mb * 1024 * 1024))
+    size = os.path.getsize(path)
+    totals = new_totals()
+    start = time.perf_counter()
+    tasks = [(path, chunk_start, chunk_end) for chunk_start, chunk_end in ranges]
+    if workers == 1:
+        results = map(validate_chunk_range, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(validate_chunk_range, tasks)
+    try:
+        for chunk_totals in results:
+            merge_totals(totals, chunk_totals)
+            if progress:
+                elapsed = time.perf_counter() - start
+                print(f'{totals["bytes"] * 100 // max(size, 1)}% ({totals["games"]} games, '
+                      f'{totals["invalid_games"]} invalid), {totals["games"] / elapsed:,.0f} games/sec, '
+                      f'{totals["bytes"] / elapsed / 1024 / 1024:.1f} MB/sec', file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    totals['seconds'] = round(time.perf_counter() - start, 3)
+    totals['games_per_second'] = round(totals['games'] / totals['seconds'], 1) if totals['seconds'] else 0.0
+    totals['workers'] = workers
+    totals['errors'].sort(key=lambda error: error['offset'])
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay and check every game in a PGN file.')
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-mb', type=float, default=4)
+    parser.add_argument('--summary', default=None, help='Where to write the JSON summary (path + .summary.json)')
+    options = parser.parse_args()
+    summary = validate_file(options.path, options.workers, options.chunk_mb)
+    summary_path = options.summary or options.path + '.summary.json'
+    with open(summary_path, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=1)
+    print(f'{summary["games"]} games ({summary["invalid_games"]} invalid) in {summary["seconds"]}s, '
+          f'{summary["games_per_second"]} games/sec with {summary["workers"]} workers. Summary written to '
+          f'{summary_path}')
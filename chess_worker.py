@@ -0,0 +1,137 @@
+"""This file runs the engine in a background process, so that a program with its own event loop (such as the pygame
+GUI in chess_main) can keep responding while the engine thinks.
+
+An EngineWorker starts one process that keeps a Search (and so its transposition table) for the whole game. Commands
+go to it on a queue: search a position for a time or to a depth, ponder (search the position after the move the
+engine expects its opponent to play, for as long as the opponent takes) or quit. Its replies come back on another
+queue: an 'info' reply with a SearchResult for every depth it finishes and a 'bestmove' reply at the end. A thread in
+the calling process reads the replies and passes each one to a callback, so the caller never has to poll; the GUI
+turns them into pygame events.
+
+A search is stopped through a shared Event that the Search checks as it runs, and returns the best move found so far.
+Pondering fills the transposition table: when the opponent's move arrives the ponder search is stopped and a normal
+search started, and if the opponent played the expected move that search finds most of its positions already in the
+table and reaches the ponder search's depth almost at once.
+
+Positions are sent as the game's starting FEN and its moves, so the engine knows the positions played before and can
+see repetitions. Run this file to watch a short search and a ponder search from the starting position."""
+
+import itertools
+import multiprocessing
+import threading
+import time
+
+from chess_board import move_name
+from chess_game_state import GameState
+from chess_search import Search
+
+
+# The engine_process() function is the worker process. It carries out commands until it is told to quit, sending
+# ('info', search_id, pondering, result) for every finished depth and ('bestmove', search_id, pondering, result) when
+# each search ends.
+def engine_process(commands, replies, stop_event, megabytes):
+    search = Search(megabytes=megabytes, stop_event=stop_event)
+    while True:
+        command = commands.get()
+        if command[0] == 'quit':
+            break
+        kind, search_id, fen, moves, time_ms, depth = command
+        game = GameState.from_fen(fen)
+        for move in moves:
+            game.play(move)
+        pondering = kind == 'ponder'
+        search.on_info = lambda result: replies.put(('info', search_id, pondering, result))
+        result = search.search(game, time_ms, depth)
+        replies.put(('bestmove', search_id, pondering, result))
+    replies.put(None)
+
+
+class EngineWorker:
+    # An EngineWorker starts the engine process and a thread that reads its replies and passes each one to
+    # on_reply(reply). It should be closed at the end of the game, or used in a with statement. Only one search runs
+    # at a time: starting a search stops the one before it.
+    def __init__(self, megabytes=16, on_reply=None):
+        self.on_reply = on_reply
+        self.commands = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.idle = threading.Event()  # Set whenever the engine isn't searching
+        self.idle.set()
+        self.search_ids = itertools.count(1)
+        self.process = multiprocessing.Process(target=engine_process, daemon=True,
+                                               args=(self.commands, self.replies, self.stop_event, megabytes))
+        self.process.start()
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def listen(self):
+        while True:
+            reply = self.replies.get()
+            if reply is None:
+                break
+            if reply[0] == 'bestmove':
+                self.idle.set()
+            if self.on_reply:
+                self.on_reply(reply)
+
+    # The search() method starts a search of the position in a GameState, for time_ms milliseconds or to a depth,
+    # and returns its id, which the replies to it carry.
+    def search(self, game, time_ms=None, depth=None):
+        return self.send('search', game, time_ms, depth)
+
+    # The ponder() method starts searching the position after the opponent plays move, with no limit, until it is
+    # stopped.
+    def ponder(self, game, move):
+        game.play(move)
+        try:
+            return self.send('ponder', game, None, None)
+        finally:
+            game.unmake_move()
+
+    def send(self, kind, game, time_ms, depth):
+        self.stop()
+        self.stop_event.clear()
+        self.idle.clear()
+        search_id = next(self.search_ids)
+        self.commands.put((kind, search_id, game.initial_fen, list(game.moves), time_ms, depth))
+        return search_id
+
+    # The stop() method stops the search that is running, if there is one. Its bestmove reply is still sent. With wait
+    # True it waits for that reply; otherwise it returns at once, so that it can be called from an event loop.
+    def stop(self, wait=True):
+        if not self.idle.is_set():
+            self.stop_event.set()
+            if wait:
+                self.idle.wait()
+
+    def close(self):
+        if self.process.is_alive():
+            self.stop()
+            self.commands.put(('quit',))
+            self.process.join()
+        self.listener.join()
+
+
+if __name__ == '__main__':
+    def show(reply):
+        kind, search_id, pondering, result = reply
+        print(f'{kind} {search_id}{" (pondering)" if pondering else ""}: {result}')
+
+    with EngineWorker(on_reply=show) as worker:
+        position = GameState()
+        start = time.perf_counter()
+        worker.search(position, time_ms=1000)
+        print(f'search started in {(time.perf_counter() - start) * 1000:.1f}ms, the caller is free meanwhile')
+        worker.idle.wait()
+        position.play(next(move for move in position.legal_moves() if move_name(move) == 'e2e4'))
+        worker.ponder(position, next(move for move in position.legal_moves() if move_name(move) == 'e7e5'))
+        time.sleep(1)
+        start = time.perf_counter()
+        worker.stop()
+        print(f'ponder search stopped in {(time.perf_counter() - start) * 1000:.1f}ms')
@@ -0,0 +1,50 @@
+"""This file contains the random keys used to give every position a 64-bit Zobrist hash. Each (piece, square) pair, each
+combination of castling rights, each en passant file and the side to move has its own random 64-bit key, and a
+position's hash is all of the keys that apply to it XORed together. Because XOR undoes itself, a move only has to XOR
+out the keys that no longer apply and XOR in the new ones, so GameState can keep its hash up to date as it goes rather
+than rebuilding it. The keys come from a fixed seed, so the same position has the same hash in every process and in
+every run, which is what lets hashes be shared between processes or stored in files (eg. an opening book)."""
+
+import random
+
+from chess_board import EMPTY, BLACK, KING, ALL_CASTLING, board_indices, coordinates
+
+key_generator = random.Random(20240601)
+
+# piece_keys[code][index] is the key for the piece with that code standing on that mailbox index. The entries for
+# empty and off-board squares are 0, so a square can be updated by XORing out its old code's key and in its new one.
+piece_keys = [[0] * 120 for _ in range(BLACK | KING + 1)]
+for code in range(1, BLACK | KING + 1):
+    if code & 7:
+        for index in board_indices:
+            piece_keys[code][index] = key_generator.getrandbits(64)
+
+# There is one key for each of the four castling rights, and castling_keys[rights] is the XOR of the keys for the
+# rights that are set, so changing the rights costs a single XOR whatever has changed.
+castling_right_keys = [key_generator.getrandbits(64) for _ in range(4)]
+castling_keys = [0] * (ALL_CASTLING + 1)
+for rights in range(ALL_CASTLING + 1):
+    for bit in range(4):
+        if rights >> bit & 1:
+            castling_keys[rights] ^= castling_right_keys[bit]
+
+# en_passant_keys[index] is the key for the file of an en passant square at that mailbox index, and 0 for index 0
+# (no en passant square).
+file_keys = [key_generator.getrandbits(64) for _ in range(8)]
+en_passant_keys = [file_keys[coordinates[index][1]] if coordinates[index] else 0 for index in range(120)]
+
+black_to_move_key = key_generator.getrandbits(64)
+
+
+# The position_hash() function works out a GameState's hash from scratch. GameState uses it when a position is set up
+# and then keeps the hash up to date move by move.
+def position_hash(game):
+    key = 0
+    for index in board_indices:
+        code = game.squares[index]
+        if code != EMPTY:
+            key ^= piece_keys[code][index]
+    key ^= castling_keys[game.castling] ^ en_passant_keys[game.en_passant]
+    if game.turn == 'B':
+        key ^= black_to_move_key
+    return key
@@ -0,0 +1,50 @@
+"""Tests for the move generators: the bitboard generator, GameState.legal_moves() and the chess_pieces rules must agree
+in every position of some random games, GameState's bitboards must stay in step with its board, and both must give
+the reference perft counts. Run with pytest."""
+
+import random
+
+import pytest
+
+from chess_bitboard import BitboardPosition, cross_check
+from chess_game_state import GameState
+from chess_perft import reference_positions
+
+MAX_NODES = 100000  # Deeper counts take too long for a test run, and are checked by chess_perft.py
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_generators_agree_in_random_games(seed):
+    assert cross_check(games=2, seed=seed, max_moves=80) == []
+
+
+def same_position(bitboards, other):
+    return (bitboards.pieces, bitboards.occupancy, bitboards.squares) == (other.pieces, other.occupancy, other.squares)
+
+
+def test_bitboards_follow_moves_taken_back_and_copies():
+    generator = random.Random(5)
+    game = GameState.from_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+    start = BitboardPosition.from_game_state(game)
+    for _ in range(60):
+        moves = game.legal_moves()
+        if not moves:
+            break
+        game.play(generator.choice(moves))
+        assert same_position(game.bitboards, BitboardPosition.from_game_state(game))
+        assert same_position(game.future_board().bitboards, game.bitboards)
+    while game.moves:
+        game.unmake_move()
+    assert same_position(game.bitboards, start)
+
+
+@pytest.mark.parametrize('name', list(reference_positions))
+@pytest.mark.parametrize('bitboard', [False, True])
+def test_perft_reference_counts(name, bitboard):
+    setup, expected_counts = reference_positions[name]
+    for depth, expected in sorted(expected_counts.items()):
+        if expected > MAX_NODES:
+            break
+        game = setup()
+        position = BitboardPosition.from_game_state(game) if bitboard else game
+        assert position.perft(depth) == expected, f'{name} depth {depth}'
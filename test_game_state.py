@@ -0,0 +1,110 @@
+"""Tests for GameState: FEN strings for positions that can't arise in a game are rejected, the 2D view of the board
+follows the moves but can't be written to, copies can take back the moves played before them, and games are found to
+have ended by checkmate, stalemate, insufficient material, the fifty-move rule or threefold repetition. Run with
+pytest."""
+
+import pytest
+
+from chess_board import move_name
+from chess_game_state import GameState
+
+
+# The play() function plays moves given in coordinate notation, eg. 'e2e4'.
+def play(game, *names):
+    for name in names:
+        game.play(next(move for move in game.legal_moves() if move_name(move) == name))
+
+
+@pytest.mark.parametrize('fen, message', [
+    ('8/8/8/8/8/8/8/4K3 w - - 0 1', 'one black king'),
+    ('4k3/8/8/8/8/8/8/4K2K w - - 0 1', 'one white king'),
+    ('4k3/8/8/3pP3/8/8/8/4K3 w - d3 0 1', 'en passant'),
+    ('4k3/8/8/8/3Pp3/8/8/4K3 b - d6 0 1', 'en passant'),
+    ('k7/8/1K6/8/8/8/8/7Q w - - 0 1', 'not to move is in check'),
+    ('k7/1K6/8/8/8/8/8/8 w - - 0 1', 'next to each other'),
+    ('8/8/8/3kK3/8/8/8/8 b - - 0 1', 'next to each other'),
+])
+def test_impossible_positions_are_rejected(fen, message):
+    with pytest.raises(ValueError, match=message):
+        GameState.from_fen(fen)
+
+
+@pytest.mark.parametrize('fen', [
+    'k7/8/1K6/8/8/8/8/7Q b - - 0 1',
+    '4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1',
+    '4k3/8/8/8/3Pp3/8/8/4K3 b - d3 0 1',
+    'k7/8/K7/8/8/8/8/8 w - - 0 1',
+])
+def test_possible_positions_are_read(fen):
+    assert GameState.from_fen(fen).to_fen() == fen
+
+
+def test_board_view_is_read_only():
+    game = GameState()
+    with pytest.raises(TypeError):
+        game.board[4][4] = 'WQ'
+    with pytest.raises(TypeError):
+        game.board[4] = ['~~'] * 8
+    play(game, 'e2e4')
+    assert (game.board[6][4], game.board[4][4]) == ('~~', 'WP')
+    game.unmake_move()
+    assert (game.board[6][4], game.board[4][4]) == ('WP', '~~')
+
+
+def test_copy_can_take_back_moves():
+    game = GameState()
+    play(game, 'e2e4', 'd7d5', 'e4d5', 'g8f6')
+    fen = game.to_fen()
+    copy = game.future_board()
+    while copy.moves:
+        copy.unmake_move()
+    assert copy.to_fen() == GameState().to_fen() and copy.hash == GameState().hash
+    assert game.to_fen() == fen and len(game.moves) == 4
+
+
+@pytest.mark.parametrize('fen, outcome', [
+    ('rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3', ('0-1', 'checkmate')),
+    ('k6R/8/1K6/8/8/8/8/8 b - - 100 80', ('1-0', 'checkmate')),  # A mate on the fiftieth move still wins
+    ('k7/8/1Q6/8/8/8/8/7K b - - 0 1', ('1/2-1/2', 'stalemate')),
+    ('k7/8/8/8/8/8/8/1R5K w - - 100 80', ('1/2-1/2', 'fifty-move rule')),
+    ('k7/8/8/8/8/8/8/1R5K w - - 99 80', None),
+    ('k7/8/8/8/8/8/8/K1B2b2 w - - 0 1', None),
+    ('k7/8/8/8/5b2/8/8/K1B5 w - - 0 1', ('1/2-1/2', 'insufficient material')),
+])
+def test_outcome(fen, outcome):
+    assert GameState.from_fen(fen).outcome() == outcome
+
+
+def test_threefold_repetition():
+    game = GameState()
+    play(game, 'g1f3', 'g8f6', 'f3g1', 'f6g8')
+    assert game.is_repetition() and game.outcome() is None
+    play(game, 'g1f3', 'g8f6', 'f3g1', 'f6g8')
+    assert game.outcome() == ('1/2-1/2', 'threefold repetition')
+    game.unmake_move()
+    assert game.outcome() is None
+
+
+@pytest.mark.parametrize('fen, insufficient', [
+    ('k7/8/8/8/8/8/8/K7 w - - 0 1', True),
+    ('k7/8/8/8/8/8/8/K1B5 w - - 0 1', True),
+    ('k7/8/8/8/8/8/8/K1N5 w - - 0 1', True),
+    ('k7/8/8/8/5b2/8/8/K1B5 w - - 0 1', True),  # Bishops on squares of the same colour
+    ('k7/8/8/8/8/8/8/K1B1B3 w - - 0 1', True),
+    ('k7/8/8/8/8/8/8/K1B2b2 w - - 0 1', False),  # Bishops on squares of different colours
+    ('k7/8/8/8/8/8/8/K1N1N3 w - - 0 1', False),
+    ('k7/8/8/8/8/8/8/K1B1N3 w - - 0 1', False),
+    ('k7/8/8/8/8/8/P7/K7 w - - 0 1', False),
+])
+def test_insufficient_material(fen, insufficient):
+    assert GameState.from_fen(fen).insufficient_material() == insufficient
+
+
+def test_has_legal_move():
+    assert GameState().has_legal_move()
+    stalemate = GameState.from_fen('k7/8/1Q6/8/8/8/8/7K b - - 0 1')
+    assert not stalemate.has_legal_move() and stalemate.has_legal_move('W')
+    checkmate = GameState.from_fen('rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3')
+    assert not checkmate.has_legal_move() and checkmate.has_legal_move('B')
+    pinned = GameState.from_fen('k7/8/8/8/8/8/r7/K1r5 w - - 0 1')  # Only Kxa2 is legal
+    assert pinned.has_legal_move() and [move_name(move) for move in pinned.legal_moves()] == ['a1a2']
@@ -0,0 +1,39 @@
+"""Tests for the engine-match runner: games are adjudicated at the same length whatever the opening, and a bad opening
+is reported when the suite is loaded rather than ending the match early. Run with pytest."""
+
+import pytest
+
+from chess_game_state import starting_fen
+from chess_tournament import EngineSpec, load_openings, play_game, start_worker
+
+LIMITS = {'time_ms': None, 'depth': 1, 'nodes': None}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def engines():
+    start_worker([EngineSpec('first=chess_search:Search,megabytes=1'),
+                  EngineSpec('second=chess_search:Search,megabytes=1')])
+
+
+@pytest.mark.parametrize('opening', [[], ['e2e4', 'e7e5'], ['d2d4', 'd7d5', 'c2c4', 'e7e6', 'b1c3']])
+def test_max_plies_counts_the_opening(opening):
+    game = play_game((1, (starting_fen, opening), 'first', 'second', LIMITS, 8))
+    assert (game['plies'], game['reason']) == (8, 'adjudication')
+
+
+def test_illegal_opening_move_raises_value_error():
+    with pytest.raises(ValueError, match='e2e5'):
+        play_game((1, (starting_fen, ['e2e5']), 'first', 'second', LIMITS, 8))
+
+
+def test_load_openings_names_the_bad_line(tmp_path):
+    path = tmp_path / 'openings.txt'
+    path.write_text('e2e4 e7e5\ne2e5 e7e5  # not a legal move\nd2d4 d7d5\n')
+    with pytest.raises(ValueError, match='line 2'):
+        load_openings(str(path))
+
+
+def test_load_openings_reads_moves_and_fens(tmp_path):
+    path = tmp_path / 'openings.txt'
+    path.write_text('# a comment\ne2e4 e7e5\n4k3/8/8/8/8/8/4P3/4K3 w - -\n')
+    assert load_openings(str(path)) == [(starting_fen, ['e2e4', 'e7e5']), ('4k3/8/8/8/8/8/4P3/4K3 w - - 0 1', [])]
@@ -0,0 +1,28 @@
+"""Tests for the PGN archive validator: captures are counted from the board rather than the move text, and only the
+first MAX_ERRORS errors are kept, in file order, however the file is split into chunks. Run with pytest."""
+
+import chess_validate
+from chess_pgn import PgnGame
+from chess_validate import merge_totals, new_totals, validate_chunk, validate_game
+
+
+def test_captures_are_counted_from_the_board():
+    # 'ed5' captures without an 'x', 'dxc6' captures en passant and 'Nxf6' and 'Nxf3' have an 'x' but capture nothing
+    game = PgnGame({}, ['e4', 'd5', 'ed5', 'c5', 'dxc6', 'Nxf6', 'Nxf3'], '*')
+    plies, captures = validate_game(game)[:2]
+    assert (plies, captures) == (7, 2)
+
+
+def test_only_the_first_errors_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(chess_validate, 'MAX_ERRORS', 2)
+    path = tmp_path / 'games.pgn'
+    path.write_text(''.join(f'[Event "{number}"]\n[White "W{number}"]\n[Result "*"]\n\n1. e4 e5 2. Ke3 *\n\n'
+                            for number in range(10)))
+    middle = path.read_bytes().index(b'\n[Event "5"]') + 1
+    first, second = validate_chunk(str(path), 0, middle), validate_chunk(str(path), middle, path.stat().st_size)
+    assert (len(first['errors']), first['errors_not_kept']) == (2, 3)
+    totals = new_totals()
+    merge_totals(totals, second)  # Chunks can finish in any order
+    merge_totals(totals, first)
+    assert [error['White'] for error in totals['errors']] == ['W0', 'W1']
+    assert (totals['invalid_games'], totals['errors_not_kept']) == (10, 8)